@@ -1,4 +1,5 @@
 import configparser
+import datetime
 
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
@@ -6,6 +7,7 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import (
     create_engine,
     inspect,
+    text,
 )
 
 from database.models import ( #todo починить, заменив все на абсолютные импорты из app
@@ -15,22 +17,35 @@ from database.models import ( #todo починить, заменив все на
 
 
 db_confing = 'app/database.conf'
-config = configparser.ConfigParser()
-config.read(db_confing)
 
 
 Base = declarative_base()
-engine = create_engine(
-    f"postgresql+psycopg2://"
-    f"{config.get('postgresql', 'user')}:{config.get('postgresql', 'password')}@"
-    f"{config.get('postgresql', 'host')}:{config.get('postgresql', 'port')}/"
-    f"{config.get('postgresql', 'dbname')}"
-)
+engine = None
+
+
+def get_engine():
+    """Движок БД создается при первом обращении, а не при импорте модуля."""
+
+    global engine
+
+    if engine is None:
+        config = configparser.ConfigParser()
+        config.read(db_confing)
+
+        engine = create_engine(
+            f"postgresql+psycopg2://"
+            f"{config.get('postgresql', 'user')}:{config.get('postgresql', 'password')}@"
+            f"{config.get('postgresql', 'host')}:{config.get('postgresql', 'port')}/"
+            f"{config.get('postgresql', 'dbname')}"
+        )
+
+    return engine
 
 
 def check_db():
     """Проверка наличия в БД таблиц."""
 
+    engine = get_engine()
     inspector = inspect(engine)
     analytics_exists = inspector.has_table(Analytics.__tablename__)
     specialists_exists = inspector.has_table(Specialists.__tablename__)
@@ -44,4 +59,56 @@ def check_db():
 
 def get_session():
     """Создаем сессию для работы с базой данных."""
-    return sessionmaker(bind=engine)()
+    return sessionmaker(bind=get_engine())()
+
+
+def _child_tables(session, table):
+    return set(session.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = :table
+    """), {"table": table}).scalars())
+
+
+def ensure_month_partitions(session, dates):
+    """Создание недостающих помесячных секций аналитик под даты выполнения в текущей транзакции.
+
+    Таблицу аналитик секционирует по месяцам app_v3. Запись за месяц без секции попала бы
+    в секцию по умолчанию, и создать секцию этого месяца потом было бы нельзя. Месяцы,
+    перенесенные app_v3 в холодную таблицу, только читаются - их записи не загружаются.
+
+    Returns:
+        list[str]: Имена созданных секций
+    """
+
+    table = Analytics.__tablename__
+    partitioned = session.execute(
+        text("SELECT relkind = 'p' FROM pg_class WHERE relname = :table"), {"table": table},
+    ).scalar()
+
+    if not partitioned:
+        return []
+
+    existing = _child_tables(session, table)
+    archived = _child_tables(session, f"{table}_cold")
+    created = []
+
+    for month in sorted({datetime.date(day.year, day.month, 1) for day in dates if day}):
+        suffix = f"_y{month.year}m{month.month:02d}"
+
+        if f"{table}_cold{suffix}" in archived:
+            raise ValueError(f"Аналитики за {month:%m.%Y} перенесены в холодную таблицу и не загружаются")
+
+        if f"{table}{suffix}" in existing:
+            continue
+
+        next_month = datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+        session.execute(text(
+            f"CREATE TABLE {table}{suffix} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+        ))
+        created.append(f"{table}{suffix}")
+
+    return created
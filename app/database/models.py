@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer
+from sqlalchemy import Column, Date, Numeric, String, Integer
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -11,7 +11,7 @@ class Analytics(Base):
     registration_number = Column(String, nullable=True, comment='Рег.№')
     full_name = Column(String, nullable=True, comment='ФИО')
     gender = Column(String, nullable=True, comment='Пол')
-    age = Column(String, nullable=True, comment='Возр.')
+    age = Column(Integer, nullable=True, comment='Возр.')
     okmu_code = Column(String, nullable=True, comment='Код ОКМУ')
     service = Column(String, nullable=True, comment='Услуга')
     first_name = Column(String, nullable=True, comment='Имя')
@@ -21,7 +21,7 @@ class Analytics(Base):
     admission_purpose = Column(String, nullable=True, comment='Цель поступления')
     episode_number = Column(String, nullable=True, comment='№_эпизода')
     appointment_type = Column(String, nullable=True, comment='Тип назначения')
-    appointment_date = Column(String, nullable=True, comment='Дата выполнения назначения')
+    appointment_date = Column(Date, nullable=True, comment='Дата выполнения назначения')
     appointment_time = Column(String, nullable=True, comment='Время назначения')
     underperformance = Column(String, nullable=True, comment='Недовыполнение')
     status = Column(String, nullable=True, comment='Состояние')
@@ -33,10 +33,10 @@ class Analytics(Base):
     specialist_specialization = Column(String, nullable=True, comment='Специализация исполнителя')
     hospitalization_department = Column(String, nullable=True, comment='Отделение госпитализации')
     tariff = Column(String, nullable=True, comment='Тариф')
-    price = Column(String, nullable=True, comment='Цена')
+    price = Column(Numeric(14, 2), nullable=True, comment='Цена')
     discount_percent = Column(String, nullable=True, comment='%Ск-ки')
-    total_amount = Column(String, nullable=True, comment='Сумма')
-    debt = Column(String, nullable=True, comment='Долг')
+    total_amount = Column(Numeric(14, 2), nullable=True, comment='Сумма')
+    debt = Column(Numeric(14, 2), nullable=True, comment='Долг')
     specialist_full_name = Column(String, nullable=True, comment='ФИО специалист')
     attending_physician = Column(String, nullable=True, comment='Лечащий врач')
     complex_code = Column(String, nullable=True, comment='Код комплекса')
@@ -51,10 +51,14 @@ class Analytics(Base):
     email = Column(String, nullable=True, comment='Электронная почта')
     middle_name = Column(String, nullable=True, comment='Отчество')
     episode_end_date = Column(String, nullable=True, comment='Дата завершения эпизода')
-    date = Column(String, nullable=True, comment='Дата')
-    birth_date = Column(String, nullable=True, comment='ДР')
+    date = Column(Date, nullable=True, comment='Дата')
+    birth_date = Column(Date, nullable=True, comment='ДР')
     paid_destination_num = Column(String, nullable=True, comment='Номер оплачиваемого назначения')
     instance_code = Column(String, nullable=True, comment='%Код экземпляра')
+    # Ключ секционирования: дата выполнения назначения в виде даты
+    execution_date = Column(Date, nullable=True)
+    # Запуск загрузки, добавивший строку или последним ее изменивший
+    load_run_id = Column(Integer, nullable=True)
 
 
 class Specialists(Base):
@@ -7,11 +7,13 @@ import urllib3
 import pandas as pd
 import requests
 
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
 from typing import Any
 from pandas import NaT
-from sqlalchemy import select
+from sqlalchemy import ARRAY, Date, String, any_, bindparam, delete, or_, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
-from database.db_manager import get_session
+from database.db_manager import ensure_month_partitions, get_session
 from database.models import Analytics, Specialists
 from enums import ANALYTICS, ANALYTICS_TO_BITRIX, SPECIALISTS, BitrixDealsEnum
 
@@ -29,48 +31,32 @@ class SQLManager:
         self.messages = messages
 
     def process_analytics(self, df, from_scratch=False):
-        """Загрузка аналитик. Грузим без проверки уникальности, т.к. нет возможности её проверить."""
+        """Загрузка аналитик с обновлением по коду экземпляра и дате выполнения.
+
+        Повторная загрузка той же выгрузки не плодит дублей и без from_scratch.
+        """
 
         initial_count = df.shape[0]
         self.logger.info(f"[SQLManager] Начало обработки аналитик: {initial_count} записей")
 
-        # Фильтрация тестовых пациентов
-        len_df = df.shape[0]
-        df = df[df["Категория пациента"] != "Тестовый пациент"]
-        skipped_rows = len_df - df.shape[0]
+        df.columns = df.columns.str.strip()
 
-        if skipped_rows > 0:
-            msg = f"Пропущено тестовых пациентов: {skipped_rows}"
-            self._add_message(msg)
-            self.logger.info(f"[SQLManager] {msg}")
+        # Все фильтры считаются одной маской, записи отбираются за один проход
+        mask = self._filter_mask([
+            # Фильтрация тестовых пациентов
+            ("тестовых пациентов", df["Категория пациента"] != "Тестовый пациент"),
+            # Фильтрация служебных услуг
+            ("служебных услуг", ~df["Код ОКМУ"].str.startswith("Q", na=False)),
+            # Фильтрация по статусу
+            ("записей с неактуальными статусами", df["Состояние"].isin(["выполнено", "авторизован"])),
+        ])
 
         # Выбор и переименование колонок
-        columns_to_keep = [col for col in [col.strip() for col in df.columns] if col in ANALYTICS]
-        df.columns = df.columns.str.strip()
-        df = df[columns_to_keep]
+        columns_to_keep = [col for col in df.columns if col in ANALYTICS]
+        df = df.loc[mask, columns_to_keep]
         df = df.rename(columns=ANALYTICS)
         df = df.where(pd.notna(df), None)
 
-        # Фильтрация служебных услуг
-        len_df = df.shape[0]
-        df = df[~df['okmu_code'].str.startswith('Q', na=False)]
-        skipped_rows = len_df - df.shape[0]
-
-        if skipped_rows > 0:
-            msg = f"Пропущено служебных услуг: {skipped_rows}"
-            self._add_message(msg)
-            self.logger.info(f"[SQLManager] {msg}")
-
-        # Фильтрация по статусу
-        len_df = df.shape[0]
-        df = df[df["status"].isin(["выполнено", "авторизован"])]
-        skipped_rows = len_df - df.shape[0]
-
-        if skipped_rows > 0:
-            msg = f"Пропущено записей с неактуальными статусами: {skipped_rows}"
-            self._add_message(msg)
-            self.logger.info(f"[SQLManager] {msg}")
-
         # Обработка поля age - извлекаем только цифры
         if "age" in df.columns:
             df["age"] = df["age"].apply(
@@ -103,8 +89,9 @@ class SQLManager:
 
         if from_scratch:
             # Удаляем перезаписываемые записи
+            # Коды передаются одним параметром-массивом, а не IN-списком из сотен тысяч параметров
             instance_codes = list(df['instance_code'])
-            _filter = Analytics.instance_code.in_(instance_codes)
+            _filter = Analytics.instance_code == any_(bindparam("instance_codes", instance_codes, type_=ARRAY(String)))
             deleted_count = self.session.query(Analytics).filter(_filter).delete(synchronize_session=False)
 
             if deleted_count > 0:
@@ -112,9 +99,29 @@ class SQLManager:
                 self._add_message(msg)
                 self.logger.info(f"[SQLManager] {msg}")
 
-        records_to_insert = df.to_dict("records")
+        # В БД суммы, даты и возраст типизированы, а в Bitrix дальше уходит исходный дата-фрейм
+        typed = self._typed_analytics(df.copy())
+
+        # Из повторов кода экземпляра за дату выполнения остается последняя запись выгрузки,
+        # записи без кода или даты ключа не имеют и не схлопываются
+        keyed = (typed["instance_code"].fillna("") != "") & typed["execution_date"].notna()
+        duplicates = keyed & typed.duplicated(["instance_code", "execution_date"], keep="last")
+
+        if duplicates.any():
+            msg = f"Пропущено повторов кода экземпляра за дату: {int(duplicates.sum())}"
+            self._add_message(msg)
+            self.logger.info(f"[SQLManager] {msg}")
+
+        records_to_insert = typed[~duplicates].to_dict("records")
         self.messages['statistics']['analytics']['records'] = len(records_to_insert)
-        self._bulk_upload(Analytics, records_to_insert, "аналитикам")
+
+        # Секции месяцев создаются до вставки, в транзакции первого чанка
+        created = ensure_month_partitions(self.session, [record.get("execution_date") for record in records_to_insert])
+
+        if created:
+            self.logger.info(f"[SQLManager] Созданы секции аналитик: {', '.join(created)}")
+
+        self._upsert_analytics(records_to_insert)
 
         return df
 
@@ -171,6 +178,26 @@ class SQLManager:
             self.messages['statistics']['specialists']['records'] = len(records_to_insert)
             self._bulk_upload(Specialists, records_to_insert, "специалистам")
 
+    def _filter_mask(self, rules):
+        """Объединение правил фильтрации в одну маску с подсчетом отброшенных каждым правилом записей."""
+
+        mask = None
+
+        for description, rule_mask in rules:
+            if mask is None:
+                skipped_rows = int((~rule_mask).sum())
+                mask = rule_mask
+            else:
+                skipped_rows = int((mask & ~rule_mask).sum())
+                mask = mask & rule_mask
+
+            if skipped_rows > 0:
+                msg = f"Пропущено {description}: {skipped_rows}"
+                self._add_message(msg)
+                self.logger.info(f"[SQLManager] {msg}")
+
+        return mask
+
     def _bulk_upload(self, model, records, entity):
         """Массовая загрузка записей в БД."""
         
@@ -199,6 +226,78 @@ class SQLManager:
             self.logger.error(f"[SQLManager] {err}", exc_info=True)
             raise
 
+    def _upsert_analytics(self, records):
+        """Загрузка аналитик через INSERT ... ON CONFLICT по коду экземпляра и дате выполнения.
+
+        Опирается на частичный уникальный индекс (instance_code, execution_date), который создают
+        миграции app_v3. Записи без кода или даты этим индексом не ограничены: прежние такие записи
+        за даты выгрузки удаляются в транзакции первого чанка и вставляются заново.
+        """
+
+        table = Analytics.__table__
+        keyed = [record for record in records if record.get("instance_code") and record.get("execution_date")]
+        plain = [record for record in records if not (record.get("instance_code") and record.get("execution_date"))]
+
+        try:
+            total_rows = len(records)
+            chunk_size = 50000
+            self.logger.info(f"[SQLManager] Начало загрузки {total_rows} записей по аналитикам с обновлением (чанки по {chunk_size})")
+
+            days = {record.get("execution_date") for record in records}
+            codeless = or_(table.c.instance_code.is_(None), table.c.instance_code == "")
+            dated = [day for day in days if day is not None]
+            deleted = 0
+
+            if dated:
+                deleted += self.session.execute(
+                    delete(table).where(codeless, table.c.execution_date == any_(bindparam("days", dated, type_=ARRAY(Date))))
+                ).rowcount
+
+            if None in days:
+                deleted += self.session.execute(delete(table).where(codeless, table.c.execution_date.is_(None))).rowcount
+
+            if deleted > 0:
+                msg = f"Удалено старых записей аналитик без кода экземпляра: {deleted}"
+                self._add_message(msg)
+                self.logger.info(f"[SQLManager] {msg}")
+
+            chunks = []
+
+            if keyed:
+                statement = pg_insert(table)
+                updated_columns = [column for column in keyed[0] if column not in ("instance_code", "execution_date")]
+                statement = statement.on_conflict_do_update(
+                    index_elements=[table.c.instance_code, table.c.execution_date],
+                    index_where=text("instance_code <> ''"),
+                    set_={column: statement.excluded[column] for column in updated_columns},
+                )
+                chunks += [(statement, keyed[i:i + chunk_size]) for i in range(0, len(keyed), chunk_size)]
+
+            chunks += [(table.insert(), plain[i:i + chunk_size]) for i in range(0, len(plain), chunk_size)]
+            loaded = 0
+
+            for query, chunk in chunks:
+                self.session.execute(query, chunk)
+                self.session.commit()
+                loaded += len(chunk)
+
+                print(f"\r[SQLManager] Загрузка: {loaded}/{total_rows} записей...", end="", flush=True)
+
+            # Удаление и создание секций фиксируются и при выгрузке без записей
+            self.session.commit()
+
+            print()
+            msg = f"Загружено записей по аналитикам: {total_rows}"
+            self._add_message(msg)
+            self.logger.info(f"[SQLManager] {msg}")
+        except Exception as e:
+            self.session.rollback()
+
+            err = f"Ошибка при загрузке данных по аналитикам: {str(e)}"
+            self._add_error(err)
+            self.logger.error(f"[SQLManager] {err}", exc_info=True)
+            raise
+
     def _add_message(self, message: str) -> None:
         """Добавить сообщение в отчёт."""
         self.messages['messages'].append(message)
@@ -218,6 +317,48 @@ class SQLManager:
         else:
             return None
 
+    @staticmethod
+    def _parse_amount(value):
+        """Сумма с двумя знаками под колонку numeric(14, 2). Нераспознанные и не помещающиеся - None."""
+
+        try:
+            amount = Decimal(value).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+        except (InvalidOperation, ValueError):
+            return None
+
+        return amount if amount.is_finite() and abs(amount) < 10 ** 12 else None
+
+    @staticmethod
+    def _typed_analytics(df):
+        """Приведение сумм, дат и возраста к типам колонок аналитик. Нераспознанные значения - None."""
+
+        for col in ["price", "total_amount", "debt"]:
+            if col in df.columns:
+                cleaned = (
+                    df[col].astype(str)
+                    .str.replace("\xa0", "", regex=False)
+                    .str.replace(" ", "", regex=False)
+                    .str.replace(",", ".", regex=False)
+                )
+                # Суммы разбираются в Decimal, а не во float - без двоичной погрешности в копейках
+                df[col] = pd.Series([SQLManager._parse_amount(x) for x in cleaned], index=df.index, dtype=object)
+
+        for col in ["date", "appointment_date", "birth_date"]:
+            if col in df.columns:
+                parsed = pd.to_datetime(df[col], format="%d.%m.%Y", errors="coerce")
+                parsed = parsed.fillna(pd.to_datetime(df[col], format="%d.%m.%y", errors="coerce"))
+                df[col] = pd.Series([None if pd.isna(x) else x.date() for x in parsed], index=df.index, dtype=object)
+
+        if "age" in df.columns:
+            values = [None if x == "" or pd.isna(x) else int(x) for x in df["age"]]
+            df["age"] = pd.Series(values, index=df.index, dtype=object)
+
+        # Дата выполнения - ключ секционирования таблицы аналитик, без нее строку некуда вставить
+        if "appointment_date" in df.columns:
+            df["execution_date"] = df["appointment_date"]
+
+        return df
+
 
 class BitrixManager:
     HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
@@ -1,18 +1,24 @@
+from typing import Iterator
+
 from sqlalchemy.orm import Session
-from app_v2.database.models import Analytics
-from sqlalchemy import func
-from sqlalchemy import Integer
+from app_v2.database.models import Analytics, cosmetology_totals
+from app_v2.database.streaming import DEFAULT_BATCH_SIZE, stream_batches
+from sqlalchemy import func, select
+from sqlalchemy import ARRAY, Row, String, any_, bindparam
 
 class AnalyticsRepository:
     def __init__(self, db: Session):
         self.db = db
 
     def insert_many(self, records: list[dict]):
+        # Дата выполнения - ключ секционирования таблицы аналитик
+        records = [{"execution_date": record.get("appointment_date"), **record} for record in records]
         self.db.bulk_insert_mappings(Analytics, records)
         self.db.commit()
 
     def delete_by_instance_codes(self, instance_codes: list[str]) -> int:
-        res = self.db.query(Analytics).filter(Analytics.instance_code.in_(instance_codes)).delete(synchronize_session=False)
+        codes = bindparam("instance_codes", list(instance_codes), type_=ARRAY(String))
+        res = self.db.query(Analytics).filter(Analytics.instance_code == any_(codes)).delete(synchronize_session=False)
         self.db.commit()
         return res
 
@@ -28,22 +34,33 @@ class AnalyticsRepository:
     def get_all(self):
         return self.db.query(Analytics).all()
 
+    # Потоковые варианты выборок: пачки кортежей колонок вместо ORM-объектов всей выборки
+
+    def iter_all(self, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[list[Row]]:
+        return self._stream(batch_size=batch_size)
+
+    def iter_by_status(self, statuses: list[str], batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[list[Row]]:
+        return self._stream(Analytics.status.in_(statuses), batch_size=batch_size)
+
+    def iter_not_test_patients(self, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[list[Row]]:
+        return self._stream(Analytics.category != "Тестовый пациент", batch_size=batch_size)
+
+    def iter_not_service_codes(self, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[list[Row]]:
+        return self._stream(~Analytics.okmu_code.startswith("Q"), batch_size=batch_size)
+
+    def _stream(self, *criteria, batch_size: int) -> Iterator[list[Row]]:
+        statement = select(*Analytics.__table__.columns).where(*criteria)
+        return stream_batches(self.db, statement, batch_size)
+
     def select_for_bitrix(self):
-        q = self.db.query(
-            Analytics.registration_number,
-            Analytics.full_name,
-            Analytics.appointment_date,
-            Analytics.department_execution,
-            Analytics.specialist_execution,
-            func.sum(func.cast(Analytics.total_amount, Integer)).label('total_amount_sum'),
-        ).filter(
-            Analytics.admission_type == "КОСМЕТОЛОГИЯ",
-            Analytics.department_execution == "ХГМ КОСМ АМБ",
-        ).group_by(
-            Analytics.registration_number,
-            Analytics.full_name,
-            Analytics.appointment_date,
-            Analytics.department_execution,
-            Analytics.specialist_execution,
+        # Агрегат предрассчитан в материализованном представлении и обновляется после каждой загрузки.
+        # Пустые ключи группировки представление хранит как '' - здесь они снова NULL, как в исходных данных
+        q = select(
+            func.nullif(cosmetology_totals.c.registration_number, '').label('registration_number'),
+            func.nullif(cosmetology_totals.c.full_name, '').label('full_name'),
+            cosmetology_totals.c.appointment_date,
+            cosmetology_totals.c.department_execution,
+            func.nullif(cosmetology_totals.c.specialist_execution, '').label('specialist_execution'),
+            cosmetology_totals.c.total_amount.label('total_amount_sum'),
         )
-        return q.all()
+        return self.db.execute(q).all()
@@ -1,5 +1,9 @@
+from typing import Iterator
+
+from sqlalchemy import Row, select
 from sqlalchemy.orm import Session
 from app_v2.database.models import Specialists
+from app_v2.database.streaming import DEFAULT_BATCH_SIZE, stream_batches
 
 class SpecialistsRepository:
     def __init__(self, db: Session):
@@ -18,3 +22,6 @@ class SpecialistsRepository:
 
     def get_all(self):
         return self.db.query(Specialists).all()
+
+    def iter_all(self, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[list[Row]]:
+        return stream_batches(self.db, select(*Specialists.__table__.columns), batch_size)
@@ -1,3 +1,4 @@
+import threading
 import yaml
 from app_v2.config import config
 from sqlalchemy import create_engine
@@ -12,7 +13,7 @@ def load_db_config(path=CONFIG_PATH):
         config = yaml.safe_load(f)
     return config
 
-def get_engine():
+def create_db_engine():
     conf = config.postgres
     url = (
         f"postgresql+psycopg2://{conf['user']}:{conf['password']}@"
@@ -29,11 +30,22 @@ def get_engine():
     )
     return engine
 
-_engine = get_engine()
-SessionLocal = sessionmaker(bind=_engine, autoflush=False, autocommit=False, expire_on_commit=False)
+_engine = None
+_engine_lock = threading.Lock()
+SessionLocal = sessionmaker(autoflush=False, autocommit=False, expire_on_commit=False)
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_db_engine()
+                SessionLocal.configure(bind=_engine)
+    return _engine
 
 def get_session():
+    get_engine()
     return SessionLocal()
 
 def init_db():
-    Base.metadata.create_all(_engine)
+    Base.metadata.create_all(get_engine())
@@ -0,0 +1,23 @@
+from typing import Iterator
+
+from sqlalchemy import Row
+from sqlalchemy.orm import Session
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+def stream_batches(db: Session, statement, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[list[Row]]:
+    # Серверный курсор: строки приходят пачками по batch_size, а не всей выборкой.
+    # Курсор живет в транзакции сессии - до конца итерации нельзя делать commit/rollback.
+    result = db.execute(statement.execution_options(stream_results=True, yield_per=batch_size))
+
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+
+def stream_rows(db: Session, statement, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[Row]:
+    for batch in stream_batches(db, statement, batch_size):
+        yield from batch
@@ -0,0 +1,38 @@
+"""Перенос аналитик закрытых лет в холодную таблицу.
+
+Пример:
+    python -m app_v3.archive
+    python -m app_v3.archive --keep-years 2 --parquet-dir archive/analytics
+
+Секции месяцев раньше последних keep-years лет отсоединяются от таблицы аналитик и присоединяются
+к grandmed_qms_analytics_cold. Читатели всей истории используют представление grandmed_qms_analytics_all.
+Запускать между загрузками: перенос секции ненадолго блокирует таблицу аналитик.
+"""
+
+import argparse
+
+from app_v3.database.session import get_engine, init_db
+from app_v3.database.tiering import archive_closed_years
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос аналитик закрытых лет в холодную таблицу")
+    parser.add_argument("--keep-years", type=int, help="Сколько последних лет, включая текущий, не переносить")
+    parser.add_argument("--parquet-dir", help="Директория для выгрузки перенесенных секций в Parquet")
+    parser.add_argument("--no-compact", action="store_true", help="Не уплотнять перенесенные секции VACUUM FULL")
+    parser.add_argument("--dry-run", action="store_true", help="Только показать секции к переносу")
+
+    args = parser.parse_args()
+
+    init_db()
+    archive_closed_years(
+        get_engine(),
+        keep_years=args.keep_years,
+        parquet_dir=args.parquet_dir,
+        compact=False if args.no_compact else None,
+        dry_run=args.dry_run,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -69,7 +69,7 @@ class BitrixManager:
         return deal_id
 
     def upload_cosmetology_to_bitrix(self, record):
-        """Выгрузка сделки по косметологии в Bitrix."""
+        """Выгрузка сделки по косметологии в Bitrix. Возвращает id созданной сделки или None."""
 
         reg_num = record.pop('registration_number')
         contact = self._get_contact_by_reg_number(reg_num)
@@ -83,10 +83,15 @@ class BitrixManager:
             })
 
             deal_id = self.upload_to_bitrix(record)
-            self._add_contact_to_deal(deal_id, contact)
 
-        else:
-            self.not_found_contacts.append(reg_num)
+            if deal_id is not None:
+                self._add_contact_to_deal(deal_id, contact)
+
+            return deal_id
+
+        self.not_found_contacts.append(reg_num)
+
+        return None
 
     def _get_contact_by_reg_number(self, reg_num):
         """Находим контакт юзера по его рег. номеру."""
@@ -0,0 +1,174 @@
+import io
+import math
+import time
+import uuid
+
+import pandas as pd
+
+from sqlalchemy import ARRAY, Column, MetaData, Table, any_, bindparam, delete, text
+
+from app_v3.database.instrumentation import record_statement
+
+
+# Экранирование спецсимволов текстового формата COPY
+_COPY_ESCAPES = str.maketrans({
+    "\\": "\\\\",
+    "\t": "\\t",
+    "\n": "\\n",
+    "\r": "\\r",
+})
+_COPY_NULL = "\\N"
+
+
+def supports_copy(bind):
+    """COPY доступен только для PostgreSQL через psycopg2."""
+
+    return bind.dialect.name == "postgresql" and bind.dialect.driver == "psycopg2"
+
+
+def encode_value(value):
+    """Значение в текстовом формате COPY. Пропуски (None, NaN, NaT) - NULL."""
+
+    if value is None:
+        return _COPY_NULL
+
+    value_type = type(value)
+
+    if value_type is str:
+        return value.translate(_COPY_ESCAPES)
+
+    if value_type is float:
+        return _COPY_NULL if math.isnan(value) else repr(value)
+
+    if value_type is bool:
+        return "true" if value else "false"
+
+    if value_type is int:
+        return str(value)
+
+    if pd.isna(value):
+        return _COPY_NULL
+
+    return str(value).translate(_COPY_ESCAPES)
+
+
+def encode_rows(columns, records):
+    """Кодирование пачки записей в буфер COPY. Значения кодируются поколоночно."""
+
+    if not records:
+        return io.StringIO()
+
+    # Строки - самый частый случай, для них экранирование делается без вызова encode_value
+    encoded_columns = [
+        [
+            value.translate(_COPY_ESCAPES) if type(value) is str else encode_value(value)
+            for value in (record.get(column) for record in records)
+        ]
+        for column in columns
+    ]
+
+    return io.StringIO("\n".join(map("\t".join, zip(*encoded_columns))) + "\n")
+
+
+def copy_records(session, table, records, columns=None):
+    """Загрузка записей в таблицу через COPY ... FROM STDIN в транзакции сессии.
+
+    Args:
+        session: Сессия SQLAlchemy поверх psycopg2
+        table: Таблица SQLAlchemy
+        records: Список словарей колонка -> значение
+        columns: Загружаемые колонки. По умолчанию - колонки таблицы, присутствующие в первой записи
+
+    Returns:
+        int: Объем переданных данных в символах
+    """
+
+    if not records:
+        return 0
+
+    if columns is None:
+        columns = [column.name for column in table.columns if column.name in records[0]]
+
+    preparer = session.bind.dialect.identifier_preparer
+    statement = (
+        f"COPY {preparer.format_table(table)} ({', '.join(preparer.quote(column) for column in columns)}) "
+        f"FROM STDIN"
+    )
+    buffer = encode_rows(columns, records)
+    size = len(buffer.getvalue())
+    start = time.perf_counter()
+
+    # COPY идет мимо событий SQLAlchemy и учитывается в замерах запросов отдельно
+    with session.connection().connection.cursor() as cursor:
+        cursor.copy_expert(statement, buffer)
+
+    record_statement("COPY", time.perf_counter() - start, len(records), size, statement)
+
+    return size
+
+
+def delete_by_keys(session, table, column, keys, use_copy=True, returning=None):
+    """Удаление строк, у которых значение колонки входит в набор ключей, без огромного IN-списка.
+
+    На PostgreSQL ключи загружаются во временную таблицу через COPY и удаление выполняется соединением,
+    без COPY - передаются одним параметром-массивом (= ANY). На прочих СУБД - IN пачками.
+    Выполняется в текущей транзакции сессии.
+
+    Args:
+        session: Сессия SQLAlchemy
+        table: Таблица SQLAlchemy
+        column: Колонка таблицы с ключом
+        keys: Набор ключей
+        use_copy: Разрешена ли загрузка ключей через COPY
+        returning: Колонка таблицы, значения которой нужно вернуть для удаленных строк
+
+    Returns:
+        int | list: Количество удаленных строк, а с returning - значения колонки удаленных строк
+    """
+
+    keys = list(keys)
+
+    if not keys:
+        return [] if returning is not None else 0
+
+    def execute(statement, params=None):
+        result = session.execute(statement, params or {})
+
+        return result.scalars().all() if returning is not None else result.rowcount
+
+    dialect = session.bind.dialect
+
+    if dialect.name != "postgresql":
+        deleted = [] if returning is not None else 0
+
+        for i in range(0, len(keys), 10000):
+            statement = delete(table).where(column.in_(keys[i:i + 10000]))
+            deleted += execute(statement if returning is None else statement.returning(returning))
+
+        return deleted
+
+    if not (use_copy and supports_copy(session.bind)):
+        statement = delete(table).where(column == any_(bindparam("keys", type_=ARRAY(column.type))))
+
+        return execute(statement if returning is None else statement.returning(returning), {"keys": keys})
+
+    preparer = dialect.identifier_preparer
+    keys_table = Table(f"delete_keys_{uuid.uuid4().hex[:8]}", MetaData(), Column("key", column.type))
+    keys_name = preparer.format_table(keys_table)
+
+    session.execute(text(f"CREATE TEMP TABLE {keys_name} (key {column.type.compile(dialect)})"))
+    copy_records(session, keys_table, [{"key": key} for key in keys])
+    session.execute(text(f"ANALYZE {keys_name}"))
+
+    statement = (
+        f"DELETE FROM {preparer.format_table(table)} t USING {keys_name} k "
+        f"WHERE t.{preparer.quote(column.name)} = k.key"
+    )
+
+    if returning is not None:
+        statement += f" RETURNING t.{preparer.quote(returning.name)}"
+
+    deleted = execute(text(statement))
+    session.execute(text(f"DROP TABLE {keys_name}"))
+
+    return deleted
@@ -0,0 +1,90 @@
+from app_v3.utils.logger import app_logger
+
+
+class AdaptiveChunkSizer:
+    """Размер чанка массовой загрузки под целевую длительность транзакции и статистика скорости.
+
+    После каждого чанка по измеренной скорости (записей в секунду) размер следующего чанка
+    подстраивается так, чтобы его вставка с фиксацией занимала около target_seconds.
+    Широкие строки аналитик получают чанки меньше, узкие строки специалистов - больше.
+    За один шаг размер меняется не больше чем вдвое, чтобы единичный медленный коммит его не обрушил.
+    Подобранный размер запоминается по таблице и служит начальным для следующих загрузок процесса.
+    """
+
+    # Подобранные размеры чанков по таблицам
+    _tuned = {}
+
+    def __init__(self, table, initial=50000, target_seconds=2.0, min_size=1000, max_size=500000):
+        self.table = table
+        self.target_seconds = target_seconds
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size = self._tuned.get(table, initial)
+
+        self.chunks = 0
+        self.rows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    @property
+    def rate(self):
+        """Средняя скорость загрузки, записей в секунду."""
+
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def split(self, batch):
+        """Нарезка пачки на чанки текущего размера. Размер может меняться между чанками."""
+
+        start = 0
+
+        while start < len(batch):
+            chunk = batch[start:start + self.size]
+            start += len(chunk)
+
+            yield chunk
+
+    def record(self, rows, seconds, size=None):
+        """Учет загруженного чанка и подстройка размера следующего.
+
+        Args:
+            rows: Количество записей в чанке
+            seconds: Время вставки и фиксации чанка
+            size: Объем переданных данных в символах, если известен
+        """
+
+        self.chunks += 1
+        self.rows += rows
+        self.seconds += seconds
+        self.bytes += size or 0
+
+        # Хвостовые чанки малы, и их скорость определяется накладными расходами транзакции
+        if seconds <= 0 or rows < self.min_size:
+            return
+
+        wanted = rows / seconds * self.target_seconds
+        wanted = min(max(wanted, self.size / 2), self.size * 2)
+        self.size = int(min(max(wanted, self.min_size), self.max_size))
+        self._tuned[self.table] = self.size
+
+        app_logger.debug(
+            f"[BRep] {self.table}: чанк {rows} записей, {(size or 0) / 2 ** 20:.1f} МБ за {seconds:.2f} с, "
+            f"следующий чанк {self.size}",
+        )
+
+    def report(self):
+        """Логирование итоговой скорости загрузки таблицы."""
+
+        if not self.chunks:
+            return
+
+        megabytes = self.bytes / 2 ** 20
+        throughput = ""
+
+        # Объем известен только для загрузки через COPY
+        if self.bytes and self.seconds:
+            throughput = f", {megabytes / self.seconds:.1f} МБ/с, в среднем {megabytes / self.chunks:.1f} МБ на чанк"
+
+        app_logger.info(
+            f"[BRep] {self.table}: {self.rows} записей в {self.chunks} чанках за {self.seconds:.1f} с - "
+            f"{self.rate:.0f} записей/с{throughput}, размер чанка {self.size}",
+        )
@@ -1,3 +1,5 @@
+from sqlalchemy import Date, Numeric
+
 from app_v3.database.models import Analytics, Specialists
 
 
@@ -13,6 +15,19 @@ ANALYTICS_FIELDS = {
     if column.comment is not None
 }
 
+# Типизированные колонки аналитик, которые загрузчик приводит из текста выгрузки
+ANALYTICS_NUMERIC_FIELDS = [
+    column.name
+    for column in Analytics.__table__.columns
+    if isinstance(column.type, Numeric)
+]
+
+ANALYTICS_DATE_FIELDS = [
+    column.name
+    for column in Analytics.__table__.columns
+    if isinstance(column.type, Date) and column.comment is not None
+]
+
 ANALYTICS_TO_BITRIX = {
     column.comment: column.name
     for column in [
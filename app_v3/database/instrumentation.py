@@ -0,0 +1,237 @@
+"""Замеры запросов и коммитов к БД по событиям SQLAlchemy.
+
+События движка (before/after_cursor_execute) засекают время каждого запроса, а события сессий
+(before/after_commit) - время коммитов. COPY идет мимо SQLAlchemy напрямую через курсор psycopg2,
+поэтому copy_records учитывает его сам через record_statement.
+
+Замеры копятся по типу запроса (первое слово SQL: INSERT, DELETE, COPY, COMMIT...) в этапах, открытых
+query_stage, и по выходу из этапа выводятся в лог и отчет. Этапы общие для всех потоков процесса -
+запросы параллельных загрузчиков и фоновых потоков попадают в этап, открытый основным потоком.
+Запросы дольше порога логируются вместе с планом (EXPLAIN без выполнения, только PostgreSQL).
+"""
+
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app_v3.utils.config import app_config
+from app_v3.utils.logger import app_logger
+from app_v3.utils.reporter import reporter
+
+
+INSTRUMENTATION_CONFIG = app_config.database.get("instrumentation") or {}
+
+SLOW_STATEMENT_SECONDS = INSTRUMENTATION_CONFIG.get("slow_statement_seconds", 5.0)
+
+# Запросы, для которых PostgreSQL строит план
+EXPLAIN_KINDS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"}
+
+# Длина текста медленного запроса в логе
+STATEMENT_LOG_LENGTH = 1000
+
+_stages = []
+_lock = threading.Lock()
+
+
+class StatementStats:
+    """Счетчики запросов одного типа."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.size = 0
+
+    def add(self, seconds, rows, size):
+        self.count += 1
+        self.seconds += seconds
+        self.rows += rows
+        self.size += size
+
+    def describe(self):
+        parts = [f"{self.count} шт. за {self.seconds:.2f} с"]
+
+        if self.rows:
+            parts.append(f"строк {self.rows}")
+
+        if self.size >= 2 ** 20:
+            parts.append(f"{self.size / 2 ** 20:.1f} МБ")
+        elif self.size:
+            parts.append(f"{self.size / 2 ** 10:.1f} КБ")
+
+        return ", ".join(parts)
+
+
+class QueryStage:
+    """Замеры запросов этапа по их типам."""
+
+    def __init__(self, name):
+        self.name = name
+        self.kinds = defaultdict(StatementStats)
+        self.started = time.monotonic()
+
+    @property
+    def seconds(self):
+        return sum(stats.seconds for stats in self.kinds.values())
+
+    def summary(self):
+        """Строка для отчета: время этапа, время в БД и типы запросов, самые долгие первыми."""
+
+        kinds = sorted(self.kinds.items(), key=lambda item: item[1].seconds, reverse=True)
+
+        return (
+            f"{self.name}: {time.monotonic() - self.started:.1f} с, из них в БД {self.seconds:.1f} с"
+            + "".join(f"; {kind} {stats.describe()}" for kind, stats in kinds)
+        )
+
+
+def statement_kind(statement):
+    """Тип запроса - первое слово SQL."""
+
+    words = statement.split(None, 1)
+
+    return words[0].upper() if words else ""
+
+
+def record_statement(kind, seconds, rows=0, size=0, statement=None, plan=None):
+    """Учет выполненного запроса в открытых этапах и лог запроса дольше порога.
+
+    Args:
+        kind: Тип запроса
+        seconds: Время выполнения
+        rows: Количество затронутых или полученных строк
+        size: Объем переданных данных в символах, если известен
+        statement: Текст запроса - для лога медленного запроса
+        plan: План медленного запроса
+    """
+
+    with _lock:
+        for stage in _stages:
+            stage.kinds[kind].add(seconds, rows, size)
+
+    if statement is None or seconds < SLOW_STATEMENT_SECONDS:
+        return
+
+    msg = f"[SQL] Медленный запрос {kind}: {seconds:.1f} с, строк {rows}\n{statement[:STATEMENT_LOG_LENGTH]}"
+
+    if plan:
+        msg += "\nПлан:\n" + "\n".join(plan)
+
+    app_logger.warning(msg)
+
+
+def _explain(cursor, statement, parameters):
+    """План запроса на соединении курсора, в savepoint: ошибка EXPLAIN не должна обрывать транзакцию загрузки."""
+
+    connection = cursor.connection
+    savepoint = not connection.autocommit
+
+    with connection.cursor() as explain:
+        try:
+            if savepoint:
+                explain.execute("SAVEPOINT instrumentation_explain")
+
+            explain.execute(f"EXPLAIN {statement}", parameters)
+            plan = [row[0] for row in explain.fetchall()]
+
+            if savepoint:
+                explain.execute("RELEASE SAVEPOINT instrumentation_explain")
+
+            return plan
+        except Exception as e:
+            if savepoint:
+                explain.execute("ROLLBACK TO SAVEPOINT instrumentation_explain")
+
+            app_logger.warning(f"[SQL] Не удалось получить план запроса: {str(e)}")
+
+    return None
+
+
+def _before_execute(conn, _cursor, _statement, _parameters, _context, _executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, _context, executemany):
+    seconds = time.perf_counter() - conn.info["query_start"].pop()
+    kind = statement_kind(statement)
+    # rowcount -1, если драйвер его не знает. query есть у psycopg2 - запрос с подставленными параметрами,
+    # у executemany - только последний из них
+    rows = max(cursor.rowcount, 0)
+    query = getattr(cursor, "query", None)
+    size = len(query) if query and not executemany else 0
+    plan = None
+
+    if (
+        seconds >= SLOW_STATEMENT_SECONDS
+        and kind in EXPLAIN_KINDS
+        and not executemany
+        and conn.dialect.name == "postgresql"
+    ):
+        plan = _explain(cursor, statement, parameters)
+
+    record_statement(kind, seconds, rows, size, statement, plan)
+
+
+def _handle_error(context):
+    # after_cursor_execute при ошибке запроса не вызывается
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+
+def _before_commit(session):
+    session.info["commit_start"] = time.perf_counter()
+
+
+def _after_commit(session):
+    start = session.info.pop("commit_start", None)
+
+    # Время коммита сессии включает flush несохраненных объектов ORM
+    if start is not None:
+        record_statement("COMMIT", time.perf_counter() - start, statement="COMMIT")
+
+
+def instrument(engine, session_factory):
+    """Подключение замеров к движку и сессиям фабрики. Отключается instrumentation.enabled: false."""
+
+    if not INSTRUMENTATION_CONFIG.get("enabled", True):
+        return
+
+    event.listen(engine, "before_cursor_execute", _before_execute)
+    event.listen(engine, "after_cursor_execute", _after_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    event.listen(session_factory, "before_commit", _before_commit)
+    event.listen(session_factory, "after_commit", _after_commit)
+
+
+@contextmanager
+def query_stage(name, report=True):
+    """Этап, по выходу из которого замеры его запросов выводятся в лог и, при report, в отчет.
+
+    Запросы вложенного этапа учитываются и во внешнем.
+
+    Args:
+        name: Название этапа
+        report: Добавлять ли итог этапа в отчет
+    """
+
+    stage = QueryStage(name)
+
+    with _lock:
+        _stages.append(stage)
+
+    try:
+        yield stage
+    finally:
+        with _lock:
+            _stages.remove(stage)
+
+        if stage.kinds:
+            summary = stage.summary()
+            app_logger.info(f"[SQL] {summary}")
+
+            if report:
+                reporter.add_info(f"SQL {summary}")
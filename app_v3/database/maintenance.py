@@ -0,0 +1,128 @@
+"""Обслуживание таблиц после загрузки: ANALYZE и VACUUM по порогам изменений.
+
+Репозитории считают записи, которые загрузка добавила, изменила или удалила, по таблицам, а у аналитик -
+по помесячным секциям. После загрузки таблицы, изменившиеся больше порога относительно своего размера,
+анализируются сразу, не дожидаясь autovacuum, - иначе первые запросы после загрузки планируются
+по устаревшей статистике. Секционированную таблицу аналитик autovacuum не анализирует вовсе,
+поэтому ее статистика обновляется здесь же по сумме изменений секций.
+VACUUM не выполняется внутри транзакции и запускается на отдельном соединении в режиме AUTOCOMMIT.
+"""
+
+import time
+
+from collections import Counter
+
+from sqlalchemy import text
+
+from app_v3.database.partitions import ANALYTICS_TABLE, DEFAULT_PARTITION, month_start, partition_name
+from app_v3.utils.config import app_config
+from app_v3.utils.logger import app_logger
+
+
+MAINTENANCE_CONFIG = app_config.database.get("maintenance") or {}
+
+
+class ChangeTracker:
+    """Счетчик измененных загрузкой записей по таблицам и секциям аналитик."""
+
+    def __init__(self):
+        self.rows = Counter()
+
+    def add(self, table, rows):
+        if rows:
+            self.rows[table] += rows
+
+    def add_days(self, days):
+        """Учет измененных записей аналитик по их датам выполнения - по одной на дату."""
+
+        for day in days:
+            self.rows[partition_name(month_start(day)) if day else DEFAULT_PARTITION] += 1
+
+    def add_months(self, counts):
+        """Учет записей аналитик, посчитанных по месяцам: месяц (или None для пустой даты) -> количество."""
+
+        for month, rows in counts:
+            self.add(partition_name(month_start(month)) if month else DEFAULT_PARTITION, rows)
+
+    def take(self):
+        """Накопленные изменения со сбросом счетчика."""
+
+        rows, self.rows = self.rows, Counter()
+
+        return rows
+
+
+def _thresholds_exceeded(changed, reltuples, ratio, min_rows):
+    # reltuples у еще не анализированной таблицы -1 (или 0 в старых версиях)
+    return changed >= min_rows and changed >= ratio * max(reltuples, 0)
+
+
+def maintain_tables(engine, changes):
+    """ANALYZE, а при включенном maintenance.vacuum - VACUUM (ANALYZE) таблиц, изменившихся больше порогов.
+
+    Пороги из раздела maintenance настроек БД: analyze_ratio и vacuum_ratio - доля измененных
+    записей от размера таблицы по pg_class.reltuples, analyze_min_rows - минимум измененных записей.
+
+    Args:
+        engine: Движок SQLAlchemy
+        changes: Таблица или секция -> количество измененных записей
+
+    Returns:
+        list[str]: Обработанные таблицы
+    """
+
+    if engine.dialect.name != "postgresql" or not changes or not MAINTENANCE_CONFIG.get("enabled", True):
+        return []
+
+    analyze_ratio = MAINTENANCE_CONFIG.get("analyze_ratio", 0.1)
+    min_rows = MAINTENANCE_CONFIG.get("analyze_min_rows", 1000)
+    vacuum = MAINTENANCE_CONFIG.get("vacuum", False)
+    vacuum_ratio = MAINTENANCE_CONFIG.get("vacuum_ratio", 0.2)
+
+    # Изменения секций - это и изменения таблицы аналитик
+    changes = Counter(changes)
+    partitions = {
+        table for table in changes
+        if table == DEFAULT_PARTITION or table.startswith(f"{ANALYTICS_TABLE}_y")
+    }
+
+    if partitions:
+        changes[ANALYTICS_TABLE] += sum(changes[table] for table in partitions)
+
+    processed = []
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        sizes = dict(connection.execute(
+            text("SELECT relname, reltuples FROM pg_class WHERE relname = ANY(:tables) AND relkind IN ('r', 'p')"),
+            {"tables": list(changes)},
+        ).all())
+
+        def run(command, table):
+            start = time.monotonic()
+            connection.execute(text(f"{command} {table}"))
+            processed.append(table)
+
+            app_logger.info(
+                f"[Mnt] {command} {table}: изменено {changes[table]} из ~{max(int(sizes[table]), 0)} записей, "
+                f"{time.monotonic() - start:.1f} с",
+            )
+
+        # ANALYZE секционированной таблицы сам обходит все ее секции
+        analyze_parent = ANALYTICS_TABLE in sizes and _thresholds_exceeded(
+            changes[ANALYTICS_TABLE], sizes[ANALYTICS_TABLE], analyze_ratio, min_rows,
+        )
+
+        # Секции, которых нет (например, учтенные по дате, но не созданные), пропускаются
+        for table in sorted(set(changes) & set(sizes) - {ANALYTICS_TABLE}):
+            changed, reltuples = changes[table], sizes[table]
+            partition = table in partitions
+
+            if vacuum and _thresholds_exceeded(changed, reltuples, vacuum_ratio, min_rows):
+                run("VACUUM" if partition and analyze_parent else "VACUUM (ANALYZE)", table)
+            elif not (partition and analyze_parent) and _thresholds_exceeded(changed, reltuples, analyze_ratio, min_rows):
+                run("ANALYZE", table)
+
+        if analyze_parent:
+            run("ANALYZE", ANALYTICS_TABLE)
+
+    return processed
@@ -0,0 +1,474 @@
+"""Версионные миграции схемы поверх Base.metadata.create_all.
+
+create_all создает только отсутствующие таблицы, а индексы и прочие изменения существующих таблиц
+применяются здесь. Каждая миграция выполняется в своей транзакции и записывается в schema_migrations.
+Новые миграции добавляются в конец MIGRATIONS со следующим номером версии.
+"""
+
+import datetime
+
+from contextlib import contextmanager
+from typing import Callable, NamedTuple
+
+from sqlalchemy import Date, Numeric, String, insert, inspect, select, text
+
+from app_v3.database.models import (
+    COSMETOLOGY_ADMISSION_TYPE,
+    COSMETOLOGY_DEPARTMENT,
+    Analytics,
+    AnalyticsDaily,
+    CosmetologyExport,
+    LoadRun,
+    SchemaMigration,
+    Specialists,
+)
+from app_v3.database.partitions import (
+    ANALYTICS_TABLE,
+    DEFAULT_PARTITION,
+    EXECUTION_DATE_SQL,
+    ensure_month_partitions,
+)
+from app_v3.database.rollups import rebuild_daily_rollup
+from app_v3.database.tiering import create_cold_tier
+from app_v3.database.views import COSMETOLOGY_TOTALS, create_cosmetology_totals
+from app_v3.utils.logger import app_logger
+
+
+# Ключ advisory-блокировки, чтобы миграции не применялись одновременно из нескольких процессов
+MIGRATIONS_LOCK_KEY = 7340026
+
+
+class Migration(NamedTuple):
+    """Миграция схемы: версия, описание и функция, применяющая ее на соединении."""
+
+    version: int
+    description: str
+    apply: Callable
+
+
+def _index(table, name):
+    return next(index for index in table.indexes if index.name == name)
+
+
+# Индексы аналитик первой миграции. Индексы, добавленные позже, создают свои миграции
+INITIAL_ANALYTICS_INDEXES = (
+    "ix_grandmed_qms_analytics_instance_code",
+    "ix_grandmed_qms_analytics_registration_number",
+    "ix_grandmed_qms_analytics_appointment_date",
+    "ix_grandmed_qms_analytics_admission_type",
+)
+
+
+def _create_indexes(*indexes):
+    def apply(connection):
+        for index in indexes:
+            index.create(connection, checkfirst=True)
+
+    return apply
+
+
+def _column_type(connection, table, column):
+    return connection.execute(text(
+        "SELECT data_type FROM information_schema.columns WHERE table_name = :table AND column_name = :column"
+    ), {"table": table, "column": column}).scalar()
+
+
+def _partition_analytics(connection):
+    """Перевод аналитик в таблицу, секционированную по месяцам даты выполнения.
+
+    Первичный ключ секционированной таблицы обязан включать ключ секционирования, а дата выполнения
+    бывает пустой, поэтому вместо первичного ключа по id остается обычный индекс.
+    """
+
+    if connection.dialect.name != "postgresql":
+        return
+
+    old = f"{ANALYTICS_TABLE}_unpartitioned"
+
+    connection.execute(text(f"ALTER TABLE {ANALYTICS_TABLE} ADD COLUMN IF NOT EXISTS execution_date date"))
+
+    if _column_type(connection, ANALYTICS_TABLE, "appointment_date") == "date":
+        execution_date = "appointment_date"
+    else:
+        execution_date = EXECUTION_DATE_SQL.format(column="appointment_date")
+
+    connection.execute(text(f"UPDATE {ANALYTICS_TABLE} SET execution_date = {execution_date}"))
+
+    sequence = connection.execute(text(f"SELECT pg_get_serial_sequence('{ANALYTICS_TABLE}', 'id')")).scalar()
+
+    connection.execute(text(f"ALTER TABLE {ANALYTICS_TABLE} RENAME TO {old}"))
+    connection.execute(text(f"ALTER TABLE {old} DROP CONSTRAINT IF EXISTS {ANALYTICS_TABLE}_pkey"))
+
+    for index in Analytics.__table__.indexes:
+        connection.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+
+    # Иначе последовательность удалится вместе со старой таблицей
+    connection.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+
+    connection.execute(text(
+        f"CREATE TABLE {ANALYTICS_TABLE} (LIKE {old} INCLUDING DEFAULTS INCLUDING COMMENTS) "
+        f"PARTITION BY RANGE (execution_date)"
+    ))
+    connection.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {ANALYTICS_TABLE} DEFAULT"))
+
+    start, end = connection.execute(text(f"SELECT min(execution_date), max(execution_date) FROM {old}")).one()
+    ensure_month_partitions(connection, start, end)
+
+    connection.execute(text(f"INSERT INTO {ANALYTICS_TABLE} SELECT * FROM {old}"))
+    connection.execute(text(f"DROP TABLE {old}"))
+    connection.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {ANALYTICS_TABLE}.id"))
+
+    connection.execute(text(f"CREATE INDEX ix_{ANALYTICS_TABLE}_id ON {ANALYTICS_TABLE} (id)"))
+
+    for name in INITIAL_ANALYTICS_INDEXES:
+        _index(Analytics.__table__, name).create(connection, checkfirst=True)
+
+
+def _type_analytics_columns(connection):
+    """Перевод сумм в numeric, дат в date и возраста в integer с разбором текущих текстовых значений.
+
+    Нераспознанные значения становятся NULL. Колонки, у которых тип уже правильный, не трогаются.
+    """
+
+    if connection.dialect.name != "postgresql":
+        return
+
+    for column in Analytics.__table__.columns:
+        if column.comment is None or isinstance(column.type, String):
+            continue
+
+        if _column_type(connection, ANALYTICS_TABLE, column.name) not in ("text", "character varying"):
+            continue
+
+        name = connection.dialect.identifier_preparer.quote_identifier(column.name)
+
+        if isinstance(column.type, Numeric):
+            cleaned = f"replace(replace(replace({name}, chr(160), ''), ' ', ''), ',', '.')"
+            using = f"CASE WHEN {cleaned} ~ '^-?\\d+(\\.\\d+)?$' THEN CAST({cleaned} AS numeric) END"
+        elif isinstance(column.type, Date):
+            using = EXECUTION_DATE_SQL.format(column=name)
+        else:
+            using = f"CASE WHEN {name} ~ '^\\d+(\\.0+)?$' THEN CAST(CAST({name} AS numeric) AS integer) END"
+
+        type_name = column.type.compile(connection.dialect)
+        connection.execute(text(f"ALTER TABLE {ANALYTICS_TABLE} ALTER COLUMN {name} TYPE {type_name} USING {using}"))
+        app_logger.info(f"[Mig] {ANALYTICS_TABLE}.{column.name} -> {type_name}")
+
+
+def _unique_instance_codes(connection):
+    """Удаление повторов (код экземпляра, дата выполнения) и уникальный индекс по ним.
+
+    Из повторов остается последняя загруженная запись. Пустые коды уникальностью не ограничиваются.
+    """
+
+    index = _index(Analytics.__table__, "ux_grandmed_qms_analytics_instance_code_execution_date")
+
+    if connection.dialect.name == "postgresql":
+        deleted = connection.execute(text(f"""
+            DELETE FROM {ANALYTICS_TABLE} WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, row_number() OVER (PARTITION BY instance_code, execution_date ORDER BY id DESC) AS num
+                    FROM {ANALYTICS_TABLE}
+                    WHERE instance_code <> '' AND execution_date IS NOT NULL
+                ) t
+                WHERE num > 1
+            )
+        """)).rowcount
+        app_logger.info(f"[Mig] Удалено повторов кодов экземпляров: {deleted}")
+
+    index.create(connection, checkfirst=True)
+
+
+def _load_runs(connection):
+    """Колонка запуска загрузки в аналитиках и индекс по ней. Таблицу load_runs создает create_all."""
+
+    columns = {column["name"] for column in inspect(connection).get_columns(ANALYTICS_TABLE)}
+
+    if "load_run_id" not in columns:
+        connection.execute(text(f"ALTER TABLE {ANALYTICS_TABLE} ADD COLUMN load_run_id integer"))
+
+    _index(Analytics.__table__, "ix_grandmed_qms_analytics_load_run_id").create(connection, checkfirst=True)
+
+
+def _daily_rollup(connection):
+    """Заполнение дневных итогов по уже загруженным аналитикам."""
+
+    AnalyticsDaily.__table__.create(connection, checkfirst=True)
+    rebuild_daily_rollup(connection)
+
+
+def _cosmetology_totals(connection):
+    """Материализованное представление с агрегатом Косметологии и уникальным индексом для обновления CONCURRENTLY."""
+
+    if connection.dialect.name == "postgresql":
+        create_cosmetology_totals(connection, ANALYTICS_TABLE)
+
+
+def _cosmetology_exports(connection):
+    """Журнал выгрузки Косметологии в Bitrix и индекс для поиска невыгруженных аналитик.
+
+    До журнала в Bitrix выгружались только аналитики за вчерашний день, поэтому все более ранние
+    аналитики Косметологии отмечаются выгруженными, а вчерашние выгрузит первый запуск.
+    """
+
+    CosmetologyExport.__table__.create(connection, checkfirst=True)
+    _index(Analytics.__table__, "ix_grandmed_qms_analytics_cosmetology_instance_code").create(
+        connection, checkfirst=True,
+    )
+
+    analytics = Analytics.__table__.c
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+
+    seeded = connection.execute(
+        insert(CosmetologyExport).from_select(
+            ["instance_code", "execution_date"],
+            select(analytics.instance_code, analytics.execution_date)
+            .where(
+                analytics.admission_type == COSMETOLOGY_ADMISSION_TYPE,
+                analytics.department_execution == COSMETOLOGY_DEPARTMENT,
+                analytics.instance_code != "",
+                analytics.execution_date < yesterday,
+            )
+            .distinct(),
+        ),
+    ).rowcount
+    app_logger.info(f"[Mig] Отмечено выгруженными ранее аналитик Косметологии: {seeded}")
+
+
+def _cold_tier(connection):
+    """Холодная таблица аналитик закрытых лет и представление, объединяющее ее с таблицей аналитик.
+
+    Агрегат Косметологии пересоздается поверх представления, чтобы включать и перенесенные годы.
+    """
+
+    if connection.dialect.name != "postgresql":
+        return
+
+    create_cold_tier(connection)
+    connection.execute(text(f"DROP MATERIALIZED VIEW IF EXISTS {COSMETOLOGY_TOTALS}"))
+    create_cosmetology_totals(connection)
+
+
+def _cosmetology_export_attempts(connection):
+    """Статус и счетчик неудачных попыток в журнале выгрузки Косметологии. Записи журнала - выгруженные."""
+
+    table = CosmetologyExport.__tablename__
+    columns = {column["name"] for column in inspect(connection).get_columns(table)}
+
+    if "status" not in columns:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN status varchar NOT NULL DEFAULT 'exported'"))
+
+    if "attempts" not in columns:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN attempts integer NOT NULL DEFAULT 0"))
+
+
+def _load_run_plans(connection):
+    """Способ обработки выгрузки в запусках загрузки. Запуски без него не продолжаются."""
+
+    table = LoadRun.__tablename__
+    columns = {column["name"] for column in inspect(connection).get_columns(table)}
+
+    if "engine" not in columns:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN engine varchar"))
+
+    if "chunk_size" not in columns:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN chunk_size integer"))
+
+
+def _cosmetology_export_dates(connection):
+    """Ключ журнала выгрузки Косметологии - код экземпляра и дата выполнения, как у аналитик.
+
+    По одному коду журнал считал выгруженными аналитики этого кода за все даты. Записи журнала
+    без даты удаляются - такие аналитики не выгружаются, а аналитики остальных дат кодов журнала
+    получают записи со статусом и попытками записи кода, чтобы не уйти в Bitrix повторно.
+    """
+
+    table = CosmetologyExport.__tablename__
+    primary_key = inspect(connection).get_pk_constraint(table)
+
+    if primary_key["constrained_columns"] != ["instance_code"]:
+        return
+
+    connection.execute(text(f"DELETE FROM {table} WHERE execution_date IS NULL"))
+
+    if connection.dialect.name == "postgresql":
+        connection.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT {primary_key['name']}"))
+        connection.execute(text(f"ALTER TABLE {table} ALTER COLUMN execution_date SET NOT NULL"))
+        connection.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (instance_code, execution_date)"))
+    else:
+        # SQLite не меняет первичный ключ существующей таблицы - она пересоздается
+        old = f"{table}_by_code"
+        columns = ", ".join(column.name for column in CosmetologyExport.__table__.columns)
+
+        connection.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+        CosmetologyExport.__table__.create(connection)
+        connection.execute(text(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {old}"))
+        connection.execute(text(f"DROP TABLE {old}"))
+
+    analytics = Analytics.__table__.c
+    ledger = CosmetologyExport.__table__.alias("ledger").c
+
+    added = connection.execute(
+        insert(CosmetologyExport).from_select(
+            ["instance_code", "execution_date", "status", "attempts", "deal_id", "exported_at"],
+            select(
+                analytics.instance_code,
+                analytics.execution_date,
+                ledger.status,
+                ledger.attempts,
+                ledger.deal_id,
+                ledger.exported_at,
+            )
+            .where(
+                ledger.instance_code == analytics.instance_code,
+                ledger.execution_date != analytics.execution_date,
+                analytics.admission_type == COSMETOLOGY_ADMISSION_TYPE,
+                analytics.department_execution == COSMETOLOGY_DEPARTMENT,
+            )
+            .distinct(),
+        ),
+    ).rowcount
+    app_logger.info(f"[Mig] Добавлено записей журнала Косметологии за другие даты кодов: {added}")
+
+
+MIGRATIONS = [
+    Migration(
+        1,
+        "Индексы аналитик по коду экземпляра, рег.номеру, дате выполнения и виду поступления",
+        _create_indexes(*(_index(Analytics.__table__, name) for name in INITIAL_ANALYTICS_INDEXES)),
+    ),
+    Migration(
+        2,
+        "Индекс специалистов по рег.номеру",
+        _create_indexes(_index(Specialists.__table__, "ix_grandmed_qms_specialists_registration_number")),
+    ),
+    Migration(
+        3,
+        "Секционирование аналитик по месяцам даты выполнения",
+        _partition_analytics,
+    ),
+    Migration(
+        4,
+        "Числовые суммы, даты и целый возраст в аналитиках",
+        _type_analytics_columns,
+    ),
+    Migration(
+        5,
+        "Уникальный код экземпляра в пределах даты выполнения",
+        _unique_instance_codes,
+    ),
+    Migration(
+        6,
+        "Запуск загрузки в аналитиках",
+        _load_runs,
+    ),
+    Migration(
+        7,
+        "Дневные итоги аналитик по отделению, специалисту и виду поступления",
+        _daily_rollup,
+    ),
+    Migration(
+        8,
+        "Материализованное представление агрегата Косметологии",
+        _cosmetology_totals,
+    ),
+    Migration(
+        9,
+        "Журнал выгрузки аналитик Косметологии в Bitrix",
+        _cosmetology_exports,
+    ),
+    Migration(
+        10,
+        "Холодная таблица аналитик закрытых лет и объединяющее представление",
+        _cold_tier,
+    ),
+    Migration(
+        11,
+        "Статус и попытки выгрузки в журнале Косметологии",
+        _cosmetology_export_attempts,
+    ),
+    Migration(
+        12,
+        "Способ обработки выгрузки в запусках загрузки",
+        _load_run_plans,
+    ),
+    Migration(
+        13,
+        "Код экземпляра и дата выполнения - ключ журнала Косметологии",
+        _cosmetology_export_dates,
+    ),
+]
+
+
+class MigrationManager:
+    """Применение недостающих миграций и учет примененных версий."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def applied_versions(self, connection):
+        return set(connection.execute(select(SchemaMigration.version)).scalars())
+
+    def migrate(self):
+        """Применение всех непримененных миграций по порядку версий."""
+
+        SchemaMigration.__table__.create(self.engine, checkfirst=True)
+        applied = 0
+
+        for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+            with self.engine.begin() as connection:
+                if connection.dialect.name == "postgresql":
+                    connection.execute(text(f"SELECT pg_advisory_xact_lock({MIGRATIONS_LOCK_KEY})"))
+
+                # Проверка под блокировкой: миграцию мог применить параллельный процесс
+                if migration.version in self.applied_versions(connection):
+                    continue
+
+                start = datetime.datetime.now()
+                migration.apply(connection)
+                connection.execute(
+                    insert(SchemaMigration).values(version=migration.version, description=migration.description),
+                )
+
+            applied += 1
+            seconds = (datetime.datetime.now() - start).total_seconds()
+            app_logger.info(f"[Mig] Применена миграция {migration.version}: {migration.description} ({seconds:.1f} с)")
+
+        if not applied:
+            app_logger.info("[Mig] Схема БД актуальна")
+
+
+@contextmanager
+def indexes_dropped(engine, table, keep=()):
+    """Удаление вторичных индексов таблицы на время массовой загрузки и их пересоздание после.
+
+    Уникальные индексы и индексы из keep не трогаются. Индексы пересоздаются и при ошибке загрузки.
+
+    Args:
+        engine: Движок SQLAlchemy
+        table: Таблица SQLAlchemy
+        keep: Имена индексов, которые нужны самой загрузке (например, для удаления по ключам)
+    """
+
+    indexes = [index for index in table.indexes if not index.unique and index.name not in keep]
+
+    with engine.begin() as connection:
+        for index in indexes:
+            index.drop(connection, checkfirst=True)
+
+    app_logger.info(f"[Mig] {table.name}: индексы удалены на время загрузки: {', '.join(i.name for i in indexes)}")
+
+    try:
+        yield
+    finally:
+        start = datetime.datetime.now()
+
+        with engine.begin() as connection:
+            for index in indexes:
+                index.create(connection, checkfirst=True)
+
+            if connection.dialect.name == "postgresql":
+                connection.execute(text(f"ANALYZE {table.name}"))
+
+        seconds = (datetime.datetime.now() - start).total_seconds()
+        app_logger.info(f"[Mig] {table.name}: индексы пересозданы за {seconds:.1f} с")
@@ -1,18 +1,48 @@
-from sqlalchemy import Column, String, Integer
+from sqlalchemy import JSON, Boolean, Column, Date, DateTime, Index, Numeric, String, Integer, func, text
 from sqlalchemy.ext.declarative import declarative_base
 
 
 Base = declarative_base()
 
+# Аналитики Косметологии, по которым создаются сделки в Bitrix
+COSMETOLOGY_ADMISSION_TYPE = "КОСМЕТОЛОГИЯ"
+COSMETOLOGY_DEPARTMENT = "ХГМ КОСМ АМБ"
+COSMETOLOGY_CONDITION = (
+    f"admission_type = '{COSMETOLOGY_ADMISSION_TYPE}' AND department_execution = '{COSMETOLOGY_DEPARTMENT}'"
+)
+
 
 class Analytics(Base):
     __tablename__ = 'grandmed_qms_analytics'
+    __table_args__ = (
+        Index('ix_grandmed_qms_analytics_instance_code', 'instance_code'),
+        Index('ix_grandmed_qms_analytics_registration_number', 'registration_number'),
+        Index('ix_grandmed_qms_analytics_appointment_date', 'appointment_date'),
+        Index('ix_grandmed_qms_analytics_admission_type', 'admission_type'),
+        Index('ix_grandmed_qms_analytics_load_run_id', 'load_run_id'),
+        # Поиск еще не выгруженных в Bitrix аналитик Косметологии
+        Index(
+            'ix_grandmed_qms_analytics_cosmetology_instance_code',
+            'instance_code',
+            postgresql_where=text(COSMETOLOGY_CONDITION),
+            sqlite_where=text(COSMETOLOGY_CONDITION),
+        ),
+        # Код экземпляра уникален в пределах даты выполнения (ключ секционирования обязан входить в индекс)
+        Index(
+            'ux_grandmed_qms_analytics_instance_code_execution_date',
+            'instance_code',
+            'execution_date',
+            unique=True,
+            postgresql_where=text("instance_code <> ''"),
+            sqlite_where=text("instance_code <> ''"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
     registration_number = Column(String, nullable=True, comment='Рег.№')
     full_name = Column(String, nullable=True, comment='ФИО')
     gender = Column(String, nullable=True, comment='Пол')
-    age = Column(String, nullable=True, comment='Возр.')
+    age = Column(Integer, nullable=True, comment='Возр.')
     okmu_code = Column(String, nullable=True, comment='Код ОКМУ')
     service = Column(String, nullable=True, comment='Услуга')
     first_name = Column(String, nullable=True, comment='Имя')
@@ -22,7 +52,7 @@ class Analytics(Base):
     admission_purpose = Column(String, nullable=True, comment='Цель поступления')
     episode_number = Column(String, nullable=True, comment='№_эпизода')
     appointment_type = Column(String, nullable=True, comment='Тип назначения')
-    appointment_date = Column(String, nullable=True, comment='Дата выполнения назначения')
+    appointment_date = Column(Date, nullable=True, comment='Дата выполнения назначения')
     appointment_time = Column(String, nullable=True, comment='Время назначения')
     underperformance = Column(String, nullable=True, comment='Недовыполнение')
     status = Column(String, nullable=True, comment='Состояние')
@@ -34,10 +64,10 @@ class Analytics(Base):
     specialist_specialization = Column(String, nullable=True, comment='Специализация исполнителя')
     hospitalization_department = Column(String, nullable=True, comment='Отделение госпитализации')
     tariff = Column(String, nullable=True, comment='Тариф')
-    price = Column(String, nullable=True, comment='Цена')
+    price = Column(Numeric(14, 2), nullable=True, comment='Цена')
     discount_percent = Column(String, nullable=True, comment='%Ск-ки')
-    total_amount = Column(String, nullable=True, comment='Сумма')
-    debt = Column(String, nullable=True, comment='Долг')
+    total_amount = Column(Numeric(14, 2), nullable=True, comment='Сумма')
+    debt = Column(Numeric(14, 2), nullable=True, comment='Долг')
     specialist_full_name = Column(String, nullable=True, comment='ФИО специалист')
     attending_physician = Column(String, nullable=True, comment='Лечащий врач')
     complex_code = Column(String, nullable=True, comment='Код комплекса')
@@ -52,14 +82,38 @@ class Analytics(Base):
     email = Column(String, nullable=True, comment='Электронная почта')
     middle_name = Column(String, nullable=True, comment='Отчество')
     episode_end_date = Column(String, nullable=True, comment='Дата завершения эпизода')
-    date = Column(String, nullable=True, comment='Дата')
-    birth_date = Column(String, nullable=True, comment='ДР')
+    date = Column(Date, nullable=True, comment='Дата')
+    birth_date = Column(Date, nullable=True, comment='ДР')
     paid_destination_num = Column(String, nullable=True, comment='Номер оплачиваемого назначения')
     instance_code = Column(String, nullable=True, comment='%Код экземпляра')
+    # Ключ секционирования: дата выполнения назначения в виде даты
+    execution_date = Column(Date, nullable=True)
+    # Запуск загрузки, добавивший строку или последним ее изменивший
+    load_run_id = Column(Integer, nullable=True)
+
+
+class AnalyticsDaily(Base):
+    """Дневные итоги аналитик по отделению, специалисту и виду поступления.
+
+    Поддерживаются загрузчиком: дни, затронутые загрузкой, пересчитываются в той же транзакции.
+    """
+
+    __tablename__ = 'grandmed_qms_analytics_daily'
+
+    day = Column(Date, primary_key=True)
+    department_execution = Column(String, primary_key=True)
+    specialist_execution = Column(String, primary_key=True)
+    admission_type = Column(String, primary_key=True)
+    services_count = Column(Integer, nullable=False)
+    total_amount = Column(Numeric(14, 2), nullable=False)
+    debt = Column(Numeric(14, 2), nullable=False)
 
 
 class Specialists(Base):
     __tablename__ = 'grandmed_qms_specialists'
+    __table_args__ = (
+        Index('ix_grandmed_qms_specialists_registration_number', 'registration_number'),
+    )
 
     id = Column(Integer, primary_key=True)
     material_number = Column(String, unique=True, comment='Номер материала')
@@ -77,3 +131,60 @@ class Specialists(Base):
     registration_number = Column(String, comment='Рег.№')
     patient_age = Column(String, comment='Возраст пациента')
     development_medium_alt = Column(String, comment='Среда для развития.')
+
+
+class SchemaMigration(Base):
+    __tablename__ = 'schema_migrations'
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String, nullable=False)
+    applied_at = Column(DateTime, nullable=False, server_default=func.now())
+
+
+class LoadRun(Base):
+    """Запуск загрузки выгрузки: режим, статус по этапам и количество зафиксированных записей."""
+
+    __tablename__ = 'load_runs'
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    source = Column(String, nullable=False)
+    # Имя, размер и время изменения файла - по ним прерванная загрузка находит свой запуск
+    fingerprint = Column(String, nullable=False)
+    mode = Column(String, nullable=False)
+    from_scratch = Column(Boolean, nullable=False)
+    window_start = Column(Date, nullable=True)
+    window_end = Column(Date, nullable=True)
+    # Способ обработки выгрузки: продолжение пропускает записи по порядку, поэтому обрабатывает ее так же
+    engine = Column(String, nullable=True)
+    chunk_size = Column(Integer, nullable=True)
+    # running, completed, failed, rolled_back
+    status = Column(String, nullable=False)
+    stages = Column(JSON, nullable=False, default=dict)
+    rows_committed = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    started_at = Column(DateTime, nullable=False, server_default=func.now())
+    finished_at = Column(DateTime, nullable=True)
+
+
+class CosmetologyExport(Base):
+    """Журнал выгрузки аналитик Косметологии в Bitrix.
+
+    Код экземпляра с датой выполнения - ключ аналитики, как и в таблице аналитик, - записывается сюда
+    выгруженным, когда Bitrix создал сделку, в которую вошла аналитика, и неудачным, когда контакт пациента
+    сделки в Bitrix не найден. Аналитики Косметологии, которых в журнале нет, и неудачные с числом попыток
+    меньше предельного выгружаются при следующем запуске.
+    """
+
+    __tablename__ = 'grandmed_qms_cosmetology_exports'
+
+    instance_code = Column(String, primary_key=True)
+    execution_date = Column(Date, primary_key=True)
+    # exported, failed
+    status = Column(String, nullable=False, server_default='exported')
+    # Неудачные попытки выгрузки: контакт пациента не найден
+    attempts = Column(Integer, nullable=False, server_default='0')
+    # Пусто у записей, отмеченных выгруженными при создании журнала, и у неудачных
+    deal_id = Column(Integer, nullable=True)
+    # Время выгрузки, у неудачных - последней попытки
+    exported_at = Column(DateTime, nullable=False, server_default=func.now())
@@ -0,0 +1,155 @@
+"""Помесячные секции таблицы аналитик по дате выполнения.
+
+Таблица аналитик секционирована по execution_date (RANGE), каждая секция - календарный месяц.
+Записи без даты выполнения попадают в секцию по умолчанию. Секции создаются заранее,
+до вставки записей: создать секцию под уже лежащие в секции по умолчанию записи нельзя.
+
+Секции закрытых лет переносятся в холодную таблицу (tiering), а представление
+grandmed_qms_analytics_all объединяет обе таблицы для читателей всей истории.
+"""
+
+import datetime
+import re
+
+from sqlalchemy import text
+
+from app_v3.database.models import Analytics
+from app_v3.utils.logger import app_logger
+
+
+ANALYTICS_TABLE = Analytics.__tablename__
+DEFAULT_PARTITION = f"{ANALYTICS_TABLE}_default"
+COLD_ANALYTICS_TABLE = f"{ANALYTICS_TABLE}_cold"
+ALL_ANALYTICS_VIEW = f"{ANALYTICS_TABLE}_all"
+
+_PARTITION_MONTH = re.compile(r"_y(\d{4})m(\d{2})$")
+
+# SQL-эквивалент разбора даты выполнения из appointment_date (dd.mm.yyyy или dd.mm.yy)
+EXECUTION_DATE_SQL = """
+    CASE
+        WHEN {column} ~ '^\\d{{1,2}}\\.\\d{{1,2}}\\.\\d{{4}}$' THEN to_date({column}, 'DD.MM.YYYY')
+        WHEN {column} ~ '^\\d{{1,2}}\\.\\d{{1,2}}\\.\\d{{2}}$' THEN to_date({column}, 'DD.MM.YY')
+    END
+"""
+
+
+def month_start(value):
+    return datetime.date(value.year, value.month, 1)
+
+
+def next_month(value):
+    return datetime.date(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def months_between(start, end):
+    """Первые числа месяцев, пересекающихся с отрезком [start, end]."""
+
+    months = []
+    current = month_start(start)
+
+    while current <= end:
+        months.append(current)
+        current = next_month(current)
+
+    return months
+
+
+def month_days(month):
+    """Все дни месяца, начинающегося с month."""
+
+    return [month + datetime.timedelta(days=day) for day in range((next_month(month) - month).days)]
+
+
+def full_months(start, end):
+    """Первые числа месяцев, целиком входящих в отрезок [start, end]."""
+
+    return [
+        month for month in months_between(start, end)
+        if month >= start and next_month(month) - datetime.timedelta(days=1) <= end
+    ]
+
+
+def partition_name(month):
+    return f"{ANALYTICS_TABLE}_y{month.year}m{month.month:02d}"
+
+
+def cold_partition_name(month):
+    return f"{COLD_ANALYTICS_TABLE}_y{month.year}m{month.month:02d}"
+
+
+def partition_month(name):
+    """Первое число месяца помесячной секции по ее имени, для прочих таблиц - None."""
+
+    match = _PARTITION_MONTH.search(name)
+
+    return datetime.date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def existing_partitions(connection, table=ANALYTICS_TABLE):
+    """Имена секций таблицы аналитик (или холодной таблицы)."""
+
+    return set(connection.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = :table
+    """), {"table": table}).scalars())
+
+
+def ensure_month_partitions(connection, start, end):
+    """Создание недостающих помесячных секций для дат с start по end в текущей транзакции.
+
+    Returns:
+        list[str]: Имена созданных секций
+    """
+
+    if start is None or end is None:
+        return []
+
+    existing = existing_partitions(connection)
+    created = []
+
+    for month in months_between(start, end):
+        name = partition_name(month)
+
+        if name in existing:
+            continue
+
+        connection.execute(text(
+            f"CREATE TABLE {name} PARTITION OF {ANALYTICS_TABLE} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+        ))
+        created.append(name)
+
+    if created:
+        app_logger.info(f"[Part] Созданы секции аналитик: {', '.join(created)}")
+
+    return created
+
+
+def ensure_future_partitions(engine, months_ahead):
+    """Создание секций от текущего месяца на months_ahead месяцев вперед."""
+
+    today = datetime.date.today()
+    end = today
+
+    for _ in range(months_ahead):
+        end = next_month(end)
+
+    with engine.begin() as connection:
+        ensure_month_partitions(connection, month_start(today), end)
+
+
+def window_condition(column, months):
+    """SQL-условие попадания даты в один из месяцев. Для пустой даты и пустого списка месяцев - false."""
+
+    if not months:
+        return "false"
+
+    condition = " OR ".join(
+        f"({column} >= '{month.isoformat()}' AND {column} < '{next_month(month).isoformat()}')"
+        for month in months
+    )
+
+    return f"coalesce({condition}, false)"
@@ -0,0 +1,86 @@
+"""Профиль настроек сессии PostgreSQL на время массовой загрузки.
+
+Настройки ставятся через set_config(..., is_local => true) в начале каждой транзакции сессии загрузки
+и действуют до ее фиксации или отката. Сессия SQLAlchemy возвращает соединение в пул после каждого коммита,
+поэтому обычный SET остался бы на соединении пула и достался бы следующим запросам,
+а локальные настройки снимаются сервером сами - и при ошибке загрузки тоже.
+
+Staging-таблицы загрузки создаются UNLOGGED, а временные таблицы слияния - TEMP,
+поэтому данные в них и так не пишутся в WAL.
+"""
+
+from contextlib import contextmanager
+
+from sqlalchemy import event, text
+
+from app_v3.utils.config import app_config
+from app_v3.utils.logger import app_logger
+
+
+# synchronous_commit = off: коммит чанка не ждет сброса WAL на диск. При сбое сервера теряются
+# последние зафиксированные чанки вместе с их учетом в запуске загрузки, поэтому продолжение запуска
+# загрузит их заново
+DEFAULT_PROFILE = {
+    "synchronous_commit": "off",
+    "work_mem": "64MB",
+    "maintenance_work_mem": "512MB",
+}
+
+# Пустой словарь в настройках отключает профиль
+LOAD_PROFILE = app_config.database.get("loading", {}).get("session_profile", DEFAULT_PROFILE) or {}
+
+
+def _current_settings(session, names):
+    return {
+        name: session.execute(text("SELECT current_setting(:name)"), {"name": name}).scalar()
+        for name in names
+    }
+
+
+@contextmanager
+def bulk_load_profile(session, name, profile=None):
+    """Профиль настроек на транзакции сессии внутри блока with.
+
+    Вложенные блоки на той же сессии профиль повторно не ставят.
+    Примененные и восстановленные значения логируются для аудита.
+
+    Args:
+        session: Сессия SQLAlchemy
+        name: Название загрузки для логов
+        profile: Настройка -> значение, по умолчанию loading.session_profile из настроек
+    """
+
+    profile = LOAD_PROFILE if profile is None else profile
+
+    if not profile or session.bind.dialect.name != "postgresql" or session.info.get("load_profile"):
+        yield
+        return
+
+    def apply(_session, _transaction, connection):
+        for setting, value in profile.items():
+            connection.execute(
+                text("SELECT set_config(:setting, :value, true)"),
+                {"setting": setting, "value": str(value)},
+            )
+
+    previous = _current_settings(session, profile)
+    # Чтение настроек открыло транзакцию - профиль ставится и в нее
+    apply(session, None, session.connection())
+    event.listen(session, "after_begin", apply)
+    session.info["load_profile"] = name
+
+    app_logger.info(
+        f"[Prof] {name}: профиль загрузки - "
+        + ", ".join(f"{setting} {previous[setting]} -> {value}" for setting, value in profile.items()),
+    )
+
+    try:
+        yield
+    finally:
+        event.remove(session, "after_begin", apply)
+        session.info.pop("load_profile", None)
+
+        app_logger.info(
+            f"[Prof] {name}: профиль загрузки снят, восстановлено "
+            + ", ".join(f"{setting} = {previous[setting]}" for setting in profile),
+        )
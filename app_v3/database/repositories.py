@@ -1,37 +1,88 @@
-from sqlalchemy import select
+import datetime
+import os
+import queue
+import time
+import uuid
+import zlib
 
-from app_v3.database.models import Analytics, Specialists
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from sqlalchemy import Column, MetaData, Table, delete, exists, func, or_, select, text, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from app_v3.database.bulk import copy_records, delete_by_keys, supports_copy
+from app_v3.database.chunking import AdaptiveChunkSizer
+from app_v3.database.maintenance import ChangeTracker, maintain_tables
+from app_v3.database.models import (
+    COSMETOLOGY_ADMISSION_TYPE,
+    COSMETOLOGY_DEPARTMENT,
+    Analytics,
+    CosmetologyExport,
+    LoadRun,
+    Specialists,
+)
+from app_v3.database.partitions import (
+    ensure_month_partitions,
+    full_months,
+    month_days,
+    month_start,
+    partition_name,
+    window_condition,
+)
+from app_v3.database.profile import bulk_load_profile
+from app_v3.database.rollups import refresh_daily_rollup
 from app_v3.database.session import get_session
+from app_v3.database.tiering import archived_until
+from app_v3.utils.config import app_config
 from app_v3.utils.logger import app_logger
 
 
+LOADING_CONFIG = app_config.database.get("loading", {})
+
+
 class BaseRepository:
+    chunk_size = 50000
+
     def __init__(self):
         self.session = get_session()
+        # copy - COPY ... FROM STDIN, insert - bulk_insert_mappings
+        self.use_copy = LOADING_CONFIG.get("bulk_mode", "copy") == "copy" and supports_copy(self.session.bind)
+        # Измененные загрузками записи по таблицам - для ANALYZE и VACUUM после загрузки
+        self.changes = ChangeTracker()
 
     def bulk_upload(self, records):
         """Массовая загрузка записей в БД"""
 
         try:
             total_rows = len(records)
-            chunk_size = 50000
             app_logger.info(
-                f"[BRep] Начало массовой загрузки {total_rows} записей (чанки по {chunk_size})",
+                f"[BRep] Начало массовой загрузки {total_rows} записей (начальный чанк {self._sizer().size})",
             )
 
-            for i in range(0, len(records), chunk_size):
-                chunk = records[i:i + chunk_size]
+            with self._load_profile():
+                self._load_chunks([records], total=total_rows)
 
-                self.session.bulk_insert_mappings(self.model, chunk)
-                self.session.commit()
+            msg = f"Загружено записей: {total_rows}"
+            app_logger.info(f"[BRep] {msg}")
+        except Exception as e:
+            self.session.rollback()
 
-                print(
-                    f"\r[BRep] Загрузка: {min(i + chunk_size, total_rows)}/{total_rows} записей...",
-                    end="",
-                    flush=True,
-                )
+            err = f"Ошибка при загрузке данных: {str(e)}"
+            app_logger.error(f"[BRep] {err}", exc_info=True)
+            raise
+
+    def bulk_upload_stream(self, batches):
+        """Массовая загрузка записей, поступающих пачками, без накопления всех записей в памяти"""
+
+        try:
+            app_logger.info("[BRep] Начало потоковой загрузки записей")
+
+            with self._load_profile():
+                total_rows = self._load_chunks(batches)
 
-            print()
             msg = f"Загружено записей: {total_rows}"
             app_logger.info(f"[BRep] {msg}")
         except Exception as e:
@@ -41,6 +92,113 @@ class BaseRepository:
             app_logger.error(f"[BRep] {err}", exc_info=True)
             raise
 
+        return total_rows
+
+    def _load_profile(self):
+        """Профиль настроек сессии на время массовой загрузки в таблицу модели."""
+
+        return bulk_load_profile(self.session, self.model.__tablename__)
+
+    def _sizer(self):
+        return AdaptiveChunkSizer(
+            self.model.__tablename__,
+            initial=self.chunk_size,
+            target_seconds=LOADING_CONFIG.get("target_chunk_seconds", 2.0),
+            max_size=LOADING_CONFIG.get("max_chunk_size", 500000),
+        )
+
+    def _load_chunks(self, batches, table=None, total=None, progress=True):
+        """Вставка пачек чанками адаптивного размера, каждый чанк фиксируется отдельно.
+
+        Args:
+            batches: Пачки записей
+            table: Таблица SQLAlchemy, если грузим не в таблицу модели
+            total: Общее количество записей, если известно заранее - для вывода прогресса
+            progress: Выводить ли прогресс в консоль (параллельные загрузчики его не выводят)
+
+        Returns:
+            int: Количество загруженных записей
+        """
+
+        # Рабочие таблицы одноразовые, размер чанка для них подбирается по живой таблице
+        sizer = self._sizer()
+        loaded = 0
+
+        for batch in batches:
+            for chunk in sizer.split(batch):
+                start = time.monotonic()
+                size = self._insert_chunk(chunk, table)
+                self._before_commit(chunk, table)
+                self.session.commit()
+
+                if table is None:
+                    self._track_changes(chunk)
+
+                sizer.record(len(chunk), time.monotonic() - start, size)
+                loaded += len(chunk)
+
+                if progress:
+                    counter = f"{loaded}/{total}" if total is not None else f"{loaded}"
+                    print(f"\r[BRep] Загрузка: {counter} записей ({sizer.rate:.0f} записей/с)...", end="", flush=True)
+
+        if progress:
+            print()
+
+        sizer.report()
+
+        return loaded
+
+    def _before_commit(self, chunk, table=None):
+        """Действия в транзакции чанка перед его фиксацией. По умолчанию - никаких."""
+
+    def _track_changes(self, chunk):
+        """Учет зафиксированного чанка, вставленного в таблицу модели."""
+
+        self.changes.add(self.model.__tablename__, len(chunk))
+
+    def maintain(self):
+        """ANALYZE и VACUUM таблиц, изменившихся после прошлого вызова больше порогов.
+
+        Ошибка обслуживания загрузку не отменяет: данные уже зафиксированы, а статистику догонит autovacuum.
+        """
+
+        try:
+            maintain_tables(self.session.bind, self.changes.take())
+        except Exception as e:
+            app_logger.warning(f"[BRep] Ошибка обслуживания таблиц после загрузки: {str(e)}")
+
+    def _work_table(self, name):
+        """Рабочая таблица с колонками модели без первичного ключа - для загрузки через _insert_chunk."""
+
+        data_columns = [column for column in self.model.__table__.columns if not column.primary_key]
+
+        return Table(name, MetaData(), *(Column(column.name, column.type) for column in data_columns))
+
+    def _insert_chunk(self, chunk, table=None):
+        """Вставка чанка через COPY. При ошибке COPY чанк вставляется через bulk_insert_mappings,
+        и до конца жизни репозитория используется обычная вставка.
+
+        Args:
+            chunk: Список словарей колонка -> значение
+            table: Таблица SQLAlchemy, если грузим не в таблицу модели (например, в staging)
+
+        Returns:
+            int | None: Объем переданных через COPY данных в символах, None для обычной вставки
+        """
+
+        if self.use_copy:
+            try:
+                with self.session.begin_nested():
+                    return copy_records(self.session, self.model.__table__ if table is None else table, chunk)
+            except (SQLAlchemyError, psycopg2.Error) as e:
+                self.use_copy = False
+                app_logger.warning(f"[BRep] Ошибка COPY, переход на bulk_insert_mappings: {str(e)}")
+
+        if table is None:
+            self.session.bulk_insert_mappings(self.model, chunk)
+        else:
+            self.session.execute(table.insert(), chunk)
+
 class AnalyticsRepository(BaseRepository):
     """Репозиторий для работы с моделью аналитик."""
 
@@ -48,11 +206,857 @@ class AnalyticsRepository(BaseRepository):
         super().__init__()
 
         self.model = Analytics
+        # replace - через staging-таблицу с атомарной подменой, delete - удаление перед вставкой,
+        # upsert - INSERT ... ON CONFLICT по коду экземпляра и дате выполнения
+        self.period_mode = LOADING_CONFIG.get("period_mode", "replace")
+        # Количество соединений, параллельно загружающих staging в режиме replace, и разбиение записей
+        # между ними: month - по месяцу (секции) даты выполнения, hash - по хешу кода экземпляра
+        self.parallel_workers = LOADING_CONFIG.get("parallel_workers", 1)
+        self.parallel_split = LOADING_CONFIG.get("parallel_split", "month")
+        # Запуск текущей загрузки, его этапы и дни, итоги за которые пересчитываются при фиксации ближайшего чанка
+        self.run = None
+        self._run_stages = {}
+        self._dirty_days = set()
+        # Коды экземпляров и ключи (код, дата выполнения) уже вставленных в режиме delete записей,
+        # включая пропущенные при продолжении запуска: старые записи этих кодов уже удалены,
+        # а повтор ключа в следующей пачке заменяет вставленную ранее запись
+        self._committed_codes = set()
+        self._committed_keys = set()
+        # Даты выполнения, записи без кода экземпляра за которые уже заменены в режиме upsert
+        # (None - записи без даты), включая даты пачек, пропущенных при продолжении запуска
+        self._codeless_days = set()
 
     def delete_records(self, _filter):
         deleted = self.session.query(Analytics).filter(_filter).delete(synchronize_session=False)
         app_logger.info(f"[ARep] удалено старых записей за период: {deleted}")
 
+    def delete_by_instance_codes(self, instance_codes):
+        """Удаление записей по набору кодов экземпляров соединением с временной таблицей ключей.
+
+        Returns:
+            list: Даты выполнения удаленных записей
+        """
+
+        days = delete_by_keys(
+            self.session,
+            Analytics.__table__,
+            Analytics.__table__.c.instance_code,
+            instance_codes,
+            use_copy=self.use_copy,
+            returning=Analytics.__table__.c.execution_date,
+        )
+        app_logger.info(f"[ARep] удалено старых записей за период: {len(days)}")
+        self.changes.add_days(days)
+
+        return days
+
+    def load_mode(self, from_scratch):
+        """Способ загрузки: replace (только PostgreSQL, на прочих СУБД - delete), upsert или delete."""
+
+        partitioned = self.session.bind.dialect.name == "postgresql"
+
+        if from_scratch and self.period_mode == "replace" and partitioned:
+            return "replace"
+
+        if self.period_mode == "upsert" or not from_scratch:
+            return "upsert"
+
+        return "delete"
+
+    def load_period(self, batches, from_scratch, window=None, run=None):
+        """Загрузка аналитик за период. Возвращает количество загруженных записей.
+
+        При from_scratch записи с кодами экземпляров из выгрузки перезаписываются:
+        в режиме replace - через staging-таблицу, в режиме delete - удалением перед вставкой каждой пачки,
+        в режиме upsert - вставкой с обновлением по коду экземпляра.
+        Загрузка без from_scratch всегда идет через upsert, поэтому повторная загрузка
+        того же дня не плодит дублей. Если передан window - отрезок дат выгрузки, секции месяцев,
+        целиком входящих в него, очищаются и заполняются заново вместо удаления по кодам.
+
+        Если передан run - запуск загрузки, записи помечаются его id, а зафиксированные чанки
+        учитываются в нем в тех же транзакциях. У продолженного запуска уже зафиксированные записи
+        пропускаются, а секции окна повторно не очищаются.
+        Дневные итоги за затронутые дни пересчитываются в транзакциях загрузки.
+        Загрузка записей за годы, перенесенные в холодную таблицу, прерывается ошибкой.
+        """
+
+        mode = self.load_mode(from_scratch)
+        partitioned = self.session.bind.dialect.name == "postgresql"
+        months = full_months(*window) if from_scratch and window and partitioned else []
+        archived = archived_until(self.session) if partitioned else None
+
+        self.run = run
+        self._run_stages = dict(run.stages or {}) if run is not None else {}
+        self._dirty_days = set()
+        self._committed_codes = set()
+        self._committed_keys = set()
+        self._codeless_days = set()
+
+        if archived is not None:
+            if window and window[0] and window[0] < archived:
+                raise ValueError(
+                    f"Окно загрузки с {window[0]:%d.%m.%Y} захватывает год в холодной таблице "
+                    f"(до {archived:%d.%m.%Y})",
+                )
+
+            batches = self._reject_archived(batches, archived)
+
+        if run is not None:
+            batches = self._stamped(batches, run.id)
+
+            if run.rows_committed:
+                app_logger.info(
+                    f"[ARep] Продолжение запуска {run.id}: пропускается {run.rows_committed} загруженных записей",
+                )
+                batches = self._skip_committed(batches, run.rows_committed)
+                months = []
+
+        with self._load_profile():
+            if mode == "replace":
+                return self.replace_stream(batches, months)
+
+            if mode == "upsert" and partitioned:
+                return self.upsert_stream(batches, months)
+
+            if mode == "upsert":
+                return self.upsert_rows(batches)
+
+            if partitioned:
+                batches = self._ensure_partitions(batches)
+
+            if mode == "delete":
+                batches = self._delete_rewritten(batches, months)
+
+            loaded = self.bulk_upload_stream(batches)
+
+            self._stage("load", "completed", rows=loaded)
+            self._commit_progress(0)
+            self.session.commit()
+
+        return loaded
+
+    def rollback_run(self, run):
+        """Откат запуска загрузки: удаление записей, которые он добавил или изменил, и пересчет итогов.
+
+        Записи, которые запуск удалил или перезаписал, не восстанавливаются -
+        для этого нужно повторно загрузить предыдущую выгрузку.
+
+        Returns:
+            int: Количество удаленных записей
+        """
+
+        table = Analytics.__table__
+
+        try:
+            days = self.session.execute(
+                delete(table).where(table.c.load_run_id == run.id).returning(table.c.execution_date),
+            ).scalars().all()
+            refreshed = refresh_daily_rollup(self.session, days)
+
+            run.status = "rolled_back"
+            run.finished_at = datetime.datetime.now()
+            self.session.execute(
+                update(LoadRun).where(LoadRun.id == run.id).values(status=run.status, finished_at=run.finished_at),
+            )
+            self.session.commit()
+        except Exception as e:
+            self.session.rollback()
+
+            err = f"Ошибка при откате запуска {run.id}: {str(e)}"
+            app_logger.error(f"[ARep] {err}", exc_info=True)
+            raise
+
+        app_logger.info(f"[ARep] Запуск {run.id} откачен: удалено записей {len(days)}, пересчитано дней {refreshed}")
+        self.changes.add_days(days)
+        self.maintain()
+
+        return len(days)
+
+    def _stamped(self, batches, run_id):
+        """Пометка записей пачек запуском загрузки."""
+
+        for chunk in batches:
+            for record in chunk:
+                record["load_run_id"] = run_id
+
+            yield chunk
+
+    def _reject_archived(self, batches, archived):
+        """Проверка, что в пачках нет записей с датой выполнения раньше archived.
+
+        Закрытые годы в холодной таблице только читаются: загрузка записей за них прерывается ошибкой,
+        а не теряет их молча - такие годы нужно вернуть из холодной таблицы или не переносить.
+        """
+
+        for chunk in batches:
+            for record in chunk:
+                if record.get("execution_date") and record["execution_date"] < archived:
+                    raise ValueError(
+                        f"Запись {record.get('instance_code')} за {record['execution_date']:%d.%m.%Y} "
+                        f"относится к году в холодной таблице (до {archived:%d.%m.%Y})",
+                    )
+
+            yield chunk
+
+    def _skip_committed(self, batches, rows):
+        """Пропуск первых rows записей, зафиксированных прерванной загрузкой, с учетом их кодов экземпляров."""
+
+        for chunk in batches:
+            skipped = chunk[:rows]
+            self._committed_codes.update(record["instance_code"] for record in skipped)
+            self._committed_keys.update(self._unique_keys(skipped))
+            self._codeless_days.update(record.get("execution_date") for record in skipped)
+
+            if rows >= len(chunk):
+                rows -= len(chunk)
+                continue
+
+            yield chunk[rows:]
+            rows = 0
+
+    def _stage(self, name, status, **counts):
+        """Отметка этапа в запуске загрузки в текущей транзакции."""
+
+        if self.run is None:
+            return
+
+        self._run_stages = {**self._run_stages, name: {"status": status, **counts}}
+        self.session.execute(update(LoadRun).where(LoadRun.id == self.run.id).values(stages=self._run_stages))
+
+    def _commit_progress(self, rows):
+        """Пересчет итогов за накопленные дни и учет записей в запуске - в транзакции, которую фиксируем."""
+
+        refresh_daily_rollup(self.session, self._dirty_days)
+        self._dirty_days = set()
+
+        # Объект запуска принадлежит сессии LoadRunRepository и здесь не меняется: если фиксация не удастся,
+        # fail() записал бы в запуск незафиксированные записи, и продолжение пропустило бы их
+        if self.run is not None and rows:
+            self.session.execute(
+                update(LoadRun).where(LoadRun.id == self.run.id).values(rows_committed=LoadRun.rows_committed + rows),
+            )
+
+    def _before_commit(self, chunk, table=None):
+        """Загрузка в рабочие таблицы живую таблицу не меняет: итоги и запуск обновляются при подмене."""
+
+        if table is not None:
+            return
+
+        self._dirty_days.update(record.get("execution_date") for record in chunk)
+        self._commit_progress(len(chunk))
+
+    def _track_changes(self, chunk):
+        self.changes.add_days(record.get("execution_date") for record in chunk)
+
+    def replace_stream(self, batches, months=()):
+        """Перезапись аналитик за период через UNLOGGED staging-таблицу.
+
+        Выгрузка грузится в staging, там же строится разница с живой таблицей по кодам экземпляров.
+        Совпадающие записи не трогаются, а удаление измененных и вставка новых делаются в одной
+        короткой транзакции - читатели не видят частично загруженных данных,
+        а при ошибке живая таблица остается как была.
+        Секции месяцев из months в той же транзакции очищаются TRUNCATE и заполняются из staging целиком.
+        """
+
+        live = Analytics.__tablename__
+        suffix = uuid.uuid4().hex[:8]
+        staging = f"{live}_staging_{suffix}"
+        incoming = f"{live}_incoming_{suffix}"
+        current = f"{live}_current_{suffix}"
+        doomed = f"{live}_doomed_{suffix}"
+
+        data_columns = [column for column in Analytics.__table__.columns if not column.primary_key]
+        columns = ", ".join(column.name for column in data_columns)
+
+        # Запуск загрузки - не данные: запись, не изменившаяся по существу, остается со старым запуском
+        hashed_columns = [column for column in data_columns if column.name != "load_run_id"]
+
+        def row_hash(alias):
+            return f"md5(ROW({', '.join(f'{alias}.{column.name}' for column in hashed_columns)})::text)"
+
+        total_rows = 0
+
+        try:
+            app_logger.info(f"[ARep] Загрузка аналитик в staging-таблицу {staging}")
+
+            self.session.execute(text(f"CREATE UNLOGGED TABLE {staging} AS SELECT {columns} FROM {live} WITH NO DATA"))
+            self.session.commit()
+
+            if self.parallel_workers > 1:
+                total_rows = self._load_staging_parallel(batches, staging)
+            else:
+                total_rows = self._load_chunks(batches, self._work_table(staging))
+            self._stage("staging", "completed", rows=total_rows)
+
+            start, end = self.session.execute(
+                text(f"SELECT min(execution_date), max(execution_date) FROM {staging}"),
+            ).one()
+            ensure_month_partitions(self.session, start, end)
+            months = self._months_to_truncate(staging, months)
+            self.session.commit()
+
+            # Из повторов кода экземпляра в пределах даты выполнения остается последняя загруженная строка.
+            # Одинаковые строки с одним кодом нумеруются, чтобы дубли сопоставлялись один к одному
+            self.session.execute(text(f"""
+                CREATE UNLOGGED TABLE {incoming} AS
+                SELECT {columns}, row_hash, row_number() OVER (PARTITION BY instance_code, row_hash) AS row_num
+                FROM (
+                    SELECT s.*, {row_hash("s")} AS row_hash,
+                           row_number() OVER (PARTITION BY instance_code, execution_date ORDER BY s.ctid DESC) AS dup_num
+                    FROM {staging} s
+                ) t
+                WHERE dup_num = 1 OR coalesce(instance_code, '') = '' OR execution_date IS NULL
+            """))
+            self.session.execute(text(f"CREATE INDEX ON {incoming} (instance_code)"))
+            self.session.execute(text(f"ANALYZE {incoming}"))
+
+            self.session.execute(text(f"""
+                CREATE UNLOGGED TABLE {current} AS
+                SELECT id, instance_code, row_hash,
+                       row_number() OVER (PARTITION BY instance_code, row_hash) AS row_num
+                FROM (
+                    SELECT l.id, l.instance_code, {row_hash("l")} AS row_hash
+                    FROM {live} l
+                    WHERE l.instance_code IN (SELECT instance_code FROM {incoming})
+                      AND NOT {window_condition("l.execution_date", months)}
+                ) t
+            """))
+            self.session.execute(text(f"ANALYZE {current}"))
+
+            match = (
+                "c.instance_code = i.instance_code AND c.row_hash = i.row_hash AND c.row_num = i.row_num"
+            )
+            self.session.execute(text(f"""
+                CREATE UNLOGGED TABLE {doomed} AS
+                SELECT c.id FROM {current} c
+                WHERE NOT EXISTS (SELECT 1 FROM {incoming} i WHERE {match})
+            """))
+            unchanged = self.session.execute(text(f"DELETE FROM {incoming} i USING {current} c WHERE {match}")).rowcount
+            self.session.commit()
+
+            # Подмена: одна короткая транзакция по живой таблице вместе с пересчетом итогов
+            self._dirty_days.update(
+                self.session.execute(text(f"SELECT DISTINCT execution_date FROM {incoming}")).scalars(),
+            )
+
+            for month in months:
+                self.session.execute(text(f"TRUNCATE {partition_name(month)}"))
+                self._dirty_days.update(month_days(month))
+
+            inserted_months = self.session.execute(text(f"""
+                SELECT CAST(date_trunc('month', execution_date) AS date), count(*) FROM {incoming} GROUP BY 1
+            """)).all()
+            deleted_days = self.session.execute(
+                text(f"DELETE FROM {live} l USING {doomed} d WHERE l.id = d.id RETURNING l.execution_date"),
+            ).scalars().all()
+            self._dirty_days.update(deleted_days)
+            deleted = len(deleted_days)
+            inserted = self.session.execute(
+                text(f"INSERT INTO {live} ({columns}) SELECT {columns} FROM {incoming}"),
+            ).rowcount
+
+            self._stage(
+                "swap",
+                "completed",
+                deleted=deleted,
+                inserted=inserted,
+                unchanged=unchanged,
+                partitions=len(months),
+            )
+            self._commit_progress(total_rows)
+            self.session.commit()
+
+            self.changes.add_days(deleted_days)
+            self.changes.add_months(inserted_months)
+
+            app_logger.info(
+                f"[ARep] Аналитики за период заменены: удалено {deleted}, добавлено {inserted}, "
+                f"без изменений {unchanged}, очищено секций {len(months)}",
+            )
+        except Exception as e:
+            self.session.rollback()
+
+            err = f"Ошибка при перезаписи аналитик через staging: {str(e)}"
+            app_logger.error(f"[ARep] {err}", exc_info=True)
+            raise
+        finally:
+            # CASCADE - вместе с частями staging параллельной загрузки
+            self.session.execute(text(f"DROP TABLE IF EXISTS {staging}, {incoming}, {current}, {doomed} CASCADE"))
+            self.session.commit()
+
+        return total_rows
+
+    def _load_staging_parallel(self, batches, staging):
+        """Параллельная загрузка staging несколькими соединениями пула.
+
+        У staging создаются части - UNLOGGED-таблицы, наследующие ее, по одной на загрузчик.
+        Записи пачек раскладываются между загрузчиками по месяцу даты выполнения или хешу кода экземпляра,
+        каждый загрузчик в своем потоке и своей сессии грузит свою часть через COPY чанками.
+        Все повторы кода экземпляра в пределах даты попадают в одну часть в порядке выгрузки,
+        поэтому выбор последней строки по ctid при построении разницы остается верным.
+        Запросы к staging читают и части, а подмена живой таблицы по-прежнему одна транзакция.
+
+        Returns:
+            int: Количество загруженных записей
+        """
+
+        workers = self.parallel_workers
+        parts = [f"{staging}_part{i}" for i in range(workers)]
+
+        for part in parts:
+            self.session.execute(text(f"CREATE UNLOGGED TABLE {part} () INHERITS ({staging})"))
+        self.session.commit()
+
+        app_logger.info(
+            f"[ARep] Параллельная загрузка staging: {workers} соединений, разбиение по {self.parallel_split}",
+        )
+
+        start = time.monotonic()
+        queues = [queue.Queue(maxsize=2) for _ in parts]
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="staging") as executor:
+            futures = [
+                executor.submit(self._load_staging_part, part_queue, self._work_table(part))
+                for part_queue, part in zip(queues, parts)
+            ]
+
+            try:
+                for batch in batches:
+                    groups = [[] for _ in parts]
+
+                    for record in batch:
+                        groups[self._part_index(record, workers)].append(record)
+
+                    for part_queue, group in zip(queues, groups):
+                        if group:
+                            part_queue.put(group)
+
+                    # Ошибка одного загрузчика прекращает разбор выгрузки
+                    if any(future.done() for future in futures):
+                        break
+            finally:
+                for part_queue in queues:
+                    part_queue.put(None)
+
+            loaded = [future.result() for future in futures]
+
+        total_rows = sum(loaded)
+        seconds = time.monotonic() - start
+        app_logger.info(
+            f"[ARep] staging загружена за {seconds:.1f} с ({total_rows / seconds if seconds else 0:.0f} записей/с), "
+            f"записей по частям: {', '.join(map(str, loaded))}",
+        )
+
+        return total_rows
+
+    def _load_staging_part(self, part_queue, table):
+        """Загрузчик части staging: пачки из очереди до None, в собственной сессии."""
+
+        repository = AnalyticsRepository()
+
+        try:
+            with repository._load_profile():
+                return repository._load_chunks(iter(part_queue.get, None), table, progress=False)
+        except BaseException:
+            # Очередь вычитывается до конца, чтобы раскладывающий пачки поток не заблокировался
+            for _ in iter(part_queue.get, None):
+                pass
+
+            raise
+        finally:
+            repository.session.close()
+
+    def _part_index(self, record, workers):
+        """Номер части staging для записи. Записи без даты или кода попадают в первую часть."""
+
+        if self.parallel_split == "hash":
+            code = record.get("instance_code")
+
+            return zlib.crc32(code.encode()) % workers if code else 0
+
+        day = record.get("execution_date")
+
+        return (day.year * 12 + day.month) % workers if day else 0
+
+    def _months_to_truncate(self, staging, months):
+        """Месяцы окна, по которым в выгрузке есть записи.
+
+        Пустой месяц в выгрузке скорее говорит о неполной выгрузке, чем об отсутствии приемов,
+        поэтому такие секции не очищаются.
+        """
+
+        if not months:
+            return []
+
+        loaded = set(self.session.execute(text(f"""
+            SELECT DISTINCT CAST(date_trunc('month', execution_date) AS date) FROM {staging}
+            WHERE {window_condition("execution_date", months)}
+        """)).scalars())
+        self._warn_untouched_months([month for month in months if month not in loaded])
+
+        return [month for month in months if month in loaded]
+
+    @staticmethod
+    def _warn_untouched_months(skipped):
+        if skipped:
+            app_logger.warning(
+                f"[ARep] В выгрузке нет записей за месяцы {', '.join(m.strftime('%m.%Y') for m in skipped)}, "
+                f"их секции не очищаются",
+            )
+
+    def _truncate_loaded_months(self, batches, months):
+        """Очистка секций месяцев из months перед первой пачкой, в которой есть записи за месяц.
+
+        Очистка идет в транзакции этой пачки. Как и в replace_stream, месяцы окна, за которые
+        в выгрузке нет записей, не очищаются - это скорее неполная выгрузка, чем месяц без приемов.
+        """
+
+        pending = set(months)
+
+        for chunk in batches:
+            loaded = pending & {
+                month_start(record["execution_date"]) for record in chunk if record.get("execution_date")
+            }
+
+            for month in sorted(loaded):
+                ensure_month_partitions(self.session, month, month)
+                self.session.execute(text(f"TRUNCATE {partition_name(month)}"))
+                self._dirty_days.update(month_days(month))
+
+            if loaded:
+                pending -= loaded
+                app_logger.info(
+                    f"[ARep] Очищены секции за период: {', '.join(m.strftime('%m.%Y') for m in sorted(loaded))}",
+                )
+
+            yield chunk
+
+        self._warn_untouched_months(sorted(pending))
+
+    def upsert_stream(self, batches, months=()):
+        """Идемпотентная загрузка аналитик: каждая пачка - один INSERT ... ON CONFLICT в своей транзакции.
+
+        Пачка загружается во временную таблицу, из повторов кода экземпляра в пределах даты выполнения
+        берется последняя запись. Новые записи добавляются, изменившиеся обновляются на месте,
+        совпадающие не трогаются. Запись, у которой сменилась дата выполнения, удаляется со старой даты.
+        Записи без кода экземпляра или без даты выполнения уникальностью не ограничены: прежние такие
+        записи за даты выполнения выгрузки удаляются перед первой пачкой с этими датами.
+        Секции месяцев из months очищаются перед первой пачкой с записями за месяц.
+        """
+
+        live = Analytics.__tablename__
+        temp = f"{live}_upsert_{uuid.uuid4().hex[:8]}"
+
+        data_columns = [column.name for column in Analytics.__table__.columns if not column.primary_key]
+        key_columns = ("instance_code", "execution_date")
+        columns = ", ".join(data_columns)
+        updated_columns = [column for column in data_columns if column not in key_columns]
+        # Запись, не изменившаяся по существу, остается со старым запуском загрузки
+        compared_columns = [column for column in updated_columns if column != "load_run_id"]
+        quote = self.session.bind.dialect.identifier_preparer.quote
+        assignments = ", ".join(f"{quote(column)} = EXCLUDED.{quote(column)}" for column in updated_columns)
+        current = ", ".join(f"{live}.{quote(column)}" for column in compared_columns)
+        excluded = ", ".join(f"EXCLUDED.{quote(column)}" for column in compared_columns)
+
+        work_table = self._work_table(temp)
+        total_rows = inserted = updated = moved = 0
+
+        try:
+            app_logger.info("[ARep] Начало загрузки аналитик с обновлением по коду экземпляра")
+
+            for chunk in self._ensure_partitions(self._delete_codeless(self._truncate_loaded_months(batches, months))):
+                self.session.execute(text(
+                    f"CREATE TEMP TABLE {temp} ON COMMIT DROP AS SELECT {columns} FROM {live} WITH NO DATA"
+                ))
+                # Порядковый номер строки выгрузки, чтобы из повторов брать последнюю
+                self.session.execute(text(f"ALTER TABLE {temp} ADD COLUMN row_num bigserial"))
+                self._insert_chunk(chunk, work_table)
+
+                moved_days = self.session.execute(text(f"""
+                    DELETE FROM {live} l USING {temp} t
+                    WHERE t.instance_code <> '' AND l.instance_code = t.instance_code
+                      AND (l.execution_date IS DISTINCT FROM t.execution_date OR t.execution_date IS NULL)
+                    RETURNING l.execution_date
+                """)).scalars().all()
+
+                # xmax для различения вставки и обновления у секционированной таблицы недоступен,
+                # поэтому новые ключи считаются до вставки
+                new_keys = self.session.execute(text(f"""
+                    SELECT count(DISTINCT (t.instance_code, t.execution_date)) FROM {temp} t
+                    WHERE t.instance_code <> '' AND t.execution_date IS NOT NULL
+                      AND NOT EXISTS (
+                          SELECT 1 FROM {live} l
+                          WHERE l.instance_code = t.instance_code AND l.execution_date = t.execution_date
+                      )
+                """)).scalar()
+
+                upserted_days = self.session.execute(text(f"""
+                    INSERT INTO {live} ({columns})
+                    SELECT DISTINCT ON (instance_code, execution_date) {columns}
+                    FROM {temp}
+                    WHERE instance_code <> '' AND execution_date IS NOT NULL
+                    ORDER BY instance_code, execution_date, row_num DESC
+                    ON CONFLICT (instance_code, execution_date) WHERE instance_code <> '' DO UPDATE SET {assignments}
+                    WHERE ({current}) IS DISTINCT FROM ({excluded})
+                    RETURNING execution_date
+                """)).scalars().all()
+
+                plain_days = self.session.execute(text(f"""
+                    INSERT INTO {live} ({columns})
+                    SELECT {columns} FROM {temp}
+                    WHERE coalesce(instance_code, '') = '' OR execution_date IS NULL
+                    RETURNING execution_date
+                """)).scalars().all()
+
+                inserted += len(plain_days) + new_keys
+                updated += len(upserted_days) - new_keys
+                moved += len(moved_days)
+                total_rows += len(chunk)
+
+                self._dirty_days.update(moved_days)
+                self._dirty_days.update(record.get("execution_date") for record in chunk)
+                self._stage("upsert", "running", rows=total_rows, inserted=inserted, updated=updated, moved=moved)
+                self._commit_progress(len(chunk))
+                self.session.commit()
+
+                self.changes.add_days(moved_days)
+                self.changes.add_days(upserted_days)
+                self.changes.add_days(plain_days)
+
+                print(f"\r[ARep] Загрузка: {total_rows} записей...", end="", flush=True)
+
+            print()
+
+            self._stage("upsert", "completed", rows=total_rows, inserted=inserted, updated=updated, moved=moved)
+            self._commit_progress(0)
+            self.session.commit()
+
+            app_logger.info(
+                f"[ARep] Аналитики загружены: добавлено {inserted}, обновлено {updated}, "
+                f"перенесено с другой даты {moved}, без изменений {total_rows - inserted - updated}",
+            )
+        except Exception as e:
+            self.session.rollback()
+
+            err = f"Ошибка при загрузке аналитик с обновлением: {str(e)}"
+            app_logger.error(f"[ARep] {err}", exc_info=True)
+            raise
+
+        return total_rows
+
+    def upsert_rows(self, batches):
+        """Загрузка с обновлением по коду экземпляра и дате выполнения без временных таблиц и COPY - для SQLite.
+
+        Повторяет upsert_stream средствами INSERT ... ON CONFLICT SQLite: из повторов ключа в пачке
+        берется последняя запись, записи, у которых сменилась дата выполнения, удаляются со старой даты,
+        совпадающие записи не обновляются, записи без кода заменяются за даты выгрузки.
+        Каждая пачка фиксируется отдельно.
+        """
+
+        table = Analytics.__table__
+        key_columns = ("instance_code", "execution_date")
+        data_columns = [column.name for column in table.columns if not column.primary_key]
+        updated_columns = [column for column in data_columns if column not in key_columns]
+        compared_columns = [column for column in updated_columns if column != "load_run_id"]
+
+        statement = sqlite_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.instance_code, table.c.execution_date],
+            index_where=text("instance_code <> ''"),
+            set_={column: statement.excluded[column] for column in updated_columns},
+            where=or_(*(table.c[column].is_distinct_from(statement.excluded[column]) for column in compared_columns)),
+        )
+
+        total_rows = inserted = updated = moved = 0
+
+        try:
+            app_logger.info("[ARep] Начало загрузки аналитик с обновлением по коду экземпляра")
+
+            for chunk in self._delete_codeless(batches):
+                latest = {}
+                plain = []
+
+                for record in chunk:
+                    if record.get("instance_code") and record.get("execution_date"):
+                        latest[(record["instance_code"], record["execution_date"])] = record
+                    else:
+                        plain.append(record)
+
+                codes = list({code for code, _ in latest})
+                current = []
+
+                for i in range(0, len(codes), 10000):
+                    current += self.session.execute(
+                        select(table.c.id, table.c.instance_code, table.c.execution_date)
+                        .where(table.c.instance_code.in_(codes[i:i + 10000])),
+                    ).all()
+
+                moved_rows = [row for row in current if (row.instance_code, row.execution_date) not in latest]
+                current_keys = {(row.instance_code, row.execution_date) for row in current}
+
+                for i in range(0, len(moved_rows), 10000):
+                    ids = [row.id for row in moved_rows[i:i + 10000]]
+                    self.session.execute(delete(table).where(table.c.id.in_(ids)))
+
+                upserted = self.session.execute(statement, list(latest.values())).rowcount if latest else 0
+
+                if plain:
+                    self.session.execute(table.insert(), plain)
+
+                new_keys = sum(1 for key in latest if key not in current_keys)
+                inserted += new_keys + len(plain)
+                updated += upserted - new_keys
+                moved += len(moved_rows)
+                total_rows += len(chunk)
+
+                moved_days = [row.execution_date for row in moved_rows]
+                self._dirty_days.update(moved_days)
+                self._dirty_days.update(record.get("execution_date") for record in chunk)
+                self._stage("upsert", "running", rows=total_rows, inserted=inserted, updated=updated, moved=moved)
+                self._commit_progress(len(chunk))
+                self.session.commit()
+
+                self.changes.add_days(moved_days)
+                self.changes.add_days(record.get("execution_date") for record in chunk)
+
+                print(f"\r[ARep] Загрузка: {total_rows} записей...", end="", flush=True)
+
+            print()
+
+            self._stage("upsert", "completed", rows=total_rows, inserted=inserted, updated=updated, moved=moved)
+            self._commit_progress(0)
+            self.session.commit()
+
+            app_logger.info(
+                f"[ARep] Аналитики загружены: добавлено {inserted}, обновлено {updated}, "
+                f"перенесено с другой даты {moved}, без изменений {total_rows - inserted - updated}",
+            )
+        except Exception as e:
+            self.session.rollback()
+
+            err = f"Ошибка при загрузке аналитик с обновлением: {str(e)}"
+            app_logger.error(f"[ARep] {err}", exc_info=True)
+            raise
+
+        return total_rows
+
+    def _ensure_partitions(self, batches):
+        """Создание недостающих секций под даты выполнения каждой пачки до ее вставки."""
+
+        for chunk in batches:
+            dates = [record["execution_date"] for record in chunk if record.get("execution_date")]
+
+            if dates:
+                ensure_month_partitions(self.session, min(dates), max(dates))
+
+            yield chunk
+
+    def _delete_rewritten(self, batches, months=()):
+        """Удаление перезаписываемых записей перед вставкой каждой пачки.
+
+        Секции месяцев из months очищаются целиком перед первой пачкой с записями за месяц.
+        Коды, встречавшиеся в предыдущих пачках, повторно не удаляются - как и коды из пачек,
+        пропущенных при продолжении запуска (_skip_committed пополняет этот же набор до выдачи пачки).
+        Повторы ключа внутри пачки убирает обработка выгрузки, а ключ, уже вставленный предыдущей пачкой
+        (чанки обрабатываются независимо), удаляется - из повторов, как и в upsert, остается последняя запись.
+        """
+
+        seen_codes = self._committed_codes
+        seen_keys = self._committed_keys
+        replaced = 0
+
+        for chunk in self._truncate_loaded_months(batches, months):
+            instance_codes = {record["instance_code"] for record in chunk} - seen_codes
+            keys = set(self._unique_keys(chunk))
+            repeated = keys & seen_keys
+            seen_codes.update(instance_codes)
+            seen_keys.update(keys)
+
+            if instance_codes:
+                self._dirty_days.update(self.delete_by_instance_codes(instance_codes))
+
+            if repeated:
+                days = self._delete_keys(repeated)
+                self._dirty_days.update(days)
+                replaced += len(days)
+
+            yield chunk
+
+        if replaced:
+            app_logger.info(f"[ARep] Заменено записей, повторенных в разных пачках: {replaced}")
+
+    def _delete_codeless(self, batches):
+        """Удаление прежних записей без кода экземпляра за даты выполнения пачки перед ее вставкой.
+
+        Ключа у таких записей нет, поэтому в режиме upsert они не обновляются, а заменяются целиком
+        за каждую дату выгрузки. Дата очищается один раз - перед первой пачкой с записями за нее,
+        чтобы следующие пачки не удаляли вставленное предыдущими.
+        """
+
+        table = Analytics.__table__
+        codeless = or_(table.c.instance_code.is_(None), table.c.instance_code == "")
+        deleted = 0
+
+        for chunk in batches:
+            days = {record.get("execution_date") for record in chunk} - self._codeless_days
+            self._codeless_days.update(days)
+            dated = list(days - {None})
+            removed = []
+
+            for i in range(0, len(dated), 10000):
+                removed += self.session.execute(
+                    delete(table)
+                    .where(codeless, table.c.execution_date.in_(dated[i:i + 10000]))
+                    .returning(table.c.execution_date),
+                ).scalars().all()
+
+            if None in days:
+                removed += self.session.execute(
+                    delete(table).where(codeless, table.c.execution_date.is_(None)).returning(table.c.execution_date),
+                ).scalars().all()
+
+            if removed:
+                self._dirty_days.update(removed)
+                self.changes.add_days(removed)
+                deleted += len(removed)
+
+            yield chunk
+
+        if deleted:
+            app_logger.info(f"[ARep] Удалено прежних записей без кода экземпляра за даты выгрузки: {deleted}")
+
+    def _delete_keys(self, keys):
+        """Удаление записей по ключам (код экземпляра, дата выполнения).
+
+        Returns:
+            list: Даты выполнения удаленных записей
+        """
+
+        table = Analytics.__table__
+        keys = list(keys)
+        days = []
+
+        for i in range(0, len(keys), 10000):
+            days += self.session.execute(
+                delete(table)
+                .where(tuple_(table.c.instance_code, table.c.execution_date).in_(keys[i:i + 10000]))
+                .returning(table.c.execution_date),
+            ).scalars().all()
+
+        self.changes.add_days(days)
+
+        return days
+
+    @staticmethod
+    def _unique_keys(records):
+        """Ключи уникальности записей: записи без кода экземпляра или даты выполнения ими не ограничены."""
+
+        return (
+            (record["instance_code"], record["execution_date"])
+            for record in records
+            if record.get("instance_code") and record.get("execution_date")
+        )
+
 class SpecialistsRepository(BaseRepository):
     """Репозиторий для работы с моделью специалистов."""
 
@@ -60,6 +1064,253 @@ class SpecialistsRepository(BaseRepository):
         super().__init__()
 
         self.model = Specialists
+        # merge - слияние через временную таблицу и ON CONFLICT, insert_new - загрузка только новых номеров
+        self.merge_enabled = (
+            LOADING_CONFIG.get("specialists_mode", "merge") == "merge"
+            and self.session.bind.dialect.name == "postgresql"
+        )
 
     def all_material_numbers(self):
         return self.session.execute(select(Specialists.material_number)).all()
+
+    def merge(self, records):
+        """Слияние специалистов по номеру материала в одной транзакции.
+
+        Записи загружаются во временную таблицу, затем INSERT ... ON CONFLICT (material_number)
+        добавляет новые номера и обновляет только те существующие записи, которые изменились.
+        Для номера, повторяющегося в выгрузке, берется последняя запись.
+
+        Returns:
+            tuple[int, int]: Количество добавленных и обновленных записей
+        """
+
+        table = Specialists.__tablename__
+        temp = f"{table}_merge_{uuid.uuid4().hex[:8]}"
+
+        data_columns = [column.name for column in Specialists.__table__.columns if not column.primary_key]
+        columns = ", ".join(data_columns)
+        updated_columns = [column for column in data_columns if column != "material_number"]
+        assignments = ", ".join(f"{column} = EXCLUDED.{column}" for column in updated_columns)
+        current = ", ".join(f"{table}.{column}" for column in updated_columns)
+        excluded = ", ".join(f"EXCLUDED.{column}" for column in updated_columns)
+
+        with self._load_profile():
+            try:
+                self.session.execute(text(f"CREATE TEMP TABLE {temp} AS SELECT {columns} FROM {table} WITH NO DATA"))
+                # Порядковый номер строки выгрузки, чтобы из повторов брать последнюю
+                self.session.execute(text(f"ALTER TABLE {temp} ADD COLUMN row_num bigserial"))
+
+                work_table = self._work_table(temp)
+
+                for i in range(0, len(records), self.chunk_size):
+                    self._insert_chunk(records[i:i + self.chunk_size], work_table)
+
+                inserted_flags = self.session.execute(text(f"""
+                    INSERT INTO {table} ({columns})
+                    SELECT DISTINCT ON (material_number) {columns}
+                    FROM {temp}
+                    WHERE material_number IS NOT NULL
+                    ORDER BY material_number, row_num DESC
+                    ON CONFLICT (material_number) DO UPDATE SET {assignments}
+                    WHERE ({current}) IS DISTINCT FROM ({excluded})
+                    RETURNING xmax = 0
+                """)).scalars().all()
+
+                self.session.execute(text(f"DROP TABLE {temp}"))
+                self.session.commit()
+            except Exception as e:
+                self.session.rollback()
+
+                err = f"Ошибка при слиянии специалистов: {str(e)}"
+                app_logger.error(f"[SRep] {err}", exc_info=True)
+                raise
+
+        inserted = sum(inserted_flags)
+        self.changes.add(table, len(inserted_flags))
+
+        return inserted, len(inserted_flags) - inserted
+
+class LoadRunRepository(BaseRepository):
+    """Репозиторий запусков загрузки."""
+
+    # Режимы, в которых каждый чанк фиксируется отдельно и прерванную загрузку можно продолжить
+    RESUMABLE_MODES = ("upsert", "delete")
+
+    def __init__(self):
+        super().__init__()
+
+        self.model = LoadRun
+
+    def start(self, kind, path, mode, from_scratch, window=None, plan=None):
+        """Новый запуск загрузки файла или продолжение прерванного запуска той же загрузки.
+
+        Запуск продолжается, если тот же файл (имя, размер, время изменения) с теми же параметрами
+        уже загружался, загрузка не завершилась и успела зафиксировать хотя бы один чанк.
+        Новый запуск запоминает способ обработки из plan: продолжение пропускает уже загруженные записи
+        по их порядку, а порядок и состав пачек зависят от движка и размера чанка, поэтому продолжение
+        должно обработать выгрузку тем же способом. Запуски без способа обработки не продолжаются.
+        """
+
+        stat = os.stat(path)
+        fingerprint = f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+        window_start, window_end = window or (None, None)
+        run = None
+
+        if mode in self.RESUMABLE_MODES:
+            run = self.session.execute(
+                select(LoadRun)
+                .where(
+                    LoadRun.kind == kind,
+                    LoadRun.fingerprint == fingerprint,
+                    LoadRun.mode == mode,
+                    LoadRun.from_scratch == from_scratch,
+                    LoadRun.window_start == window_start,
+                    LoadRun.window_end == window_end,
+                    LoadRun.status.in_(("running", "failed")),
+                    LoadRun.rows_committed > 0,
+                    LoadRun.engine.isnot(None),
+                )
+                .order_by(LoadRun.id.desc())
+                .limit(1)
+            ).scalar_one_or_none()
+
+        if run is not None:
+            run.status = "running"
+            run.error = None
+            run.finished_at = None
+        else:
+            run = LoadRun(
+                kind=kind,
+                source=os.path.basename(path),
+                fingerprint=fingerprint,
+                mode=mode,
+                from_scratch=from_scratch,
+                window_start=window_start,
+                window_end=window_end,
+                status="running",
+                stages={},
+                rows_committed=0,
+                engine=plan.engine if plan else None,
+                chunk_size=plan.chunk_size if plan else None,
+            )
+            self.session.add(run)
+
+        self.session.commit()
+
+        app_logger.info(
+            f"[LRun] Запуск {run.id}: {run.source}, режим {mode}"
+            + (f", продолжение после {run.rows_committed} записей" if run.rows_committed else ""),
+        )
+
+        return run
+
+    # Этапы и зафиксированные записи запуска пишет загрузка в своих транзакциях, поэтому здесь меняется
+    # только статус, а объект запуска затем перечитывается
+
+    def finish(self, run):
+        run.status = "completed"
+        run.finished_at = datetime.datetime.now()
+        self.session.commit()
+        self.session.refresh(run)
+
+    def fail(self, run, error):
+        run.status = "failed"
+        run.error = str(error)
+        run.finished_at = datetime.datetime.now()
+        self.session.commit()
+        self.session.refresh(run)
+
+    def get(self, run_id):
+        return self.session.get(LoadRun, run_id)
+
+    def recent(self, limit=20):
+        return self.session.execute(select(LoadRun).order_by(LoadRun.id.desc()).limit(limit)).scalars().all()
+
+class CosmetologyExportRepository(BaseRepository):
+    """Репозиторий журнала выгрузки аналитик Косметологии в Bitrix."""
+
+    def __init__(self):
+        super().__init__()
+
+        self.model = CosmetologyExport
+
+    def pending(self, max_attempts):
+        """Аналитики Косметологии, еще не выгруженные в Bitrix, кроме неудачных max_attempts раз и более.
+
+        Записи без кода экземпляра или даты выполнения в журнал не попадут, поэтому не выбираются.
+        """
+
+        analytics = Analytics.__table__.c
+        done = exists().where(
+            CosmetologyExport.instance_code == analytics.instance_code,
+            CosmetologyExport.execution_date == analytics.execution_date,
+            or_(CosmetologyExport.status == "exported", CosmetologyExport.attempts >= max_attempts),
+        )
+
+        return self.session.execute(
+            select(
+                analytics.instance_code,
+                analytics.execution_date,
+                analytics.registration_number,
+                analytics.appointment_date,
+                analytics.specialist_execution,
+                analytics.physician_department,
+                analytics.total_amount,
+            )
+            .where(
+                analytics.admission_type == COSMETOLOGY_ADMISSION_TYPE,
+                analytics.department_execution == COSMETOLOGY_DEPARTMENT,
+                analytics.instance_code != "",
+                analytics.execution_date.isnot(None),
+                ~done,
+            )
+            .order_by(analytics.execution_date, analytics.registration_number, analytics.instance_code)
+        ).mappings().all()
+
+    def mark_exported(self, rows, deal_id):
+        """Запись аналитик, вошедших в сделку deal_id, в журнал - в отдельной транзакции."""
+
+        for code, day in self._keys(rows):
+            entry = self.session.get(CosmetologyExport, (code, day))
+
+            if entry is None:
+                self.session.add(CosmetologyExport(instance_code=code, execution_date=day, deal_id=deal_id))
+            elif entry.status != "exported":
+                entry.status = "exported"
+                entry.deal_id = deal_id
+                entry.exported_at = func.now()
+
+        self.session.commit()
+
+    def mark_failed(self, rows):
+        """Отметка аналитик сделки, контакт пациента которой не найден в Bitrix, - в отдельной транзакции.
+
+        Returns:
+            int: Количество неудачных попыток выгрузки аналитик сделки с учетом этой
+        """
+
+        attempts = 0
+
+        for code, day in self._keys(rows):
+            entry = self.session.get(CosmetologyExport, (code, day))
+
+            if entry is None:
+                entry = CosmetologyExport(instance_code=code, execution_date=day, status="failed", attempts=0)
+                self.session.add(entry)
+            elif entry.status == "exported":
+                continue
+
+            entry.attempts += 1
+            entry.exported_at = func.now()
+            attempts = max(attempts, entry.attempts)
+
+        self.session.commit()
+
+        return attempts
+
+    @staticmethod
+    def _keys(rows):
+        """Ключи (код экземпляра, дата выполнения) аналитик сделки."""
+
+        return {(row["instance_code"], row["execution_date"]) for row in rows}
+
@@ -0,0 +1,73 @@
+"""Дневные итоги аналитик (grandmed_qms_analytics_daily).
+
+Итоги пересчитываются целиком за затронутые дни по живой таблице, а не накапливаются приращениями:
+так они остаются верными при любом способе загрузки - вставке, обновлении, удалении или очистке секций.
+Пересчет выполняется в транзакции загрузки, поэтому отчеты не видят итогов, расходящихся с аналитиками.
+"""
+
+from sqlalchemy import delete, func, insert, select
+
+from app_v3.database.models import Analytics, AnalyticsDaily
+
+
+# Количество дней в одном запросе пересчета
+DAYS_PER_STATEMENT = 500
+
+ROLLUP_KEYS = ("department_execution", "specialist_execution", "admission_type")
+
+
+def _aggregate(days=None):
+    source = Analytics.__table__.c
+    keys = [func.coalesce(source[name], "") for name in ROLLUP_KEYS]
+
+    query = (
+        select(
+            source.execution_date,
+            *keys,
+            func.count(),
+            func.coalesce(func.sum(source.total_amount), 0),
+            func.coalesce(func.sum(source.debt), 0),
+        )
+        .where(source.execution_date.isnot(None))
+        .group_by(source.execution_date, *keys)
+    )
+
+    if days is not None:
+        query = query.where(source.execution_date.in_(days))
+
+    return query
+
+
+def _insert_aggregate(days=None):
+    columns = ["day", *ROLLUP_KEYS, "services_count", "total_amount", "debt"]
+
+    return insert(AnalyticsDaily).from_select(columns, _aggregate(days))
+
+
+def refresh_daily_rollup(connection, days):
+    """Пересчет дневных итогов за дни из days в текущей транзакции.
+
+    Args:
+        connection: Соединение или сессия SQLAlchemy
+        days: Даты выполнения, записи за которые добавлялись, изменялись или удалялись
+
+    Returns:
+        int: Количество пересчитанных дней
+    """
+
+    days = sorted({day for day in days if day is not None})
+
+    for i in range(0, len(days), DAYS_PER_STATEMENT):
+        part = days[i:i + DAYS_PER_STATEMENT]
+
+        connection.execute(delete(AnalyticsDaily).where(AnalyticsDaily.day.in_(part)))
+        connection.execute(_insert_aggregate(part))
+
+    return len(days)
+
+
+def rebuild_daily_rollup(connection):
+    """Полный пересчет дневных итогов по всей таблице аналитик."""
+
+    connection.execute(delete(AnalyticsDaily))
+    connection.execute(_insert_aggregate())
@@ -1,11 +1,52 @@
-from sqlalchemy import create_engine
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
 from app_v3.utils.config import app_config
+from app_v3.utils.logger import app_logger
+from app_v3.database.instrumentation import instrument
+from app_v3.database.migrations import MigrationManager, indexes_dropped
 from app_v3.database.models import Base
+from app_v3.database.partitions import ensure_future_partitions
 
 
-def get_engine():
+# postgresql - рабочая БД, sqlite - локальный файл (или :memory:) для запусков без PostgreSQL и замеров
+# разбора выгрузок без сетевых задержек. На SQLite нет секций, COPY, staging-подмены, слияния специалистов,
+# представления Косметологии и обслуживания таблиц: загрузка идет обычными вставками и INSERT ... ON CONFLICT
+BACKEND = app_config.database.get('backend', 'postgresql')
+
+def _backend_config():
+    return app_config.database.get(BACKEND) or {}
+
+def create_sqlite_engine():
+    conf = _backend_config()
+    path = conf.get('path', 'grandmed.sqlite3')
+    # Соединение используют и фоновые потоки (подготовка БД, параллельные загрузчики)
+    # Ожидание блокировки записи, пока пишет другое соединение или процесс (reprocess)
+    options = {"connect_args": {"check_same_thread": False, "timeout": conf.get('busy_timeout', 30)}}
+
+    if path == ':memory:':
+        # У каждого соединения была бы своя пустая БД в памяти
+        options["poolclass"] = StaticPool
+
+    engine = create_engine(f"sqlite:///{path}", echo=bool(conf.get('echo', False)), future=True, **options)
+
+    @event.listens_for(engine, "connect")
+    def configure(connection, _record):
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA journal_mode = WAL" if path != ':memory:' else "PRAGMA journal_mode = MEMORY")
+        cursor.execute("PRAGMA synchronous = NORMAL")
+        cursor.close()
+
+    return engine
+
+def create_db_engine():
+    if BACKEND == 'sqlite':
+        return create_sqlite_engine()
+
     conf = app_config.database['postgresql']
 
     url = (
@@ -25,11 +66,95 @@ def get_engine():
 
     return engine
 
-_engine = get_engine()
-SessionLocal = sessionmaker(bind=_engine, autoflush=False, autocommit=False, expire_on_commit=False)
+# Движок создается при первом обращении к БД, а не при импорте: модули с репозиториями
+# импортируются без настроек и доступности PostgreSQL
+_engine = None
+_engine_lock = threading.Lock()
+SessionLocal = sessionmaker(autoflush=False, autocommit=False, expire_on_commit=False)
+
+def get_engine():
+    global _engine
+
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = create_db_engine()
+                instrument(engine, SessionLocal)
+                SessionLocal.configure(bind=engine)
+                _engine = engine
+
+    return _engine
 
 def get_session():
+    get_engine()
+
     return SessionLocal()
 
+def dispose_inherited_pool():
+    """Сброс унаследованного пула соединений в дочернем процессе, без закрытия соединений родителя."""
+
+    if _engine is not None:
+        _engine.dispose(close=False)
+
 def init_db():
-    Base.metadata.create_all(_engine)
+    engine = get_engine()
+
+    Base.metadata.create_all(engine)
+    MigrationManager(engine).migrate()
+
+    if engine.dialect.name == "postgresql":
+        ensure_future_partitions(engine, app_config.database.get("partitioning", {}).get("months_ahead", 3))
+
+def prewarm_pool(connections=None):
+    """Открытие соединений пула заранее, чтобы первые записи в БД не ждали подключения.
+
+    Args:
+        connections: Количество соединений, по умолчанию postgresql.prewarm_connections из настроек.
+            Больше pool_size не открывается - лишние соединения пул закрыл бы при возврате
+
+    Returns:
+        int: Количество открытых соединений
+    """
+
+    conf = _backend_config()
+
+    if connections is None:
+        connections = conf.get('prewarm_connections', 1)
+
+    connections = min(connections, conf.get('pool_size', 5))
+    engine = get_engine()
+    opened = []
+
+    try:
+        # Соединения удерживаются до конца цикла, иначе пул каждый раз отдавал бы одно и то же
+        for _ in range(connections):
+            opened.append(engine.connect())
+    finally:
+        for connection in opened:
+            connection.close()
+
+    app_logger.info(f"[DB] Открыто соединений пула: {len(opened)}")
+
+    return len(opened)
+
+def warm_up_in_background(connections=None):
+    """Подготовка БД (init_db и прогрев пула) в фоновом потоке, пока браузер входит в систему.
+
+    Returns:
+        Future: Результат подготовки; result() дожидается ее и пробрасывает ошибку подключения или миграций
+    """
+
+    def warm_up():
+        init_db()
+        prewarm_pool(connections)
+
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-warmup")
+    future = executor.submit(warm_up)
+    executor.shutdown(wait=False)
+
+    return future
+
+def without_indexes(table, keep=()):
+    """Вторичные индексы таблицы удаляются на время массовой загрузки и пересоздаются после."""
+
+    return indexes_dropped(get_engine(), table, keep)
@@ -0,0 +1,241 @@
+"""Холодное хранение аналитик закрытых лет.
+
+Загрузчик перезагружает аналитики текущего года, а в январе - и прошлого (выгрузки за прошлый год
+и за последнюю неделю), поэтому в таблице аналитик всегда остаются минимум два последних года.
+Более ранние годы только читаются. Их помесячные секции
+отсоединяются от таблицы аналитик и присоединяются к холодной таблице grandmed_qms_analytics_cold
+с теми же колонками: данные не копируются, а у перенесенных секций удаляются индексы загрузки
+(уникальный ключ, поиск по коду и рег.номеру), поэтому таблица аналитик и ее индексы остаются
+небольшими, а удаления, вставки и VACUUM при загрузке работают только с горячими годами.
+Холодные секции - обычные таблицы PostgreSQL без сжатия: VACUUM FULL только убирает из них
+мертвые строки. Сжатая колоночная копия - необязательная выгрузка в Parquet (zstd) через DuckDB
+для отчетов и архива вне PostgreSQL; представление по-прежнему читает холодную таблицу.
+
+Представление grandmed_qms_analytics_all объединяет обе таблицы, агрегат Косметологии читает его.
+Колонки в нем зафиксированы при создании: миграция, добавляющая колонку аналитик,
+добавляет ее и в холодную таблицу и пересоздает представление.
+Загрузка записей за перенесенные годы прерывается ошибкой (AnalyticsRepository.load_period),
+поэтому дневные итоги этих дней больше не меняются.
+"""
+
+import datetime
+import os
+import time
+
+import duckdb
+import pandas as pd
+
+from sqlalchemy import text
+
+from app_v3.database.models import Analytics
+from app_v3.database.partitions import (
+    ALL_ANALYTICS_VIEW,
+    ANALYTICS_TABLE,
+    COLD_ANALYTICS_TABLE,
+    cold_partition_name,
+    existing_partitions,
+    next_month,
+    partition_month,
+    partition_name,
+)
+from app_v3.utils.config import app_config
+from app_v3.utils.logger import app_logger
+
+
+TIERING_CONFIG = app_config.database.get("tiering") or {}
+
+# Текущий и прошлый год: прошлый загрузчик перезагружает до конца первой недели января
+MIN_KEEP_YEARS = 2
+
+# Индексы таблицы аналитик, которые остаются у перенесенных секций:
+# частичный индекс Косметологии нужен обновлению агрегата Косметологии
+COLD_INDEXES = ("ix_grandmed_qms_analytics_cosmetology_instance_code",)
+
+
+def create_cold_tier(connection):
+    """Холодная таблица с колонками таблицы аналитик и объединяющее представление."""
+
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {COLD_ANALYTICS_TABLE} (LIKE {ANALYTICS_TABLE} INCLUDING DEFAULTS) "
+        f"PARTITION BY RANGE (execution_date)"
+    ))
+    connection.execute(text(
+        f"CREATE OR REPLACE VIEW {ALL_ANALYTICS_VIEW} AS "
+        f"SELECT * FROM {ANALYTICS_TABLE} UNION ALL SELECT * FROM {COLD_ANALYTICS_TABLE}"
+    ))
+
+
+def archived_until(connection):
+    """Начало первого года после перенесенных в холодную таблицу или None, если переносов не было.
+
+    Переносятся только закрытые годы, поэтому год с перенесенной секцией закрыт целиком. Только PostgreSQL.
+    """
+
+    months = [partition_month(name) for name in existing_partitions(connection, COLD_ANALYTICS_TABLE)]
+    months = [month for month in months if month is not None]
+
+    return datetime.date(max(months).year + 1, 1, 1) if months else None
+
+
+def closed_months(connection, keep_years):
+    """Первые числа месяцев секций таблицы аналитик раньше keep_years последних лет, по возрастанию."""
+
+    boundary = datetime.date(datetime.date.today().year - keep_years + 1, 1, 1)
+    months = (partition_month(name) for name in existing_partitions(connection))
+
+    return sorted(month for month in months if month is not None and month < boundary)
+
+
+def _hot_indexes(connection, partition):
+    """Индексы секции, кроме унаследованных от индексов из COLD_INDEXES."""
+
+    return connection.execute(text("""
+        SELECT idx.relname
+        FROM pg_index
+        JOIN pg_class idx ON idx.oid = pg_index.indexrelid
+        LEFT JOIN pg_inherits ON pg_inherits.inhrelid = pg_index.indexrelid
+        LEFT JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        WHERE pg_index.indrelid = CAST(:partition AS regclass)
+            AND coalesce(parent.relname, '') <> ALL(:keep)
+    """), {"partition": partition, "keep": list(COLD_INDEXES)}).scalars().all()
+
+
+def move_to_cold(connection, month):
+    """Перенос секции месяца из таблицы аналитик в холодную таблицу в текущей транзакции.
+
+    Отсоединение и присоединение идут в одной транзакции, поэтому читатели
+    grandmed_qms_analytics_all видят записи месяца ровно один раз.
+
+    Returns:
+        str: Имя секции в холодной таблице
+    """
+
+    hot, cold = partition_name(month), cold_partition_name(month)
+    indexes = _hot_indexes(connection, hot)
+
+    connection.execute(text(f"ALTER TABLE {ANALYTICS_TABLE} DETACH PARTITION {hot}"))
+
+    for index in indexes:
+        connection.execute(text(f"DROP INDEX {index}"))
+
+    connection.execute(text(f"ALTER TABLE {hot} RENAME TO {cold}"))
+    connection.execute(text(
+        f"ALTER TABLE {COLD_ANALYTICS_TABLE} ATTACH PARTITION {cold} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+    ))
+
+    return cold
+
+
+def export_parquet(engine, table, path, chunk_size=None):
+    """Выгрузка таблицы аналитик (или ее секции) в Parquet со сжатием zstd без загрузки целиком в память.
+
+    Записи читаются из PostgreSQL курсором на стороне сервера пачками по chunk_size и складываются
+    в файловую базу DuckDB рядом с файлом выгрузки (при нехватке памяти она уходит на диск),
+    а из нее одним COPY пишутся в Parquet. Типы колонок - как в модели аналитик, суммы - DECIMAL(14,2).
+
+    Returns:
+        int: Количество выгруженных записей
+    """
+
+    chunk_size = chunk_size or TIERING_CONFIG.get("parquet_chunk_size", 50000)
+    columns = list(Analytics.__table__.columns)
+    names = ", ".join(column.name for column in columns)
+    schema = ", ".join(f"{column.name} {column.type.compile(dialect=engine.dialect)}" for column in columns)
+    work_path = f"{path}.duckdb"
+    rows = 0
+
+    try:
+        with duckdb.connect(work_path) as duck:
+            duck.execute(f"SET memory_limit = '{TIERING_CONFIG.get('duckdb_memory_limit', '1GB')}'")
+            duck.execute(f"CREATE TABLE export ({schema})")
+
+            with engine.connect().execution_options(stream_results=True) as connection:
+                for chunk in pd.read_sql_query(text(f"SELECT {names} FROM {table}"), connection, chunksize=chunk_size):
+                    duck.register("chunk", chunk)
+                    duck.execute("INSERT INTO export SELECT * FROM chunk")
+                    duck.unregister("chunk")
+                    rows += len(chunk)
+
+            quoted_path = str(path).replace("'", "''")
+            duck.execute(f"COPY export TO '{quoted_path}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+    finally:
+        for leftover in (work_path, f"{work_path}.wal"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    return rows
+
+
+def archive_closed_years(engine, keep_years=None, parquet_dir=None, compact=None, dry_run=False):
+    """Перенос секций закрытых лет в холодную таблицу - каждая секция в своей транзакции.
+
+    Args:
+        engine: Движок SQLAlchemy
+        keep_years: Сколько последних лет, включая текущий, остается в таблице аналитик,
+            по умолчанию tiering.keep_years из настроек, не меньше MIN_KEEP_YEARS
+        parquet_dir: Директория для выгрузки перенесенных секций в Parquet, по умолчанию tiering.parquet_dir.
+            Без нее выгрузки нет
+        compact: Уплотнять ли перенесенные секции VACUUM FULL, по умолчанию tiering.compact
+        dry_run: Только вывести в лог секции к переносу
+
+    Returns:
+        list[str]: Имена перенесенных (при dry_run - переносимых) секций в холодной таблице
+    """
+
+    if engine.dialect.name != "postgresql":
+        app_logger.warning("[Tier] Холодное хранение аналитик есть только в PostgreSQL")
+        return []
+
+    keep_years = TIERING_CONFIG.get("keep_years", MIN_KEEP_YEARS) if keep_years is None else keep_years
+    parquet_dir = TIERING_CONFIG.get("parquet_dir") if parquet_dir is None else parquet_dir
+    compact = TIERING_CONFIG.get("compact", True) if compact is None else compact
+
+    if keep_years < MIN_KEEP_YEARS:
+        raise ValueError(f"В таблице аналитик остаются хотя бы {MIN_KEEP_YEARS} последних года: их перезагружает загрузчик")
+
+    with engine.connect() as connection:
+        months = closed_months(connection, keep_years)
+
+    if not months:
+        app_logger.info("[Tier] Секций закрытых лет в таблице аналитик нет")
+        return []
+
+    if dry_run:
+        app_logger.info(f"[Tier] Секций к переносу: {len(months)}, {months[0]:%m.%Y} - {months[-1]:%m.%Y}")
+        return [cold_partition_name(month) for month in months]
+
+    if parquet_dir:
+        os.makedirs(parquet_dir, exist_ok=True)
+
+    moved = []
+
+    for month in months:
+        start = time.monotonic()
+
+        with engine.begin() as connection:
+            cold = move_to_cold(connection, month)
+
+        moved.append(cold)
+        msg = f"[Tier] Секция {partition_name(month)} перенесена в {cold}"
+
+        if compact:
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                connection.execute(text(f"VACUUM (FULL, ANALYZE) {cold}"))
+
+            msg += ", уплотнена"
+
+        if parquet_dir:
+            rows = export_parquet(engine, cold, os.path.join(parquet_dir, f"{cold}.parquet"))
+            msg += f", выгружено в Parquet записей: {rows}"
+
+        app_logger.info(f"{msg} ({time.monotonic() - start:.1f} с)")
+
+    # Статистика секционированных таблиц сама не обновляется, а их состав изменился
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text(f"ANALYZE {ANALYTICS_TABLE}"))
+        connection.execute(text(f"ANALYZE {COLD_ANALYTICS_TABLE}"))
+
+    app_logger.info(f"[Tier] Перенесено в холодную таблицу секций: {len(moved)}")
+
+    return moved
@@ -0,0 +1,51 @@
+"""Материализованное представление с агрегатом аналитик Косметологии по пациенту, дате, отделению и специалисту.
+
+Загрузки аналитик представление не обновляют: выгрузка Косметологии в Bitrix читает аналитики
+по журналу выгрузки, а полный пересчет агрегата после каждой загрузки никто не читал.
+Отчет, читающий представление, сначала обновляет его через refresh_cosmetology_totals.
+Представление есть только в PostgreSQL и создается миграцией, а не create_all.
+Агрегат читает grandmed_qms_analytics_all, поэтому включает и перенесенные в холодную таблицу годы.
+"""
+
+from sqlalchemy import text
+
+from app_v3.database.models import COSMETOLOGY_CONDITION
+from app_v3.database.partitions import ALL_ANALYTICS_VIEW
+
+
+COSMETOLOGY_TOTALS = "grandmed_qms_cosmetology_totals"
+
+# Ключи группировки приведены к непустым значениям: уникальный индекс, нужный для REFRESH CONCURRENTLY,
+# должен однозначно определять каждую строку. date_key - дата выполнения, где пустая дата заменена на 0001-01-01
+COSMETOLOGY_TOTALS_SQL = f"""
+    CREATE MATERIALIZED VIEW IF NOT EXISTS {COSMETOLOGY_TOTALS} AS
+    SELECT
+        coalesce(registration_number, '') AS registration_number,
+        coalesce(full_name, '') AS full_name,
+        appointment_date,
+        coalesce(appointment_date, DATE '0001-01-01') AS date_key,
+        department_execution,
+        coalesce(specialist_execution, '') AS specialist_execution,
+        max(physician_department) AS physician_department,
+        count(*) AS services_count,
+        coalesce(sum(total_amount), 0) AS total_amount
+    FROM {{source}}
+    WHERE {COSMETOLOGY_CONDITION}
+    GROUP BY 1, 2, 3, 5, 6
+"""
+
+
+def create_cosmetology_totals(connection, source=ALL_ANALYTICS_VIEW):
+    """Создание представления по таблице или представлению аналитик source."""
+
+    connection.execute(text(COSMETOLOGY_TOTALS_SQL.format(source=source)))
+    connection.execute(text(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{COSMETOLOGY_TOTALS} ON {COSMETOLOGY_TOTALS} "
+        f"(registration_number, full_name, date_key, department_execution, specialist_execution)"
+    ))
+
+
+def refresh_cosmetology_totals(connection):
+    """Пересчет агрегата Косметологии без блокировки читателей (REFRESH ... CONCURRENTLY)."""
+
+    connection.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {COSMETOLOGY_TOTALS}"))
@@ -0,0 +1,72 @@
+"""Запуски загрузки аналитик: просмотр и откат.
+
+Пример:
+    python -m app_v3.load_runs list --limit 10
+    python -m app_v3.load_runs rollback 42
+
+Откат удаляет записи, которые запуск добавил или изменил, и пересчитывает дневные итоги за их дни.
+Записи, которые запуск удалил или перезаписал, не восстанавливаются - после отката загрузите
+предыдущую выгрузку повторно.
+"""
+
+import argparse
+
+from app_v3.database.instrumentation import query_stage
+from app_v3.database.repositories import AnalyticsRepository, LoadRunRepository
+from app_v3.database.session import init_db
+from app_v3.utils.logger import app_logger
+
+
+def list_runs(limit):
+    for run in LoadRunRepository().recent(limit):
+        window = f"{run.window_start}..{run.window_end}" if run.window_start else "-"
+        stages = ", ".join(f"{name}: {stage.get('status')}" for name, stage in (run.stages or {}).items())
+
+        print(
+            f"{run.id:>6}  {run.started_at:%d.%m.%Y %H:%M}  {run.status:<11}  {run.mode:<7}  "
+            f"{run.rows_committed:>9}  {window:<23}  {run.source}  [{stages}]"
+        )
+
+
+def rollback(run_id):
+    run = LoadRunRepository().get(run_id)
+
+    if run is None:
+        app_logger.error(f"[LRun] Запуск {run_id} не найден")
+        return False
+
+    if run.status == "rolled_back":
+        app_logger.warning(f"[LRun] Запуск {run_id} уже откачен")
+        return True
+
+    with query_stage(f"Откат запуска {run_id}", report=False):
+        AnalyticsRepository().rollback_run(run)
+
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запуски загрузки аналитик")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = commands.add_parser("list", help="Последние запуски")
+    list_parser.add_argument("--limit", type=int, default=20, help="Количество запусков")
+
+    rollback_parser = commands.add_parser("rollback", help="Откат запуска")
+    rollback_parser.add_argument("run_id", type=int, help="Номер запуска")
+
+    args = parser.parse_args()
+
+    init_db()
+
+    if args.command == "list":
+        list_runs(args.limit)
+        success = True
+    else:
+        success = rollback(args.run_id)
+
+    raise SystemExit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""Офлайн-перезагрузка архивных выгрузок из директории в БД.
+
+Пример:
+    python -m app_v3.reprocess app_v3/files --workers 4
+
+Тип каждого файла определяется по заголовку. Аналитики грузятся с перезаписью по кодам экземпляров,
+специалисты - только новые записи. Выгрузки пациентов уходят в Bitrix и здесь пропускаются.
+Периоды выгрузок аналитик могут пересекаться, поэтому аналитики пишутся в БД по одной в порядке времени
+изменения файлов - более поздняя выгрузка перезаписывает более раннюю. Разбираются они параллельно
+в процессах-воркерах во временные файлы, а основной процесс только записывает готовые пачки.
+Параллельно грузятся и специалисты.
+С --rebuild-indexes индексы аналитик удаляются на время загрузки и строятся заново в конце,
+индекс по коду экземпляра сохраняется - он нужен и для перезаписи, и для загрузки с обновлением (--append).
+"""
+
+import argparse
+import datetime
+import os
+import pickle
+import shutil
+import tempfile
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from pathlib import Path
+
+from app_v3.database.models import Analytics
+from app_v3.database.session import dispose_inherited_pool, init_db, without_indexes
+from app_v3.services.files import FileProcessor
+from app_v3.utils.logger import app_logger
+
+
+# Процессор создается один раз на процесс-воркер и переиспользует сессии БД
+_processor = None
+
+
+def _get_processor(directory):
+    global _processor
+
+    if _processor is None:
+        _processor = FileProcessor(Path(directory))
+
+    return _processor
+
+
+def _init_worker():
+    """Воркер не пользуется соединениями и процессором, унаследованными от основного процесса."""
+
+    global _processor
+
+    _processor = None
+    dispose_inherited_pool()
+
+
+def _process_file(directory, file, kind, from_scratch):
+    """Обработка одного файла в процессе-воркере."""
+
+    processor = _get_processor(directory)
+    start = datetime.datetime.now()
+
+    if kind == "analytics":
+        rows = processor.process_period_analytics(file, from_scratch)
+    else:
+        rows = processor.process_specialists(file)
+
+    seconds = (datetime.datetime.now() - start).total_seconds()
+
+    return file, kind, rows, seconds
+
+
+def _prepare_analytics(directory, file, spool_dir):
+    """Разбор выгрузки аналитик в процессе-воркере во временный файл: пачки записей pickle одна за другой.
+
+    Returns:
+        tuple: План обработки, путь к файлу с пачками и время разбора в секундах
+    """
+
+    processor = _get_processor(directory)
+    start = datetime.datetime.now()
+    plan, batches = processor.iter_period_analytics(file)
+    fd, spool = tempfile.mkstemp(prefix=f"{file}.", suffix=".pickle", dir=spool_dir)
+
+    with os.fdopen(fd, "wb") as output:
+        for batch in batches:
+            pickle.dump(batch, output, pickle.HIGHEST_PROTOCOL)
+
+    return plan, spool, (datetime.datetime.now() - start).total_seconds()
+
+
+def _spooled(spool):
+    """Пачки записей из временного файла _prepare_analytics."""
+
+    with open(spool, "rb") as source:
+        while True:
+            try:
+                yield pickle.load(source)
+            except EOFError:
+                return
+
+
+def _load_analytics(processor, file, from_scratch, future):
+    """Запись в БД выгрузки аналитик, разобранной воркером."""
+
+    plan, spool, parse_seconds = future.result()
+    start = datetime.datetime.now()
+
+    try:
+        rows = processor.process_period_analytics(file, from_scratch, prepared=(plan, _spooled(spool)))
+    finally:
+        os.remove(spool)
+
+    seconds = (datetime.datetime.now() - start).total_seconds()
+    app_logger.info(f"[Rep] {file}: разобран за {parse_seconds:.1f} с, записан за {seconds:.1f} с")
+
+    return file, "analytics", rows, parse_seconds + seconds
+
+
+def _log_result(file, kind, rows, seconds):
+    app_logger.info(
+        f"[Rep] {file} ({kind}): {rows} записей за {seconds:.1f} с "
+        f"({rows / seconds if seconds else 0:.0f} зап/с)",
+    )
+
+
+def reprocess(directory, workers, from_scratch=True, rebuild_indexes=False):
+    """Классификация файлов директории и их обработка: аналитики пишутся по очереди, остальное параллельно."""
+
+    init_db()
+
+    processor = _get_processor(directory)
+    tasks = []
+
+    for file in sorted(os.listdir(directory)):
+        if not os.path.isfile(os.path.join(directory, file)):
+            continue
+
+        kind = processor.classify_file(file)
+
+        if kind in ("analytics", "specialists"):
+            tasks.append((file, kind))
+        elif kind == "users":
+            app_logger.info(f"[Rep] {file}: выгрузка пациентов, пропущена (загружается в Bitrix)")
+        else:
+            app_logger.warning(f"[Rep] {file}: формат не распознан, пропущен")
+
+    # Из пересекающихся выгрузок аналитик остаются записи последней
+    analytics = sorted(
+        (file for file, kind in tasks if kind == "analytics"),
+        key=lambda file: os.path.getmtime(os.path.join(directory, file)),
+    )
+    specialists = [file for file, kind in tasks if kind == "specialists"]
+
+    app_logger.info(
+        f"[Rep] К обработке {len(tasks)} файлов: аналитик {len(analytics)} с записью по очереди, "
+        f"специалистов {len(specialists)} в {workers} процессах",
+    )
+
+    start = datetime.datetime.now()
+    total_rows = 0
+    failed = []
+
+    if rebuild_indexes:
+        indexes_context = without_indexes(Analytics.__table__, ("ix_grandmed_qms_analytics_instance_code",))
+    else:
+        indexes_context = nullcontext()
+
+    spool_dir = tempfile.mkdtemp(prefix="grandmed_reprocess_")
+
+    try:
+        with indexes_context, ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            # Вперед разбирается не больше workers выгрузок аналитик, чтобы разобранные не копились на диске
+            pending = deque(analytics)
+            parsing = deque()
+
+            def submit_next():
+                if pending:
+                    file = pending.popleft()
+                    parsing.append((file, executor.submit(_prepare_analytics, directory, file, spool_dir)))
+
+            for _ in range(workers):
+                submit_next()
+
+            futures = {
+                executor.submit(_process_file, directory, file, "specialists", from_scratch): file
+                for file in specialists
+            }
+
+            # Воркеры разбирают следующие выгрузки аналитик, пока основной процесс пишет текущую
+            while parsing:
+                file, future = parsing.popleft()
+                submit_next()
+
+                try:
+                    result = _load_analytics(processor, file, from_scratch, future)
+                except Exception as e:
+                    failed.append(file)
+                    app_logger.error(f"[Rep] {file}: ошибка обработки: {str(e)}")
+                    continue
+
+                total_rows += result[2]
+                _log_result(*result)
+
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed.append(futures[future])
+                    app_logger.error(f"[Rep] {futures[future]}: ошибка обработки: {str(e)}")
+                    continue
+
+                total_rows += result[2]
+                _log_result(*result)
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+    seconds = (datetime.datetime.now() - start).total_seconds()
+    app_logger.info(
+        f"[Rep] Итого: {len(tasks) - len(failed)}/{len(tasks)} файлов, {total_rows} записей за {seconds:.1f} с "
+        f"({total_rows / seconds if seconds else 0:.0f} зап/с)",
+    )
+
+    if failed:
+        app_logger.error(f"[Rep] Файлы с ошибками: {', '.join(failed)}")
+
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перезагрузка архивных выгрузок в БД")
+    parser.add_argument("directory", help="Директория с выгрузками")
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=max(1, (os.cpu_count() or 2) // 2),
+        help="Количество процессов, разбирающих выгрузки аналитик и загружающих специалистов",
+    )
+    parser.add_argument(
+        "--append",
+        action="store_true",
+        help="Не перезаписывать аналитики за период, а добавлять и обновлять по коду экземпляра",
+    )
+    parser.add_argument(
+        "--rebuild-indexes",
+        action="store_true",
+        help="Удалить индексы аналитик на время загрузки и построить их заново в конце",
+    )
+    args = parser.parse_args()
+
+    success = reprocess(
+        args.directory,
+        args.workers,
+        from_scratch=not args.append,
+        rebuild_indexes=args.rebuild_indexes,
+    )
+
+    raise SystemExit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
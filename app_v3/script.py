@@ -1,6 +1,7 @@
 import asyncio
 import urllib3
 
+from app_v3.database.session import warm_up_in_background
 from app_v3.utils.logger import app_logger
 from uploader import Orchestrator
 
@@ -10,7 +11,8 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 
 async def main():
-    uploader = Orchestrator()
+    # Подключение к БД, миграции и прогрев пула идут параллельно со входом браузера в систему
+    uploader = Orchestrator(db_ready=warm_up_in_background())
 
     try:
         await uploader.run()
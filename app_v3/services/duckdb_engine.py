@@ -0,0 +1,251 @@
+import os
+import shutil
+import tempfile
+
+from collections import deque
+
+import duckdb
+
+from app_v3.database.enums import ANALYTICS_DATE_FIELDS, ANALYTICS_FIELDS, ANALYTICS_NUMERIC_FIELDS
+from app_v3.utils.logger import app_logger
+
+
+class DuckDBAnalyticsEngine:
+    """Out-of-core обработка аналитик во встроенной DuckDB.
+
+    Повторяет логику FileProcessor.prepare_analytics_df в виде SQL над CSV.
+    Промежуточный результат хранится в файловой базе DuckDB во временной директории,
+    поэтому при нехватке памяти данные уходят на диск, а не в своп.
+    Значения читаются как текст, без приведения типов, которое делает pandas.
+    """
+
+    PREPARED_TABLE = "prepared_analytics"
+
+    def __init__(
+        self,
+        path,
+        skip_rows=3,
+        bottom_drops=1,
+        memory_limit="1GB",
+        threads=None,
+        temp_directory=None,
+        batch_size=50000,
+    ):
+        self.path = path
+        self.skip_rows = skip_rows
+        self.bottom_drops = bottom_drops
+        self.memory_limit = memory_limit
+        self.threads = threads
+        self.temp_directory = temp_directory
+        self.batch_size = batch_size
+
+        self.work_dir = None
+        self.connection = None
+        self.initial_count = 0
+        self.final_count = 0
+
+    def __enter__(self):
+        self.work_dir = tempfile.mkdtemp(prefix="grandmed_duckdb_", dir=self.temp_directory)
+        self.connection = duckdb.connect(os.path.join(self.work_dir, "analytics.duckdb"))
+
+        self.connection.execute(f"SET memory_limit = '{self.memory_limit}'")
+        self.connection.execute(f"SET temp_directory = '{self._sql_path(self.work_dir)}'")
+        self.connection.execute("SET preserve_insertion_order = false")
+
+        if self.threads:
+            self.connection.execute(f"SET threads = {int(self.threads)}")
+
+        app_logger.info(
+            f"[DDB] DuckDB запущена: memory_limit={self.memory_limit}, директория {self.work_dir}",
+        )
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def prepare(self):
+        """Фильтрация и преобразование аналитик в таблицу DuckDB.
+
+        Returns:
+            tuple[int, int]: Количество записей до и после фильтрации
+        """
+
+        csv_path = self._transcode()
+        self.connection.execute(f"""
+            CREATE VIEW raw_analytics AS
+            SELECT * FROM read_csv(
+                '{self._sql_path(csv_path)}',
+                delim = ';',
+                quote = '"',
+                escape = '"',
+                header = true,
+                all_varchar = true
+            )
+        """)
+
+        raw_columns = [row[0] for row in self.connection.execute("DESCRIBE raw_analytics").fetchall()]
+        columns_map = {column.strip(): column for column in raw_columns}
+        rules = self._filter_rules(columns_map)
+
+        # Строки подготовленной таблицы идут в порядке выгрузки: по rowid из повторов остается последняя запись
+        self.connection.execute("SET preserve_insertion_order = true")
+        self.connection.execute(
+            f"CREATE TABLE {self.PREPARED_TABLE} AS {self._build_select(columns_map, rules)}",
+        )
+        self.connection.execute("SET preserve_insertion_order = false")
+        self._count_skipped(rules)
+        self._drop_duplicates()
+        self.final_count = self.connection.execute(f"SELECT count(*) FROM {self.PREPARED_TABLE}").fetchone()[0]
+
+        return self.initial_count, self.final_count
+
+    def iter_records(self):
+        """Потоковая выдача подготовленных записей пачками по batch_size.
+
+        Порядок записей детерминирован, чтобы прерванная загрузка могла пропустить уже загруженные.
+        """
+
+        result = self.connection.execute(f"SELECT * FROM {self.PREPARED_TABLE} ORDER BY ALL")
+        columns = [column[0] for column in result.description]
+
+        while True:
+            rows = result.fetchmany(self.batch_size)
+
+            if not rows:
+                break
+
+            yield [dict(zip(columns, row)) for row in rows]
+
+    def _filter_rules(self, columns_map):
+        """Правила фильтрации prepare_analytics_df: описание и условие остающихся записей."""
+
+        category = self._quote(columns_map["Категория пациента"])
+        okmu_code = self._quote(columns_map[self._comment_of("okmu_code")])
+        status = self._quote(columns_map[self._comment_of("status")])
+
+        return [
+            ("тестовых пациентов", f"{category} IS DISTINCT FROM 'Тестовый пациент'"),
+            ("служебных услуг", f"NOT starts_with(coalesce({okmu_code}, ''), 'Q')"),
+            ("записей с неактуальными статусами", f"coalesce({status} IN ('выполнено', 'авторизован'), false)"),
+        ]
+
+    def _count_skipped(self, rules):
+        """Подсчет отброшенных каждым правилом записей за один проход по выгрузке."""
+
+        counters = ["count(*)"]
+
+        for num, (_, condition) in enumerate(rules):
+            passed = " AND ".join(f"({rule[1]})" for rule in rules[:num]) or "true"
+            counters.append(f"count(*) FILTER (WHERE {passed} AND NOT ({condition}))")
+
+        counts = self.connection.execute(f"SELECT {', '.join(counters)} FROM raw_analytics").fetchone()
+        self.initial_count = counts[0]
+
+        for (description, _), skipped in zip(rules, counts[1:]):
+            if skipped > 0:
+                app_logger.info(f"[DDB] Пропущено {description}: {skipped}")
+
+    def _drop_duplicates(self):
+        """Удаление повторов кода экземпляра в пределах даты выполнения.
+
+        Как и в prepare_analytics_df, из повторов остается последняя в выгрузке запись:
+        rowid подготовленной таблицы совпадает с порядком строк выгрузки.
+        """
+
+        columns = {row[0] for row in self.connection.execute(f"DESCRIBE {self.PREPARED_TABLE}").fetchall()}
+
+        if not {"instance_code", "execution_date"} <= columns:
+            return
+
+        deleted = self.connection.execute(f"""
+            DELETE FROM {self.PREPARED_TABLE} WHERE rowid IN (
+                SELECT rowid FROM {self.PREPARED_TABLE}
+                WHERE instance_code <> '' AND execution_date IS NOT NULL
+                QUALIFY row_number() OVER (PARTITION BY instance_code, execution_date ORDER BY rowid DESC) > 1
+            )
+        """).fetchone()[0]
+
+        if deleted > 0:
+            app_logger.info(f"[DDB] Пропущено повторов кодов экземпляров: {deleted}")
+
+    def _build_select(self, columns_map, rules):
+        """SQL-эквивалент prepare_analytics_df."""
+
+        selected = []
+
+        for comment, name in ANALYTICS_FIELDS.items():
+            if comment not in columns_map:
+                continue
+
+            source = self._quote(columns_map[comment])
+
+            # Типизированные колонки: пустые и нераспознанные значения - NULL
+            if name == "age":
+                # Извлекаем только цифры
+                expression = f"TRY_CAST(regexp_extract({source}, '\\d+') AS BIGINT)"
+            elif name in ANALYTICS_NUMERIC_FIELDS:
+                # Прочерки и прочие не-числа зануляются, пробелы-разделители и десятичная запятая допускаются
+                expression = (
+                    f"TRY_CAST(replace(replace(replace({source}, chr(160), ''), ' ', ''), ',', '.') AS DECIMAL(14, 2))"
+                )
+            elif name in ANALYTICS_DATE_FIELDS:
+                expression = self._date_expression(source)
+            else:
+                # Пропуски, как и в pandas-обработке, превращаются в пустые строки
+                expression = f"coalesce({source}, '')"
+
+            selected.append(f"{expression} AS {self._quote(name)}")
+
+            if name == "appointment_date":
+                # Дата выполнения - ключ секционирования
+                selected.append(f"{expression} AS execution_date")
+
+        conditions = " AND ".join(f"({condition})" for _, condition in rules)
+
+        return f"SELECT {', '.join(selected)} FROM raw_analytics WHERE {conditions}"
+
+    def _transcode(self):
+        """Перекодировка выгрузки в UTF-8 без шапки отчета и итоговых строк."""
+
+        target = os.path.join(self.work_dir, "analytics.csv")
+        tail = deque()
+
+        with open(self.path, "r", encoding="cp1251", newline="") as source, \
+                open(target, "w", encoding="utf-8", newline="") as output:
+            for num, line in enumerate(source):
+                if num < self.skip_rows or not line.strip():
+                    continue
+
+                tail.append(line)
+
+                if len(tail) > self.bottom_drops:
+                    output.write(tail.popleft())
+
+        return target
+
+    @staticmethod
+    def _date_expression(source):
+        """Разбор даты dd.mm.yyyy или dd.mm.yy, нераспознанные даты - NULL."""
+
+        return (
+            f"CAST(CASE WHEN regexp_full_match({source}, '\\d{{1,2}}\\.\\d{{1,2}}\\.\\d{{4}}') "
+            f"THEN try_strptime({source}, '%d.%m.%Y') "
+            f"ELSE try_strptime({source}, '%d.%m.%y') END AS DATE)"
+        )
+
+    @staticmethod
+    def _comment_of(name):
+        return next(comment for comment, field in ANALYTICS_FIELDS.items() if field == name)
+
+    @staticmethod
+    def _quote(identifier):
+        return '"' + identifier.replace('"', '""') + '"'
+
+    @staticmethod
+    def _sql_path(path):
+        return str(path).replace("\\", "/").replace("'", "''")
@@ -1,71 +1,233 @@
 import datetime
 import re
 from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
 
 import pandas as pd
 
 from pathlib import Path
 
 from app_v3.bitrix.manager import BitrixManager
-from app_v3.database.enums import ANALYTICS_FIELDS, SPECIALISTS_FIELDS, BitrixEnum, ANALYTICS_TO_BITRIX
-from app_v3.database.models import Analytics
-from app_v3.database.repositories import AnalyticsRepository, SpecialistsRepository
+from app_v3.database.enums import (
+    ANALYTICS_DATE_FIELDS,
+    ANALYTICS_FIELDS,
+    ANALYTICS_NUMERIC_FIELDS,
+    SPECIALISTS_FIELDS,
+    BitrixEnum,
+)
+from app_v3.database.instrumentation import query_stage
+from app_v3.database.repositories import (
+    AnalyticsRepository,
+    CosmetologyExportRepository,
+    LoadRunRepository,
+    SpecialistsRepository,
+)
+from app_v3.services.duckdb_engine import DuckDBAnalyticsEngine
+from app_v3.services.governor import MemoryGovernor
+from app_v3.services.pipeline import pipelined
+from app_v3.utils.config import app_config
 from app_v3.utils.logger import app_logger
 from app_v3.utils.reporter import reporter
 
 
+PROCESSING_CONFIG = app_config.main.get("processing") or {}
+
+# Точность и предел колонок сумм аналитик numeric(14, 2)
+AMOUNT_QUANT = Decimal("0.01")
+AMOUNT_LIMIT = Decimal(10) ** 12
+
+
 class FileProcessor:
     """Класс-процессор для обработки файлов."""
 
+    # Сигнатуры заголовков выгрузок: тип файла, обязательные колонки и число строк шапки перед заголовком
+    FILE_SIGNATURES = [
+        ("analytics", {"%Код экземпляра", "Код ОКМУ", "Состояние"}, 3),
+        ("specialists", {"Номер материала", "Дата D0"}, 2),
+        ("users", {"Рег.номер", "Дата создания"}, 2),
+    ]
+
     def __init__(self, redirect_dir: Path):
         self.bitrix_manager = BitrixManager()
         self.analytics_repository = AnalyticsRepository()
         self.specialists_repository = SpecialistsRepository()
+        self.load_run_repository = LoadRunRepository()
+        self.cosmetology_export_repository = CosmetologyExportRepository()
+        self.governor = MemoryGovernor(PROCESSING_CONFIG)
         self.redirect_dir = redirect_dir
 
     def process_yesterday_analytics(self, file):
-        """Загрузка за вчерашний день и выгрузка Косметологии."""
+        """Загрузка аналитик за вчерашний день в БД.
+
+        Выгрузка за период не всегда включает вчерашний день, а сделки Косметологии
+        выгружаются из БД (export_cosmetology), поэтому вчерашние аналитики загружаются отдельно.
+        Загрузка идет без перезаписи и повторно тех же записей не добавляет.
+        """
+
+        app_logger.info("[FPr] Загрузка аналитик за вчерашний день.")
+
+        return self.process_period_analytics(file, False)
+
+    @query_stage("Выгрузка Косметологии")
+    def export_cosmetology(self):
+        """Выгрузка в Bitrix сделок Косметологии по аналитикам из БД, еще не отмеченным в журнале выгрузки.
+
+        Аналитики отмечаются выгруженными только после создания сделки в Bitrix, поэтому аналитики,
+        не выгруженные из-за сбоя, как и загруженные задним числом, выгружаются следующим запуском.
+        Если контакт пациента не найден, аналитики сделки отмечаются неудачными, и после
+        bitrix.cosmetology.max_attempts таких попыток сделка больше не выгружается.
+        """
 
         app_logger.info("[FPr] Выгрузка Косметологии.")
 
-        df = self.get_df(file, [-1])
-        df = self.prepare_analytics_df(df)
+        max_attempts = (app_config.bitrix.get("cosmetology") or {}).get("max_attempts", 5)
+        rows = self.cosmetology_export_repository.pending(max_attempts)
+        deals = self._group_cosmetology_deals(rows)
+        amount = len(deals)
+        exported = 0
+        # Рег.номера пациентов, контакт которых не найден впервые и в последний раз
+        new_failures, given_up = {}, {}
 
-        records = self._aggregate_cosmetology_analytics(df)
-        amount = len(records)
+        msg = f"[FPr] Не выгружено аналитик Косметологии: {len(rows)}, сделок к выгрузке: {amount}"
+        app_logger.info(msg)
+        reporter.add_info(msg)
 
-        for num, record in enumerate(records, 1):
+        for num, deal_rows in enumerate(deals, 1):
             print(f"\r[FPr] Выгрузка Косметологии: {num}/{amount}", end="", flush=True)
-            self.bitrix_manager.upload_cosmetology_to_bitrix(record)
+            deal_id = self.bitrix_manager.upload_cosmetology_to_bitrix(self._merge_cosmetology_records(deal_rows))
+            reg_num = deal_rows[0]["registration_number"]
 
-        reporter.add_info(
-            f'Выгружено {amount - len(self.bitrix_manager.not_found_contacts)}/{amount} записей по Косметологии')
+            if deal_id is not None:
+                self.cosmetology_export_repository.mark_exported(deal_rows, deal_id)
+                exported += 1
+            elif reg_num in self.bitrix_manager.not_found_contacts:
+                attempts = self.cosmetology_export_repository.mark_failed(deal_rows)
 
-        if self.bitrix_manager.not_found_contacts:
-            reporter.add_info(f'Не найденные контакты: \n``` {self.bitrix_manager.not_found_contacts} ```')
+                if attempts >= max_attempts:
+                    given_up[reg_num] = None
+                elif attempts == 1:
+                    new_failures[reg_num] = None
 
         print()
 
-    def process_period_analytics(self, file, from_scratch):
-        """Загрузка с перезаписью за период."""
+        reporter.add_info(f'Выгружено {exported}/{amount} записей по Косметологии')
+
+        # Контакты, не найденные и в прошлые запуски, в отчете не повторяются
+        if new_failures:
+            reporter.add_info(f'Не найденные контакты: \n``` {list(new_failures)} ```')
+
+        if given_up:
+            reporter.add_info(
+                f'Контакты не найдены {max_attempts} раз, сделки больше не выгружаются: \n``` {list(given_up)} ```',
+            )
+
+        return exported
+
+    def process_period_analytics(self, file, from_scratch, window=None, prepared=None):
+        """Загрузка с перезаписью за период. Возвращает количество загруженных записей.
+
+        window - отрезок дат выгрузки (начало, конец), если он известен.
+        prepared - план обработки и пачки записей, уже подготовленные из файла в другом процессе.
+        Загрузка записывается в load_runs, прерванная загрузка того же файла продолжается с места остановки.
+        """
 
         app_logger.info("[FPr] Загрузка аналитик за период .")
 
+        # Этап замеров запросов назван по файлу: загрузки за вчера и за период различаются в отчете
+        with query_stage(f"Аналитики {file}"):
+            path = self.redirect_dir.joinpath(file)
+            plan, batches = prepared or (self.governor.plan(path), None)
+            run = self.load_run_repository.start(
+                "analytics",
+                path,
+                self.analytics_repository.load_mode(from_scratch),
+                from_scratch,
+                window,
+                plan,
+            )
+
+            # Пачки, подготовленные другим способом обработки, продолженному запуску не подходят
+            if run.rows_committed and (run.engine, run.chunk_size) != (plan.engine, plan.chunk_size):
+                plan = self.governor.plan(path, engine=run.engine, chunk_size=run.chunk_size)
+                batches = None
+
+            # Разбор следующих пачек идет в фоновом потоке, пока текущая записывается в БД
+            if batches is None:
+                batches = pipelined(
+                    self._iter_analytics_batches(file, plan),
+                    PROCESSING_CONFIG.get("pipeline_depth", 2),
+                    "analytics",
+                )
+
+            try:
+                loaded = self.analytics_repository.load_period(batches, from_scratch, window, run)
+            except Exception as e:
+                self.load_run_repository.fail(run, e)
+                raise
+
+            self.load_run_repository.finish(run)
+            self.analytics_repository.maintain()
+
+            app_logger.info("[FPr] Аналитики за период загружены.")
+
+            return loaded
+
+    def iter_period_analytics(self, file):
+        """План обработки выгрузки аналитик и ее подготовленные пачки - для разбора отдельно от загрузки."""
+
+        plan = self.governor.plan(self.redirect_dir.joinpath(file))
+
+        return plan, self._iter_analytics_batches(file, plan)
+
+    def _iter_analytics_batches(self, file, plan):
+        """Подготовленные записи аналитик пачками, способом обработки из плана."""
+
+        if plan.engine == "duckdb":
+            yield from self._iter_analytics_batches_duckdb(file, plan)
+            return
+
+        if plan.engine == "chunked":
+            stats = {}
+
+            for chunk in self.iter_df(file, [-1], plan.chunk_size):
+                yield self.prepare_analytics_df(chunk, stats).to_dict("records")
+
+            self._report_filter_stats(stats)
+            return
+
         df = self.get_df(file, [-1])
-        df = self.prepare_analytics_df(df)
+        records = self.prepare_analytics_df(df).to_dict("records")
+        del df
+
+        batch_size = self.analytics_repository.chunk_size
+
+        for i in range(0, len(records), batch_size):
+            yield records[i:i + batch_size]
+
+    def _iter_analytics_batches_duckdb(self, file, plan):
+        """Подготовка аналитик через DuckDB, без загрузки всего файла в память."""
 
-        # Удаляем перезаписываемые записи
-        if from_scratch:
-            instance_codes = list(df['instance_code'])
-            _filter = Analytics.instance_code.in_(instance_codes)
-            self.analytics_repository.delete_records(_filter)
+        duckdb_config = PROCESSING_CONFIG.get("duckdb", {})
 
-        records_to_insert = df.to_dict("records")
-        self.analytics_repository.bulk_upload(records_to_insert)
+        with DuckDBAnalyticsEngine(
+            self.redirect_dir.joinpath(file),
+            memory_limit=plan.memory_limit or "1GB",
+            threads=duckdb_config.get("threads"),
+            temp_directory=duckdb_config.get("temp_directory"),
+            batch_size=duckdb_config.get("batch_size", 50000),
+        ) as engine:
+            initial_count, final_count = engine.prepare()
 
-        app_logger.info("[FPr] Аналитики за период загружены.")
+            msg = f"[FPr] Отобрано {final_count}/{initial_count} записей аналитик"
+            app_logger.info(msg)
+            reporter.add_info(msg)
+
+            yield from engine.iter_records()
 
+    @query_stage("Специалисты")
     def process_specialists(self, file):
+        """Загрузка специалистов. Возвращает количество добавленных и обновленных записей."""
+
         app_logger.info("[FPr] Загрузка специалистов.")
 
         df = self.get_df(file, [], skip_rows=2)
@@ -83,11 +245,6 @@ class FileProcessor:
                 else None
             )
 
-        # Получаем список существующих записей
-        existing_numbers = set(
-            number[0] for number in
-            self.specialists_repository.all_material_numbers()
-        )
         # Обработка полей даты
         date_columns = ["date_d0"]
 
@@ -95,8 +252,42 @@ class FileProcessor:
             if col in df.columns:
                 df[col] = df[col].apply(self._parse_date)
 
-        # Фильтруем только новые записи
         df = df.dropna(subset=["material_number"])
+
+        if self.specialists_repository.merge_enabled:
+            # Слияние в БД: новые номера добавляются, изменившиеся записи обновляются
+            df = df.replace({pd.NaT: ""})
+            df = df.map(lambda x: "" if x is pd.NaT else x)
+            records = df.to_dict("records")
+
+            inserted, updated = self.specialists_repository.merge(records)
+            final_count = inserted + updated
+
+            msg = (
+                f"[FPr] Специалисты: добавлено {inserted}, обновлено {updated}, "
+                f"без изменений {len(records) - final_count} из {initial_count}"
+            )
+            app_logger.info(msg)
+            reporter.add_info(msg)
+        else:
+            final_count = self._insert_new_specialists(df, initial_count)
+
+        self.specialists_repository.maintain()
+
+        app_logger.info("[FPr] Специалисты загружены.")
+
+        return final_count
+
+    def _insert_new_specialists(self, df, initial_count):
+        """Загрузка только специалистов с номерами материала, которых еще нет в БД."""
+
+        # Получаем список существующих записей
+        existing_numbers = set(
+            number[0] for number in
+            self.specialists_repository.all_material_numbers()
+        )
+
+        # Фильтруем только новые записи
         new_records = df[~df["material_number"].isin(existing_numbers)]
 
         final_count = len(new_records)
@@ -115,8 +306,9 @@ class FileProcessor:
 
             self.specialists_repository.bulk_upload(records_to_insert)
 
-        app_logger.info("[FPr] Специалисты загружены.")
+        return final_count
 
+    @query_stage("Пациенты")
     def process_users(self, file):
         app_logger.info("[FPr] Загрузка пациентов.")
 
@@ -165,25 +357,33 @@ class FileProcessor:
             app_logger.info(f"[FPr] {msg}")
             reporter.add_info(msg)
 
-    def prepare_analytics_df(self, df):
-        """Обработка дата-фрейма аналитик. Фильтры, группировки, исключения."""
+    def prepare_analytics_df(self, df, stats=None):
+        """Обработка дата-фрейма аналитик. Фильтры, группировки, исключения.
+
+        Если передан stats, счетчики фильтрации накапливаются в нем, а не отправляются в отчет -
+        так обрабатываются чанки одного файла.
+        """
+
+        report = stats is None
+        stats = {} if report else stats
 
         initial_count = df.shape[0]
+        df.columns = df.columns.str.strip()
+
+        # Фильтры считаются одной маской, записи отбираются за один проход
+        mask = self._filter_mask([
+            ("тестовых пациентов", df["Категория пациента"] != "Тестовый пациент"),
+            ("служебных услуг", ~df["Код ОКМУ"].str.startswith("Q", na=False)),
+            ("записей с неактуальными статусами", df["Состояние"].isin(["выполнено", "авторизован"])),
+        ], stats)
 
-        df = df[df["Категория пациента"] != "Тестовый пациент"]
         # Выбор и переименование колонок
-        columns_to_keep = [col for col in [col.strip() for col in df.columns] if col in ANALYTICS_FIELDS]
+        columns_to_keep = [col for col in df.columns if col in ANALYTICS_FIELDS]
 
-        df.columns = df.columns.str.strip()
-        df = df[columns_to_keep]
+        df = df.loc[mask, columns_to_keep]
         df = df.rename(columns=ANALYTICS_FIELDS)
         df = df.where(pd.notna(df), None)
 
-        # Фильтрация служебных услуг
-        df = df[~df['okmu_code'].str.startswith('Q', na=False)]
-        # Фильтрация по статусу
-        df = df[df["status"].isin(["выполнено", "авторизован"])]
-
         # Обработка поля age - извлекаем только цифры
         if "age" in df.columns:
             df["age"] = df["age"].apply(
@@ -196,52 +396,96 @@ class FileProcessor:
         if "total_amount" in df.columns:
             df["total_amount"] = df["total_amount"].apply(lambda x: x if x != "-" else None)
 
-        # Обработка полей даты
-        date_columns = ["date", "birth_date"]
+        df = df.replace({pd.NaT: ""})
+        df = df.map(lambda x: "" if x is pd.NaT else x)
 
-        for col in date_columns:
+        # Типизированные колонки: пустые и нераспознанные значения - NULL, а не пустые строки
+        if "age" in df.columns:
+            df["age"] = self._as_object([None if x == "" or pd.isna(x) else int(x) for x in df["age"]], df.index)
+
+        for col in ANALYTICS_NUMERIC_FIELDS:
             if col in df.columns:
-                df[col] = df[col].apply(self._parse_date)
+                df[col] = self._as_object(self._parse_numbers(df[col]), df.index)
 
-        df = df.replace({pd.NaT: ""})
-        df = df.map(lambda x: "" if x is pd.NaT else x)
+        for col in ANALYTICS_DATE_FIELDS:
+            if col in df.columns:
+                df[col] = self._as_object(self._parse_dates(df[col]), df.index)
+
+        # Дата выполнения - ключ секционирования
+        if "appointment_date" in df.columns:
+            df["execution_date"] = df["appointment_date"]
+
+        # Код экземпляра уникален в пределах даты выполнения - из повторов остается последняя запись
+        if "instance_code" in df.columns and "execution_date" in df.columns:
+            duplicated = (
+                df.duplicated(subset=["instance_code", "execution_date"], keep="last")
+                & (df["instance_code"] != "")
+                & df["execution_date"].notna()
+            )
+            skipped_by_rule = stats.setdefault("skipped", {})
+            skipped_by_rule["повторов кодов экземпляров"] = (
+                skipped_by_rule.get("повторов кодов экземпляров", 0) + int(duplicated.sum())
+            )
+            df = df[~duplicated]
 
-        final_count = df.shape[0]
-        msg = f"[FPr] Отобрано {final_count}/{initial_count} записей аналитик"
-        app_logger.info(msg)
-        reporter.add_info(msg)
+        stats["initial"] = stats.get("initial", 0) + initial_count
+        stats["final"] = stats.get("final", 0) + df.shape[0]
+
+        if report:
+            self._report_filter_stats(stats)
 
         return df
     
-    def _aggregate_cosmetology_analytics(self, df):
-        """Агрегация суммы по аналитикам и подготовка для выгрузки в битрикс."""
+    @staticmethod
+    def _filter_mask(rules, stats):
+        """Объединение правил фильтрации в одну маску.
 
-        records = []
-        records_map = defaultdict(list)
-        initial_count = df.shape[0]
+        Args:
+            rules: Список пар (описание, маска остающихся записей) в порядке применения
+            stats: Счетчики, в которые добавляется число отброшенных каждым правилом записей
 
-        df = (
-            df
-            [df["admission_type"] == "КОСМЕТОЛОГИЯ"]
-            [df["department_execution"] == "ХГМ КОСМ АМБ"]
-            [ANALYTICS_TO_BITRIX.values()]
-        )
-        df["total_amount"] = df["total_amount"].astype(float)
-        
-        raw_records = df.to_dict("records")
-        
-        for record in raw_records:
-            records_map[f"'{record['registration_number']}{record['specialist_execution']}'"].append(record)
-            
-        for records_list in records_map.values():
-            records.append(self._merge_cosmetology_records(records_list))
-
-        msg = f"[FPr] Отобрано {len(records)}/{initial_count} записей аналитик Косметологии для выгрузки в Bitrix"
+        Returns:
+            pd.Series: Итоговая маска
+        """
+
+        mask = None
+        skipped_by_rule = stats.setdefault("skipped", {})
+
+        for description, rule_mask in rules:
+            if mask is None:
+                skipped = int((~rule_mask).sum())
+                mask = rule_mask
+            else:
+                skipped = int((mask & ~rule_mask).sum())
+                mask = mask & rule_mask
+
+            skipped_by_rule[description] = skipped_by_rule.get(description, 0) + skipped
+
+        return mask
+
+    @staticmethod
+    def _report_filter_stats(stats):
+        """Логирование и отправка в отчет счетчиков фильтрации аналитик."""
+
+        for description, skipped in stats.get("skipped", {}).items():
+            if skipped > 0:
+                app_logger.info(f"[FPr] Пропущено {description}: {skipped}")
+
+        msg = f"[FPr] Отобрано {stats.get('final', 0)}/{stats.get('initial', 0)} записей аналитик"
         app_logger.info(msg)
         reporter.add_info(msg)
 
-        return records
-    
+    @staticmethod
+    def _group_cosmetology_deals(rows):
+        """Аналитики Косметологии по сделкам: одна сделка на пациента, специалиста и дату выполнения."""
+
+        deals = defaultdict(list)
+
+        for row in rows:
+            deals[(row["registration_number"], row["specialist_execution"], row["execution_date"])].append(row)
+
+        return list(deals.values())
+
     def _merge_cosmetology_records(self, records):
         """Объединение данных для выгрузки в косметологию."""
 
@@ -255,11 +499,64 @@ class FileProcessor:
                 BitrixEnum.SPEC_EXECUTION: record['specialist_execution'],
                 BitrixEnum.PHYS_DEPARTMENT: record['physician_department'],
                 BitrixEnum.APPOINTMENT_DATE: self._modify_date_format(appointment_date) if appointment_date else None,
-                BitrixEnum.TOTAL_AMOUNT: result.get(BitrixEnum.TOTAL_AMOUNT, 0) + record['total_amount'],
+                BitrixEnum.TOTAL_AMOUNT: result.get(BitrixEnum.TOTAL_AMOUNT, 0) + float(record['total_amount'] or 0),
             })
 
         return result
 
+    def classify_file(self, file):
+        """Определение типа выгрузки по заголовку файла, а не по имени.
+
+        Returns:
+            str | None: analytics, specialists, users или None, если формат не распознан
+        """
+
+        path = self.redirect_dir.joinpath(file)
+
+        with open(path, "r", encoding="cp1251", errors="replace") as f:
+            head = [f.readline() for _ in range(10)]
+
+        for kind, required, skip_rows in self.FILE_SIGNATURES:
+            for num, line in enumerate(head):
+                columns = {column.strip().strip('"') for column in line.split(";")}
+
+                if required <= columns:
+                    if num != skip_rows:
+                        app_logger.warning(f"[FPr] {file}: заголовок на строке {num + 1}, ожидалась {skip_rows + 1}")
+                        return None
+
+                    return kind
+
+        return None
+
+    def iter_df(self, file, bottom_drops, chunk_size, skip_rows=3):
+        """Чтение выгрузки чанками. Строки из bottom_drops отбрасываются в последнем чанке.
+
+        Все значения читаются как текст, чтобы типы колонок не зависели от содержимого чанка.
+        """
+
+        path = self.redirect_dir.joinpath(file)
+        reader = pd.read_csv(
+            path,
+            skiprows=skip_rows,
+            encoding='cp1251',
+            delimiter=';',
+            dtype=str,
+            chunksize=chunk_size,
+        )
+        previous = None
+
+        for chunk in reader:
+            if previous is not None:
+                yield previous
+
+            previous = chunk
+
+        if previous is not None:
+            indices_to_drop = [previous.index[i] for i in bottom_drops if len(previous) >= abs(i)]
+
+            yield previous.drop(indices_to_drop)
+
     def get_df(self, file, bottom_drops, skip_rows=3):
         path = self.redirect_dir.joinpath(file)
         df = pd.read_csv(
@@ -284,8 +581,54 @@ class FileProcessor:
         else:
             return None
 
+    @staticmethod
+    def _parse_dates(dates):
+        """Разбор дат формата dd.mm.yyyy или dd.mm.yy в datetime.date, нераспознанные - None."""
+
+        parsed = pd.to_datetime(dates, format="%d.%m.%Y", errors="coerce")
+        parsed = parsed.fillna(pd.to_datetime(dates, format="%d.%m.%y", errors="coerce"))
+
+        return [None if pd.isna(value) else value.date() for value in parsed]
+
+    @staticmethod
+    def _parse_numbers(numbers):
+        """Разбор сумм с пробелами-разделителями разрядов и десятичной запятой, нераспознанные - None."""
+
+        cleaned = (
+            numbers.astype(str)
+            .str.replace("\xa0", "", regex=False)
+            .str.replace(" ", "", regex=False)
+            .str.replace(",", ".", regex=False)
+        )
+
+        return [FileProcessor._parse_amount(value) for value in cleaned]
+
+    @staticmethod
+    def _parse_amount(value):
+        """Сумма как Decimal с двумя знаками, как в колонке numeric(14, 2) и в DuckDB-обработке.
+
+        Через float суммы не разбираются: иначе копейки приходят с двоичной погрешностью.
+        Не помещающиеся в колонку суммы, как и нераспознанные, - None.
+        """
+
+        try:
+            amount = Decimal(value).quantize(AMOUNT_QUANT, rounding=ROUND_HALF_UP)
+        except (InvalidOperation, ValueError):
+            return None
+
+        return amount if amount.is_finite() and abs(amount) < AMOUNT_LIMIT else None
+
+    @staticmethod
+    def _as_object(values, index):
+        """Колонка с None вместо NaN: иначе pandas приведет целые и числа с пропусками к float с NaN."""
+
+        return pd.Series(values, index=index, dtype=object)
+
     @staticmethod
     def _modify_date_format(_date):
+        if isinstance(_date, datetime.date):
+            return datetime.datetime(_date.year, _date.month, _date.day).strftime('%d.%m.%Y %H:%M:%S')
+
         try:
             _date = datetime.datetime.strptime(_date, '%d.%m.%y')
         except ValueError:
@@ -0,0 +1,103 @@
+import os
+
+from typing import NamedTuple, Optional
+
+import psutil
+
+from app_v3.utils.logger import app_logger
+
+
+class ProcessingPlan(NamedTuple):
+    """Выбранный способ обработки выгрузки."""
+
+    engine: str
+    chunk_size: Optional[int]
+    spill: bool
+    memory_limit: Optional[str]
+
+
+class MemoryGovernor:
+    """Выбор движка, размера чанка и выгрузки на диск по размеру файла и свободной памяти.
+
+    pandas - весь файл в памяти, быстрее всего для небольших выгрузок.
+    chunked - потоковое чтение pandas чанками, если DataFrame целиком не помещается в бюджет.
+    duckdb - out-of-core обработка с выгрузкой на диск, если в бюджет не помещается даже сам CSV.
+    """
+
+    ENGINES = ("pandas", "chunked", "duckdb")
+
+    MIN_CHUNK_SIZE = 10000
+    MAX_CHUNK_SIZE = 500000
+
+    def __init__(self, config=None):
+        config = config or {}
+
+        self.engine = config.get("engine", "auto")
+        # Доля свободной памяти, которую можно занять обработкой
+        self.budget_share = config.get("memory_budget_share", 0.5)
+        # Во сколько раз DataFrame с object-колонками больше CSV на диске
+        self.expansion = config.get("pandas_expansion", 8)
+        self.chunk_size = config.get("chunk_size")
+        self.memory_limit = config.get("duckdb", {}).get("memory_limit")
+
+    def plan(self, path, skip_rows=3, engine=None, chunk_size=None):
+        """Выбор способа обработки файла.
+
+        Переданные engine и chunk_size (способ обработки продолжаемого запуска загрузки) имеют приоритет
+        над заданными в конфиге, а заданные в конфиге - над выбором по памяти.
+        """
+
+        file_size = os.path.getsize(path)
+        available = psutil.virtual_memory().available
+        budget = int(available * self.budget_share)
+        estimated = file_size * self.expansion
+
+        if engine in self.ENGINES:
+            reason = "как в продолжаемом запуске"
+        elif self.engine in self.ENGINES:
+            engine = self.engine
+            reason = "задан в конфиге"
+        elif estimated <= budget:
+            engine = "pandas"
+            reason = "DataFrame помещается в бюджет памяти"
+        elif file_size <= budget:
+            engine = "chunked"
+            reason = "DataFrame не помещается в бюджет, читаем чанками"
+        else:
+            engine = "duckdb"
+            reason = "файл больше бюджета памяти, обработка с выгрузкой на диск"
+
+        memory_limit = None
+
+        if engine == "chunked":
+            chunk_size = chunk_size or self.chunk_size or self._fit_chunk_size(path, skip_rows, budget)
+        else:
+            chunk_size = None
+
+        if engine == "duckdb":
+            memory_limit = self.memory_limit or f"{max(budget // 2 ** 20, 256)}MB"
+
+        plan = ProcessingPlan(engine, chunk_size, engine == "duckdb", memory_limit)
+
+        app_logger.info(
+            f"[Gov] {os.path.basename(path)}: {file_size / 2 ** 20:.1f} МБ, свободно {available / 2 ** 20:.0f} МБ, "
+            f"бюджет {budget / 2 ** 20:.0f} МБ -> {plan.engine} ({reason}), чанк {plan.chunk_size}, "
+            f"выгрузка на диск: {'да' if plan.spill else 'нет'}",
+        )
+
+        return plan
+
+    def _fit_chunk_size(self, path, skip_rows, budget):
+        """Количество строк, DataFrame из которых займет не больше четверти бюджета."""
+
+        with open(path, "rb") as f:
+            for _ in range(skip_rows + 1):
+                f.readline()
+
+            sample = f.read(1024 * 1024)
+
+        lines = sample.count(b"\n") or 1
+        row_bytes = max(len(sample) / lines, 1)
+        chunk_size = int(budget / 4 / (row_bytes * self.expansion))
+
+        return min(max(chunk_size, self.MIN_CHUNK_SIZE), self.MAX_CHUNK_SIZE)
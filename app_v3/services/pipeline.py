@@ -0,0 +1,111 @@
+import queue
+import threading
+import time
+
+from app_v3.utils.logger import app_logger
+
+
+class _Failure:
+    """Исключение, возникшее в потоке-производителе, для передачи потребителю."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+class BatchPipeline:
+    """Конвейер пачек: разбор выгрузки в фоновом потоке, запись в БД в вызывающем.
+
+    Поток-производитель перебирает исходный генератор пачек и складывает их в ограниченную очередь,
+    потребитель забирает пачки итерированием по конвейеру. Пока БД фиксирует одну пачку,
+    следующая уже разбирается, и общее время стремится к большему из времен разбора и записи,
+    а не к их сумме. Заполненная очередь останавливает производителя, поэтому в памяти
+    одновременно не больше depth готовых пачек.
+
+    Исключение производителя пробрасывается потребителю, а при ошибке или остановке потребителя
+    производитель прекращает разбор и закрывает исходный генератор в своем потоке.
+    """
+
+    _DONE = object()
+    # Период проверки флага остановки при ожидании места в очереди
+    _POLL_INTERVAL = 0.5
+
+    def __init__(self, batches, depth=2, name="batches"):
+        self.batches = batches
+        self.depth = depth
+        self.name = name
+
+        self.queue = queue.Queue(maxsize=depth)
+        self.stop = threading.Event()
+        # Время ожидания места в очереди (запись не успевает) и ожидания пачки (разбор не успевает)
+        self.producer_wait = 0.0
+        self.consumer_wait = 0.0
+
+    def __iter__(self):
+        thread = threading.Thread(target=self._produce, name=f"pipeline-{self.name}", daemon=True)
+        thread.start()
+        start = time.monotonic()
+        count = 0
+
+        try:
+            while True:
+                wait_start = time.monotonic()
+                item = self.queue.get()
+                self.consumer_wait += time.monotonic() - wait_start
+
+                if item is self._DONE:
+                    break
+
+                if isinstance(item, _Failure):
+                    raise item.error
+
+                count += 1
+                yield item
+        finally:
+            self.stop.set()
+            thread.join()
+
+        app_logger.info(
+            f"[Pipe] {self.name}: {count} пачек за {time.monotonic() - start:.1f} с, "
+            f"ожидание записи {self.producer_wait:.1f} с, ожидание разбора {self.consumer_wait:.1f} с",
+        )
+
+    def _produce(self):
+        try:
+            for batch in self.batches:
+                if not self._put(batch):
+                    return
+
+            self._put(self._DONE)
+        except BaseException as e:
+            self._put(_Failure(e))
+        finally:
+            close = getattr(self.batches, "close", None)
+
+            if close is not None:
+                close()
+
+    def _put(self, item):
+        """Помещение в очередь с ожиданием места. False - потребитель остановился."""
+
+        wait_start = time.monotonic()
+
+        try:
+            while not self.stop.is_set():
+                try:
+                    self.queue.put(item, timeout=self._POLL_INTERVAL)
+                    return True
+                except queue.Full:
+                    continue
+
+            return False
+        finally:
+            self.producer_wait += time.monotonic() - wait_start
+
+
+def pipelined(batches, depth, name="batches"):
+    """Пачки через фоновый конвейер глубины depth. При depth 0 - исходный генератор без потока."""
+
+    if not depth:
+        return batches
+
+    return BatchPipeline(batches, depth, name)
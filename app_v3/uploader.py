@@ -16,12 +16,16 @@ MAIN_CONFIG = app_config.main
 class Orchestrator:
     """Класс, объединяющий все необходимые для загрузки и обработки файлов менеджеры, сервисы и службы."""
 
-    def __init__(self):
+    def __init__(self, db_ready=None):
         self.browser_manager = BrowserManager()
         self.file_processor = FileProcessor(self.browser_manager.redirect_dir)
+        # Фоновая подготовка БД, которую нужно дождаться перед обработкой файлов
+        self.db_ready = db_ready
 
         # Флаги
         self.from_scratch = True
+        # Отрезок дат выгрузки аналитик за период
+        self.period_window = None
 
         # Файлы
         self.yesterday_analytics_file = None
@@ -84,9 +88,17 @@ class Orchestrator:
             app_logger.info("[Orch] Начало обработки загруженных данных.")
             app_logger.info("=" * 60)
 
+            if self.db_ready is not None:
+                self.db_ready.result()
+
             self.file_processor.process_users(self.users_file)
             self.file_processor.process_yesterday_analytics(self.yesterday_analytics_file)
-            self.file_processor.process_period_analytics(self.period_analytics_file, self.from_scratch)
+            self.file_processor.process_period_analytics(
+                self.period_analytics_file,
+                self.from_scratch,
+                self.period_window,
+            )
+            self.file_processor.export_cosmetology()
             self.file_processor.process_specialists(self.specialists_file)
 
             await asyncio.sleep(10)
@@ -138,17 +150,20 @@ class Orchestrator:
                 choices = action["choices"]
 
                 if today == self.from_scratch_dates["year_first_day"]:
-                    action["text_to_search"] = choices["last_year"]
+                    choice = "last_year"
                 elif today in self.from_scratch_dates["quarters_first_days"]:
-                    action["text_to_search"] = choices[self.quarters_first_days[today]]
+                    choice = self.quarters_first_days[today]
                 elif today in self.from_scratch_dates["months_first_week_days"]:
-                    action["text_to_search"] = choices["last_month"]
+                    choice = "last_month"
                 elif today in self.from_scratch_dates["mondays"]:
-                    action["text_to_search"] = choices["last_week"]
+                    choice = "last_week"
                 else:
-                    action["text_to_search"] = choices["yesterday"]
+                    choice = "yesterday"
                     self.from_scratch = False
 
+                action["text_to_search"] = choices[choice]
+                self.period_window = self._period_window(choice, today.date())
+
             await self.browser_manager.click(action)
 
         await self.browser_manager.await_for_download()
@@ -189,6 +204,32 @@ class Orchestrator:
         for action in MAIN_CONFIG["specialists_after_upload_actions"]:
             await self.browser_manager.click(action)
 
+    @staticmethod
+    def _period_window(choice, today):
+        """Отрезок дат (начало, конец), который выгружается при выборе периода."""
+
+        yesterday = today - datetime.timedelta(days=1)
+
+        if choice == "last_year":
+            return datetime.date(today.year - 1, 1, 1), datetime.date(today.year - 1, 12, 31)
+
+        if choice in ("quarter_one", "quarter_two", "quarter_three"):
+            quarter = ("quarter_one", "quarter_two", "quarter_three").index(choice)
+            start = datetime.date(today.year, quarter * 3 + 1, 1)
+            end = datetime.date(today.year, quarter * 3 + 4, 1) - datetime.timedelta(days=1)
+
+            return start, end
+
+        if choice == "last_month":
+            end = today.replace(day=1) - datetime.timedelta(days=1)
+
+            return end.replace(day=1), end
+
+        if choice == "last_week":
+            return today - datetime.timedelta(days=7), yesterday
+
+        return yesterday, yesterday
+
     def _fill_from_scratches_dates(self):
         """Подготовка словаря дат для определения периода перезаписи аналитик."""
 